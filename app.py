@@ -2,14 +2,45 @@ import os
 import time
 import sqlite3
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, send_from_directory, abort, make_response, g
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 import io
 import random
+import json
+import math
+import gzip
+import zlib
+import mimetypes
+import hmac
+import ipaddress
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
+from concurrent.futures import ThreadPoolExecutor
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from werkzeug.utils import secure_filename
+from jinja2 import FileSystemBytecodeCache
+import click
+import sql_grader
+import storage
+
+# Optional: brotli compression of static assets and responses
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional: Pillow for downscaling and re-encoding question images
+try:
+    from PIL import Image, ImageOps, features
+    IMAGE_WEBP_SUPPORTED = features.check('webp')
+except ImportError:
+    Image = None
+    IMAGE_WEBP_SUPPORTED = False
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
@@ -17,6 +48,12 @@ app.secret_key = secrets.token_hex(16)
 # Add chr function to Jinja2 environment
 app.jinja_env.globals.update(chr=chr)
 
+# Compiled templates are kept on disk, so a restarted server (or each new
+# worker process) skips parsing and compiling them again
+TEMPLATE_CACHE_DIR = os.environ.get('EXAM_TEMPLATE_CACHE', os.path.join('.cache', 'jinja'))
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
 # Function to get real IP address (handles X-Forwarded-For for testing)
 
 
@@ -30,12 +67,52 @@ def get_real_ip():
     return request.remote_addr
 
 
-# Database setup
-DATABASE_PATH = 'database/exam_system.db'
+# Database setup (EXAM_DATABASE_PATH lets test and replay instances use their own file)
+DATABASE_PATH = os.environ.get('EXAM_DATABASE_PATH', 'database/exam_system.db')
+
+# Background database maintenance (statistics, WAL checkpoints); see
+# "Database maintenance" below. EXAM_DB_MAINTENANCE=0 leaves it to SQLite.
+DB_MAINTENANCE_ENABLED = os.environ.get('EXAM_DB_MAINTENANCE', '1') != '0'
+WAL_AUTOCHECKPOINT_PAGES = 8192    # SQLite's default is 1000
+
+# Stored answers
+#
+# Every auto-save stores all answers again, both per question and as the
+# combined code. Answers of at least ANSWER_COMPRESSION_MIN_SIZE bytes are
+# stored as zlib-compressed BLOBs that start with ANSWER_COMPRESSION_MARKER;
+# the row factory of get_db_connection decompresses them on read, so code
+# reading answers always sees text.
+ANSWER_COMPRESSION_MIN_SIZE = int(os.environ.get('EXAM_ANSWER_COMPRESSION_MIN_SIZE', 512))
+ANSWER_COMPRESSION_LEVEL = 6
+ANSWER_COMPRESSION_MARKER = b'zlib:'
+
+
+def compress_answer(text):
+    """Stored form of an answer: compressed if that pays off, else the text"""
+    if not isinstance(text, str) or len(text) < ANSWER_COMPRESSION_MIN_SIZE:
+        return text
+    encoded = text.encode('utf-8')
+    compressed = ANSWER_COMPRESSION_MARKER + \
+        zlib.compress(encoded, ANSWER_COMPRESSION_LEVEL)
+    return compressed if len(compressed) < len(encoded) else text
+
+
+def decompress_answer(value):
+    """Text of a stored answer, whether it was compressed or not"""
+    if isinstance(value, bytes) and value.startswith(ANSWER_COMPRESSION_MARKER):
+        return zlib.decompress(value[len(ANSWER_COMPRESSION_MARKER):]).decode('utf-8')
+    return value
+
+
+def answer_row(cursor, values):
+    """sqlite3.Row factory that decompresses stored answers"""
+    if bytes in map(type, values):
+        values = tuple(decompress_answer(value) for value in values)
+    return sqlite3.Row(cursor, values)
 
 
 # Database connection helper with retry mechanism
-def get_db_connection(timeout=20, max_retries=5):
+def get_db_connection(timeout=20, max_retries=5, path=None):
     """
     Gets a SQLite connection with a configurable timeout and retry mechanism 
     to handle database locks.
@@ -43,6 +120,8 @@ def get_db_connection(timeout=20, max_retries=5):
     Args:
         timeout (int): Timeout in seconds for acquiring a database lock
         max_retries (int): Maximum number of retries when database is locked
+        path (str): Database file to open instead of the exam database,
+            such as an exam shard
 
     Returns:
         sqlite3.Connection: Database connection object
@@ -51,8 +130,14 @@ def get_db_connection(timeout=20, max_retries=5):
     while retry_count < max_retries:
         try:
             # Set timeout for acquiring locks and enable row factory for named access
-            conn = sqlite3.connect(DATABASE_PATH, timeout=timeout)
-            conn.row_factory = sqlite3.Row
+            conn = sqlite3.connect(path or DATABASE_PATH, timeout=timeout)
+            conn.row_factory = answer_row
+            if DB_MAINTENANCE_ENABLED and not path:
+                # Checkpoints run in the maintenance thread, not in whichever
+                # request happens to commit when the WAL is full; requests only
+                # checkpoint if it falls far behind. Exam shards keep SQLite's
+                # automatic checkpoints.
+                conn.execute(f"PRAGMA wal_autocheckpoint = {WAL_AUTOCHECKPOINT_PAGES}")
             return conn
         except sqlite3.OperationalError as e:
             if "database is locked" in str(e) and retry_count < max_retries - 1:
@@ -69,11 +154,56 @@ def get_db_connection(timeout=20, max_retries=5):
         "Failed to acquire database lock after multiple retries")
 
 
+def get_read_connection(timeout=20, snapshot=False, path=None):
+    """
+    Gets a read-only SQLite connection for teacher reporting. It never takes
+    the write lock, so a long report neither waits for nor holds up students'
+    auto-saves.
+
+    Args:
+        timeout (int): Timeout in seconds for acquiring a database lock
+        snapshot (bool): Read the reporting snapshot instead, when one is kept
+        path (str): Database file to open instead, such as an exam shard
+
+    Returns:
+        sqlite3.Connection: Read-only database connection object
+    """
+    path = path or (snapshot and _reporting_snapshot) or DATABASE_PATH
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro",
+                           uri=True, timeout=timeout)
+    conn.row_factory = answer_row
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def add_missing_columns(cursor, table, columns):
+    """Add any of `columns` (name -> definition) that `table` does not have yet"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row['name'] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(
+                f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
 def init_db():
     """Initialize database with required tables"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
+        # The autosave compactor hands freed pages back with incremental
+        # vacuum. A new database starts in that mode; converting an existing
+        # one rewrites the whole file, so it is left to convert-auto-vacuum
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        elif cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("The database does not release freed pages; run "
+                  "`flask --app app convert-auto-vacuum` while the server is stopped")
+
+        # Write-ahead logging: auto-saves and page loads do not block each other
+        cursor.execute("PRAGMA journal_mode = WAL")
+
         # Create users table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -114,6 +244,10 @@ def init_db():
             model_id INTEGER,
             question_text TEXT NOT NULL,
             image_filename TEXT,
+            dataset_sql TEXT,
+            expected_query TEXT,
+            order_sensitive BOOLEAN DEFAULT 0,
+            points REAL DEFAULT 1,
             FOREIGN KEY (exam_id) REFERENCES exams (id),
             FOREIGN KEY (model_id) REFERENCES exam_models (id)
         )
@@ -145,6 +279,8 @@ def init_db():
             submission_id INTEGER,
             question_id INTEGER,
             answer_content TEXT,
+            check_status TEXT,
+            check_error TEXT,
             FOREIGN KEY (submission_id) REFERENCES submissions (id),
             FOREIGN KEY (question_id) REFERENCES questions (id)
         )
@@ -191,6 +327,70 @@ def init_db():
         )
         ''')
 
+        # Create auto_grades table for the SQL auto-grader's suggested marks
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS auto_grades (
+            id INTEGER PRIMARY KEY,
+            submission_id INTEGER,
+            question_id INTEGER,
+            status TEXT,
+            detail TEXT,
+            suggested_mark REAL,
+            graded_at TIMESTAMP,
+            UNIQUE (submission_id, question_id),
+            FOREIGN KEY (submission_id) REFERENCES submissions (id),
+            FOREIGN KEY (question_id) REFERENCES questions (id)
+        )
+        ''')
+
+        # Create autograde_cache table: one outcome per distinct answer, keyed by
+        # the question's reference version and the normalised answer's hash
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS autograde_cache (
+            question_id INTEGER NOT NULL,
+            reference_hash TEXT NOT NULL,
+            answer_hash TEXT NOT NULL,
+            status TEXT,
+            detail TEXT,
+            PRIMARY KEY (question_id, reference_hash, answer_hash),
+            FOREIGN KEY (question_id) REFERENCES questions (id)
+        )
+        ''')
+
+        # Add columns introduced after the first release to existing databases
+        add_missing_columns(cursor, 'questions', {
+            'dataset_sql': 'TEXT',
+            'expected_query': 'TEXT',
+            'order_sensitive': 'BOOLEAN DEFAULT 0',
+            'points': 'REAL DEFAULT 1'
+        })
+        add_missing_columns(cursor, 'question_answers', {
+            'check_status': 'TEXT',
+            'check_error': 'TEXT'
+        })
+        add_missing_columns(cursor, 'submissions', {
+            'is_final': 'BOOLEAN DEFAULT 0'
+        })
+        add_missing_columns(cursor, 'exams', {
+            'archive_path': 'TEXT',
+            'shard_path': 'TEXT',
+            'access_code': 'TEXT',
+            'ip_ranges': 'TEXT'
+        })
+
+        # Image garbage collection counts references to each upload
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_questions_image ON questions (image_filename)")
+
+        # Auto-saves look up the student's last version, and the autosave
+        # compactor ranks each student's versions
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_submissions_student ON submissions (student_number, exam_id, model_id, version)")
+
+        # Grading pages and the answer checker look answers up by submission
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_question_answers_submission ON question_answers (submission_id)")
+
         # Insert default teacher account if not exists
         cursor.execute("SELECT * FROM users WHERE username = 'teacher'")
         if not cursor.fetchone():
@@ -203,10 +403,1374 @@ def init_db():
         conn.commit()
 
 
+def compress_stored_answers(batch_size=500):
+    """
+    Compress answers saved as plain text before answer compression (or under
+    a higher threshold), a batch per transaction so auto-saves are never kept
+    waiting. Answers that are already compressed are left alone.
+
+    Returns:
+        int: Bytes of answer storage reclaimed
+    """
+    compressed_rows = reclaimed = 0
+    for table, column in (('question_answers', 'answer_content'),
+                          ('submissions', 'code_content')):
+        last_id = 0
+        while True:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT id, {column} AS content FROM {table}
+                    WHERE id > ? AND typeof({column}) = 'text'
+                      AND length(CAST({column} AS BLOB)) >= ?
+                    ORDER BY id LIMIT ?
+                    """, (last_id, ANSWER_COMPRESSION_MIN_SIZE, batch_size))
+                batch = cursor.fetchall()
+                if not batch:
+                    break
+
+                updates = []
+                for row in batch:
+                    stored = compress_answer(row['content'])
+                    if isinstance(stored, bytes):
+                        updates.append((stored, row['id']))
+                        reclaimed += len(row['content'].encode('utf-8')) - len(stored)
+                cursor.executemany(
+                    f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                conn.commit()
+                compressed_rows += len(updates)
+                last_id = batch[-1]['id']
+
+    if compressed_rows:
+        print(f"Compressed {compressed_rows} stored answers, "
+              f"reclaiming {reclaimed / 1024:.0f} KB for new saves")
+    return reclaimed
+
+
 # Ensure database directory exists
-os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
 init_db()
 
+
+# Storage backend
+#
+# Exam sessions, submissions, answers, grades and IP policies are read and
+# written through `records` (see storage.py). EXAM_STORAGE=postgresql keeps
+# them in the PostgreSQL database at EXAM_POSTGRES_DSN instead, through a pool
+# of EXAM_POSTGRES_POOL_MIN to EXAM_POSTGRES_POOL_MAX connections that a
+# request waits up to EXAM_POSTGRES_POOL_TIMEOUT seconds for. Users, exams and
+# questions stay in the SQLite database either way. Answer compression, the
+# autosave compactor and archiving work on the SQLite tables, so they are only
+# available with the default EXAM_STORAGE=sqlite.
+STORAGE_BACKEND = os.environ.get('EXAM_STORAGE', 'sqlite')
+POSTGRES_DSN = os.environ.get('EXAM_POSTGRES_DSN', 'dbname=exam_system')
+POSTGRES_POOL_MIN = int(os.environ.get('EXAM_POSTGRES_POOL_MIN', 2))
+POSTGRES_POOL_MAX = int(os.environ.get('EXAM_POSTGRES_POOL_MAX', 20))
+POSTGRES_POOL_TIMEOUT = float(os.environ.get('EXAM_POSTGRES_POOL_TIMEOUT', 10))
+
+if STORAGE_BACKEND not in storage.BACKENDS:
+    raise RuntimeError(
+        f"EXAM_STORAGE must be one of: {', '.join(storage.BACKENDS)}")
+
+if STORAGE_BACKEND == 'postgresql':
+    # The pool is opened on first use, or by start_background_jobs()
+    records = storage.PostgresStorage(
+        POSTGRES_DSN, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT)
+else:
+    records = storage.SQLiteStorage(
+        get_db_connection, get_read_connection, compress_answer)
+
+# A busy database, either the SQLite one or the storage backend's: worth a retry
+DATABASE_BUSY_ERRORS = (sqlite3.OperationalError,) + tuple(records.busy_errors)
+
+
+# Traffic capture
+#
+# When EXAM_TRAFFIC_LOG is set, every request is appended to that file as one
+# compact JSON line (route, timing, payload sizes, session identity) so an exam
+# day can be replayed later with replay_traffic.py. Answer contents are never
+# written, only their sizes. Identities and IP addresses are replaced by keyed
+# hashes unless EXAM_TRAFFIC_LOG_ANONYMISE=0.
+TRAFFIC_LOG_PATH = os.environ.get('EXAM_TRAFFIC_LOG')
+TRAFFIC_LOG_ANONYMISE = os.environ.get('EXAM_TRAFFIC_LOG_ANONYMISE', '1') != '0'
+
+
+def _traffic_log_salt():
+    """
+    Key of the hashes in the traffic log: EXAM_TRAFFIC_LOG_SALT, or a random
+    one kept next to the log as <log>.salt, so every server process and
+    restart writing to the same log hashes a student the same way
+    """
+    salt = os.environ.get('EXAM_TRAFFIC_LOG_SALT')
+    if salt or not TRAFFIC_LOG_PATH or not TRAFFIC_LOG_ANONYMISE:
+        return (salt or secrets.token_hex(16)).encode()
+
+    salt_path = TRAFFIC_LOG_PATH + '.salt'
+    if not os.path.exists(salt_path):
+        # Written in full before it appears, and only by the first process
+        temp_path = f"{salt_path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as salt_file:
+            salt_file.write(secrets.token_hex(16))
+        try:
+            os.link(temp_path, salt_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(salt_path, encoding='utf-8') as salt_file:
+        return salt_file.read().strip().encode()
+
+
+TRAFFIC_LOG_SALT = _traffic_log_salt()
+
+# Records are written by a background thread so requests never wait on disk;
+# if the writer falls behind, records are dropped rather than slowing requests.
+# The thread starts with the first record, in the process serving requests.
+_traffic_queue = queue.Queue(maxsize=100000)
+_traffic_writer_started = False
+_traffic_writer_lock = threading.Lock()
+
+
+def _traffic_writer():
+    """Append queued traffic records to the log file"""
+    with open(TRAFFIC_LOG_PATH, 'a', encoding='utf-8') as log_file:
+        while True:
+            record = _traffic_queue.get()
+            log_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            if _traffic_queue.empty():
+                log_file.flush()
+
+
+def _anonymise(value):
+    """Replace an identifying value with a short keyed hash"""
+    if not TRAFFIC_LOG_ANONYMISE:
+        return value
+    return hmac.new(TRAFFIC_LOG_SALT, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def _traffic_identity():
+    """Who is making this request: student number, teacher id or client IP"""
+    student_number = session.get('student_number')
+    if not student_number and request.endpoint == 'student_login' and request.method == 'POST':
+        student_number = request.form.get('student_number')
+    if student_number:
+        return 's:' + _anonymise(student_number)
+    if 'user_id' in session:
+        return 't:' + _anonymise(str(session['user_id']))
+    return 'a:' + _anonymise(get_real_ip() or '')
+
+
+def _start_traffic_writer():
+    global _traffic_writer_started
+    with _traffic_writer_lock:
+        if not _traffic_writer_started:
+            threading.Thread(target=_traffic_writer, name='traffic-writer',
+                             daemon=True).start()
+            _traffic_writer_started = True
+
+
+if TRAFFIC_LOG_PATH:
+    @app.before_request
+    def _start_traffic_capture():
+        g.traffic_start = time.time()
+        # Taken now, because submitting or logging out clears the session
+        g.traffic_identity = _traffic_identity()
+
+    @app.after_request
+    def _capture_traffic(response):
+        if request.endpoint == 'static' or 'traffic_start' not in g:
+            return response
+
+        record = {
+            't': round(g.traffic_start, 3),
+            'm': request.method,
+            'ep': request.endpoint,
+            'p': request.path,
+            'st': response.status_code,
+            'ms': round((time.time() - g.traffic_start) * 1000, 2),
+            'in': request.content_length or 0,
+            'out': response.calculate_content_length() or 0,
+            'who': g.traffic_identity,
+            'ip': _anonymise(get_real_ip() or '')
+        }
+        if request.view_args:
+            record['args'] = request.view_args
+        if request.endpoint in ('auto_save', 'submit_exam'):
+            # Whatever the client sent; the routes reject other shapes with 400
+            payload = request.get_json(silent=True)
+            answers = payload.get('answers') if isinstance(payload, dict) else None
+            if isinstance(answers, dict):
+                record['ans'] = [len(answer) if isinstance(answer, str) else 0
+                                 for answer in answers.values()]
+
+        if not _traffic_writer_started:
+            _start_traffic_writer()
+        try:
+            _traffic_queue.put_nowait(record)
+        except queue.Full:
+            pass
+        return response
+
+# Answer pre-check
+#
+# A background thread picks up newly saved answers every few seconds and has a
+# small process pool compile them against their question's reference schema
+# (see sql_grader.check_answer), so broken answers show up on the submissions
+# page without opening each one. Only each student's latest version is checked,
+# and nothing happens on the request path. Started by start_background_jobs();
+# EXAM_ANSWER_CHECK=0 turns it off.
+ANSWER_CHECK_ENABLED = os.environ.get('EXAM_ANSWER_CHECK', '1') != '0'
+ANSWER_CHECK_INTERVAL = 5          # seconds between scans for new answers
+ANSWER_CHECK_PROCESSES = 2
+ANSWER_CHECK_BATCH = 1000          # submissions read per scan
+ANSWER_CHECK_CACHE_SIZE = 50000    # outcomes remembered before starting afresh
+ANSWER_CHECK_TIMEOUT = 30          # seconds before a stuck check's pool is replaced
+
+# Set when a question's dataset changes, so earlier submissions are scanned again
+_answer_recheck = threading.Event()
+
+
+def _check_new_answers(pool, cache, after_submission_id, exam_id=None):
+    """
+    Check the latest answers among the next batch of submissions, in the
+    database of `exam_id` (see storage.Storage.live_scopes).
+
+    Returns:
+        tuple: (last submission id scanned, whether more submissions are waiting)
+    """
+    last_id, count, rows = records.answers_to_check(
+        after_submission_id, ANSWER_CHECK_BATCH, exam_id=exam_id)
+    if not count:
+        return after_submission_id, False
+
+    # Reference schemas, from the questions in the SQLite database
+    question_ids = sorted({row['question_id'] for row in rows})
+    datasets = {}
+    if question_ids:
+        placeholders = ','.join('?' * len(question_ids))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, dataset_sql FROM questions WHERE id IN ({placeholders})",
+                question_ids)
+            datasets = {row['id']: row['dataset_sql'] for row in cursor.fetchall()}
+
+    # Autosaves supersede each other, so only the newest version is checked
+    latest = {}
+    for row in rows:
+        student = (row['student_number'], row['exam_id'])
+        latest[student] = max(latest.get(student, 0), row['submission_id'])
+    unchecked = [row for row in rows if row['check_status'] is None
+                 and row['question_id'] in datasets
+                 and latest[(row['student_number'], row['exam_id'])] == row['submission_id']]
+
+    if unchecked:
+        outcomes = sql_grader.check_answers(
+            pool, [(datasets[row['question_id']], row['answer_content'])
+                   for row in unchecked], cache, timeout=ANSWER_CHECK_TIMEOUT)
+        records.save_answer_checks(
+            [(status, error, row['id'])
+             for row, (status, error) in zip(unchecked, outcomes)],
+            exam_id=exam_id)
+
+    return last_id, count == ANSWER_CHECK_BATCH
+
+
+def _answer_checker():
+    """Keep checking newly saved answers until the server stops"""
+    pool = sql_grader.check_pool(ANSWER_CHECK_PROCESSES)
+    cache = {}
+    # Submission ids count separately in the main database and each exam shard
+    last_submission_ids = {}
+    while True:
+        if _answer_recheck.is_set():
+            _answer_recheck.clear()
+            last_submission_ids.clear()
+
+        more = False
+        try:
+            for exam_id in records.live_scopes():
+                last_submission_ids[exam_id], waiting = _check_new_answers(
+                    pool, cache, last_submission_ids.get(exam_id, 0), exam_id)
+                more = more or waiting
+        except DATABASE_BUSY_ERRORS as e:
+            # Typically a busy database; the same batch is tried again
+            print(f"Database error in answer checker: {str(e)}")
+        except sql_grader.CheckTimeout as e:
+            # A worker is stuck or died; the answer is cached as invalid, so
+            # the next scan gets past it
+            print(f"{str(e)}, starting a new answer checker pool")
+            pool.terminate()
+            pool = sql_grader.check_pool(ANSWER_CHECK_PROCESSES)
+
+        if len(cache) > ANSWER_CHECK_CACHE_SIZE:
+            cache.clear()
+        if not more:
+            _answer_recheck.wait(ANSWER_CHECK_INTERVAL)
+
+
+# Autosave retention
+#
+# Every auto-save adds a full version of a student's answers. A background
+# compactor thins out the old ones, keeping each final submission, every
+# version a teacher or the auto-grader has graded, each student's last
+# RETENTION_KEEP_LATEST versions and the newest version in every
+# RETENTION_BUCKET_MINUTES window. It deletes a small batch per transaction so
+# auto-saves never wait long for the write lock, then hands the freed pages
+# back with incremental vacuum. EXAM_RETENTION=0 keeps every version.
+RETENTION_ENABLED = os.environ.get('EXAM_RETENTION', '1') != '0'
+RETENTION_KEEP_LATEST = int(os.environ.get('EXAM_RETENTION_KEEP_LATEST', 5))
+RETENTION_BUCKET_MINUTES = int(os.environ.get('EXAM_RETENTION_BUCKET_MINUTES', 10))
+RETENTION_INTERVAL = 600           # seconds between compaction passes
+RETENTION_BATCH = 200              # submissions deleted per transaction
+RETENTION_PAUSE = 0.05             # seconds between transactions, for writers
+VACUUM_STEP_PAGES = 256            # pages released per incremental vacuum step
+
+
+def expired_submission_ids(path=None):
+    """Ids of the submissions the retention policy no longer keeps"""
+    with get_db_connection(path=path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id FROM (
+                SELECT id, is_final,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY student_number, exam_id, model_id
+                           ORDER BY version DESC) AS recency,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY student_number, exam_id, model_id,
+                                        CAST(strftime('%s', submission_time) AS INTEGER) / ?
+                           ORDER BY version DESC) AS bucket_rank
+                FROM submissions
+            )
+            WHERE recency > ? AND bucket_rank > 1 AND NOT is_final
+              AND id NOT IN (SELECT submission_id FROM grades
+                             WHERE submission_id IS NOT NULL)
+              AND id NOT IN (SELECT submission_id FROM auto_grades
+                             WHERE submission_id IS NOT NULL)
+            ORDER BY id
+            """,
+            (RETENTION_BUCKET_MINUTES * 60, RETENTION_KEEP_LATEST)
+        )
+        return [row['id'] for row in cursor.fetchall()]
+
+
+def release_free_pages(path=None):
+    """
+    Shrink the database file (or the exam shard at `path`) by its free pages,
+    a few at a time.
+
+    Returns:
+        int: Number of pages released
+    """
+    released = 0
+    with get_db_connection(path=path) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0  # Not in incremental mode: free pages are reused instead
+        while True:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages:
+                break
+            conn.execute(
+                f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+            released += min(free_pages, VACUUM_STEP_PAGES)
+            time.sleep(RETENTION_PAUSE)
+    return released
+
+
+@app.cli.command('convert-auto-vacuum')
+def convert_auto_vacuum_command():
+    """Switch the database to incremental auto-vacuum (stop the server first)."""
+    with get_db_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            click.echo("The database already uses incremental auto-vacuum")
+            return
+        click.echo(f"Rewriting {DATABASE_PATH} with VACUUM, this may take a while...")
+        started = time.time()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    click.echo(f"Converted to incremental auto-vacuum in {time.time() - started:.1f}s")
+
+
+def compact_submissions(path=None):
+    """
+    Delete the submissions the retention policy no longer keeps, with their
+    answers, and release the space they took. `path` is an exam shard to
+    compact instead of the main database.
+
+    Returns:
+        int: Number of submissions deleted
+    """
+    deleted = 0
+    expired = expired_submission_ids(path)
+    for start in range(0, len(expired), RETENTION_BATCH):
+        batch = expired[start:start + RETENTION_BATCH]
+        placeholders = ','.join('?' * len(batch))
+        with get_db_connection(path=path) as conn:
+            cursor = conn.cursor()
+            # Graded since the policy was evaluated? Then it stays
+            cursor.execute(
+                f"""
+                DELETE FROM submissions WHERE id IN ({placeholders})
+                  AND id NOT IN (SELECT submission_id FROM grades
+                                 WHERE submission_id IS NOT NULL)
+                  AND id NOT IN (SELECT submission_id FROM auto_grades
+                                 WHERE submission_id IS NOT NULL)
+                """,
+                batch
+            )
+            deleted += cursor.rowcount
+            cursor.execute(
+                f"""
+                DELETE FROM question_answers WHERE submission_id IN ({placeholders})
+                  AND submission_id NOT IN (SELECT id FROM submissions)
+                """,
+                batch
+            )
+            conn.commit()
+        time.sleep(RETENTION_PAUSE)
+
+    if deleted:
+        released = release_free_pages(path)
+        print(f"Compacted {deleted} old autosave versions"
+              f"{f' in {path}' if path else ''}, "
+              f"released {released} database pages")
+    return deleted
+
+
+def _submission_compactor():
+    """Apply the retention policy every RETENTION_INTERVAL seconds"""
+    while True:
+        try:
+            # The main database, then the shard of each exam not archived yet
+            for exam_id in records.live_scopes():
+                compact_submissions(records.shard_path(exam_id))
+        except sqlite3.OperationalError as e:
+            # Typically a busy database; the next pass picks up where this stopped
+            print(f"Database error in submission compactor: {str(e)}")
+        time.sleep(RETENTION_INTERVAL)
+
+
+# Exam archive
+#
+# A finished exam's sessions, submissions, answers and grades can be moved out
+# of the live database into database/archive/exam_<id>.db (EXAM_ARCHIVE_DIR),
+# so the tables every auto-save touches only hold recent exams. The exam,
+# its models and questions stay in the live database, with the archive file
+# in exams.archive_path. The storage backend reads an archived exam from its
+# file (see storage.SQLiteStorage). Archived exams are read-only. An exam with
+# a shard (see "Exam shards" below) already has a file of its own, which then
+# becomes its archive as it is.
+ARCHIVE_DIR = os.environ.get(
+    'EXAM_ARCHIVE_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'archive'))
+
+# Tables moved to the archive (storage.EXAM_TABLES), with the condition
+# selecting one exam's rows
+ARCHIVED_TABLES = {
+    'submissions': "exam_id = :exam_id",
+    'exam_sessions': "exam_id = :exam_id",
+    'question_answers': "submission_id IN (SELECT id FROM main.submissions WHERE exam_id = :exam_id)",
+    'grades': "submission_id IN (SELECT id FROM main.submissions WHERE exam_id = :exam_id)",
+    'auto_grades': "submission_id IN (SELECT id FROM main.submissions WHERE exam_id = :exam_id)"
+}
+
+
+def _prepare_archive(conn, indexes=False):
+    """
+    Give the attached `archive` database the archived tables, as they are
+    now, and their indexes if asked (an exam shard is written to as well).
+    """
+    for table in ARCHIVED_TABLES:
+        cursor = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        conn.execute(cursor.fetchone()['sql'].replace(
+            f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS archive.{table}", 1))
+        if indexes:
+            cursor = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'index' "
+                "AND tbl_name = ? AND sql IS NOT NULL", (table,))
+            for row in cursor.fetchall():
+                conn.execute(row['sql'].replace(
+                    "INDEX ", "INDEX IF NOT EXISTS archive.", 1))
+
+        # Columns added to the live table after the exam was archived
+        archived = {row['name']
+                    for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+        for column in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if column['name'] not in archived:
+                definition = column['type']
+                if column['dflt_value'] is not None:
+                    definition += f" DEFAULT {column['dflt_value']}"
+                conn.execute(
+                    f"ALTER TABLE archive.{table} ADD COLUMN {column['name']} {definition}")
+
+
+def archive_exam(exam_id):
+    """
+    Move a finished exam's sessions, submissions, answers and grades from the
+    live database into its archive file, in one transaction.
+
+    Returns:
+        int: Number of submissions archived
+
+    Raises:
+        ValueError: If the exam does not exist or is not finished
+    """
+    if STORAGE_BACKEND != 'sqlite':
+        raise ValueError("Exams can only be archived with the SQLite storage backend")
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+        if not exam:
+            raise ValueError(f"Exam {exam_id} does not exist")
+        if exam['is_active']:
+            raise ValueError("The exam is still active")
+        if records.sessions_running(exam_id):
+            raise ValueError("Students are still taking the exam")
+
+        if exam['shard_path']:
+            if not exam['archive_path']:
+                cursor.execute(
+                    "UPDATE exams SET archive_path = shard_path WHERE id = ?", (exam_id,))
+                conn.commit()
+            shard = get_read_connection(path=exam['shard_path'])
+            try:
+                return shard.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+            finally:
+                shard.close()
+
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = exam['archive_path'] or os.path.join(
+            ARCHIVE_DIR, f"exam_{exam_id}.db")
+        cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            _prepare_archive(conn)
+            conn.commit()
+
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                "SELECT COUNT(*) FROM submissions WHERE exam_id = ?", (exam_id,))
+            archived = cursor.fetchone()[0]
+            for table, condition in ARCHIVED_TABLES.items():
+                columns = ', '.join(
+                    row['name'] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+                cursor.execute(
+                    f"INSERT INTO archive.{table} ({columns}) "
+                    f"SELECT {columns} FROM main.{table} WHERE {condition}",
+                    {'exam_id': exam_id})
+            # Answers and grades go before the submissions they are selected by
+            for table, condition in reversed(ARCHIVED_TABLES.items()):
+                cursor.execute(
+                    f"DELETE FROM main.{table} WHERE {condition}", {'exam_id': exam_id})
+            cursor.execute(
+                "UPDATE exams SET archive_path = ? WHERE id = ?", (path, exam_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # A failed detach must not hide why archiving failed
+            try:
+                cursor.execute("DETACH DATABASE archive")
+            except sqlite3.Error as e:
+                print(f"Could not detach the archive of exam {exam_id}: {e}")
+            raise
+        cursor.execute("DETACH DATABASE archive")
+
+    release_free_pages()
+    return archived
+
+
+@app.cli.command('archive-exam')
+@click.argument('exam_id', type=int)
+def archive_exam_command(exam_id):
+    """Move a finished exam's submissions into its archive database."""
+    try:
+        archived = archive_exam(exam_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Archived {archived} submissions of exam {exam_id}")
+
+# Exam shards
+#
+# With EXAM_SHARDS=1 every exam activated from then on keeps its sessions,
+# submissions, answers and grades in a database of its own,
+# database/shards/exam_<id>.db (EXAM_SHARD_DIR), recorded in exams.shard_path.
+# Students of different exams then never queue behind each other's writes, and
+# a finished exam leaves nothing behind in the tables the next one writes to.
+# Users, exams, questions and IP policies stay in the main database. The
+# storage backend routes an exam's queries by its exams.shard_path (see
+# storage.SQLiteStorage), so exams that already have data in the main
+# database stay there, and shards stay in use if the option is turned off.
+# Shards run SQLite's own WAL checkpoints; the autosave compactor and backups
+# cover them too. Only available with EXAM_STORAGE=sqlite.
+SHARDS_ENABLED = os.environ.get('EXAM_SHARDS', '0') == '1'
+SHARD_DIR = os.environ.get(
+    'EXAM_SHARD_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'shards'))
+
+
+def prepare_shard(path):
+    """Create the shard at `path`, or bring it up to the live tables' schema"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    shard = sqlite3.connect(path)
+    try:
+        # Only takes effect before the first table is created
+        shard.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Restored shards come back in rollback journal mode
+        shard.execute("PRAGMA journal_mode = WAL")
+    finally:
+        shard.close()
+
+    conn = get_db_connection()
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            _prepare_archive(conn, indexes=True)
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+
+def assign_exam_shard(exam_id):
+    """
+    Give an exam a shard database, unless it has one already or some of its
+    data is in the main database.
+
+    Returns:
+        str: Path of the exam's shard, or None if it has none
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT shard_path, archive_path FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+    if not exam or exam['shard_path'] or exam['archive_path']:
+        return exam['shard_path'] if exam else None
+
+    path = os.path.join(SHARD_DIR, f"exam_{exam_id}.db")
+    prepare_shard(path)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Nobody may log in between the check and the switch
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """
+            SELECT 1 FROM exam_sessions WHERE exam_id = :exam_id
+            UNION ALL
+            SELECT 1 FROM submissions WHERE exam_id = :exam_id
+            LIMIT 1
+            """,
+            {'exam_id': exam_id})
+        if cursor.fetchone():
+            conn.rollback()
+            return None
+        cursor.execute(
+            "UPDATE exams SET shard_path = ? WHERE id = ? AND shard_path IS NULL",
+            (path, exam_id))
+        conn.commit()
+
+    records.set_shard(exam_id, path)
+    print(f"Exam {exam_id} stores its submissions in {path}")
+    return path
+
+
+def upgrade_shards():
+    """Give shards created by an older version the columns added since"""
+    with get_db_connection() as conn:
+        shard_paths = [row['shard_path'] for row in conn.execute(
+            "SELECT shard_path FROM exams WHERE shard_path IS NOT NULL").fetchall()]
+    conn.close()
+    for shard_path in shard_paths:
+        if os.path.exists(shard_path):
+            prepare_shard(shard_path)
+
+# Database maintenance
+#
+# A background thread keeps the database in shape while it fills up during an
+# exam: it refreshes the query planner's statistics (ANALYZE, sampling at
+# most ANALYSIS_LIMIT rows per index) whenever OPTIMIZE_WRITES answers have
+# been saved since the last time, and runs a passive WAL checkpoint every
+# CHECKPOINT_INTERVAL seconds or as soon as the WAL reaches CHECKPOINT_WAL_SIZE.
+# Passive checkpoints never wait for readers or writers. Truncating the WAL
+# back to zero waits for both, so it is left until no exam session is running,
+# unless the WAL has grown past WAL_SIZE_LIMIT anyway. Connections keep an
+# automatic checkpoint every WAL_AUTOCHECKPOINT_PAGES pages as a backstop for
+# when this thread falls behind.
+# The last run of each task is shown at /teacher/maintenance.
+MAINTENANCE_INTERVAL = 10          # seconds between checks
+OPTIMIZE_WRITES = 20000            # saved answers between statistics refreshes
+ANALYSIS_LIMIT = 1000              # rows sampled per index by ANALYZE
+CHECKPOINT_INTERVAL = 60           # seconds between passive checkpoints
+CHECKPOINT_WAL_SIZE = 16 * 1024 * 1024
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+_maintenance_runs = {}
+_maintenance_lock = threading.Lock()
+
+
+def _record_maintenance(task, started, result):
+    with _maintenance_lock:
+        _maintenance_runs[task] = {
+            'last_run': datetime.now().isoformat(timespec='seconds'),
+            'duration': round(time.time() - started, 3),
+            'result': result
+        }
+
+
+def wal_size():
+    """Current size of the database's write-ahead log in bytes"""
+    try:
+        return os.path.getsize(DATABASE_PATH + '-wal')
+    except OSError:
+        return 0
+
+
+def exam_in_progress():
+    """Whether any student is still taking an exam, in any live database"""
+    return any(records.sessions_running(exam_id)
+               for exam_id in records.live_scopes())
+
+
+def checkpoint_database(conn, mode='PASSIVE'):
+    """Run a WAL checkpoint and report how far it got"""
+    started = time.time()
+    busy, log_pages, checkpointed = conn.execute(
+        f"PRAGMA wal_checkpoint({mode})").fetchone()
+    result = {'busy': bool(busy), 'wal_pages': log_pages,
+              'checkpointed_pages': checkpointed}
+    _record_maintenance(f"checkpoint_{mode.lower()}", started, result)
+    return result
+
+
+def analyze_database(conn):
+    """Refresh the query planner's statistics, sampling a bounded number of rows"""
+    started = time.time()
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+    _record_maintenance('analyze', started, {})
+
+
+def _database_maintainer():
+    """Run the maintenance tasks that are due, until the server stops"""
+    analyzed_answers = None    # answer count at the last ANALYZE
+    last_checkpoint = time.time()
+    truncated = False
+    while True:
+        try:
+            with get_db_connection() as conn:
+                answers = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM question_answers").fetchone()[0]
+                if analyzed_answers is None or answers - analyzed_answers >= OPTIMIZE_WRITES:
+                    analyze_database(conn)
+                    analyzed_answers = answers
+
+                if wal_size() >= WAL_SIZE_LIMIT:
+                    # Readers kept passive checkpoints from resetting the
+                    # WAL; this one waits for them, holding up writers briefly
+                    checkpoint_database(conn, 'TRUNCATE')
+                    last_checkpoint = time.time()
+                elif (time.time() - last_checkpoint >= CHECKPOINT_INTERVAL
+                        or wal_size() >= CHECKPOINT_WAL_SIZE):
+                    checkpoint_database(conn)
+                    last_checkpoint = time.time()
+
+                if exam_in_progress():
+                    truncated = False
+                elif not truncated:
+                    truncated = not checkpoint_database(conn, 'TRUNCATE')['busy']
+        except sqlite3.OperationalError as e:
+            # Typically a busy database; due tasks are tried again next time
+            print(f"Database error in maintenance: {str(e)}")
+        time.sleep(MAINTENANCE_INTERVAL)
+
+
+
+# Backups
+#
+# Every BACKUP_INTERVAL seconds a consistent snapshot of the database is
+# written to database/backups (EXAM_BACKUP_DIR) with SQLite's online backup
+# API, BACKUP_STEP_PAGES pages at a time with a short pause after each step so
+# auto-saves keep their latency. The source connection holds one read
+# transaction throughout, so writes made meanwhile neither show up half-way
+# nor restart the copy. The newest BACKUP_KEEP snapshots are kept. Exam
+# shards still in use are copied right after the main database, into
+# backup_<time>.exam_<id>.db next to it, and restored with it.
+# `flask --app app restore-backup <file>` puts one back (with the server
+# stopped). EXAM_BACKUP=0 turns scheduled backups off.
+BACKUP_ENABLED = os.environ.get('EXAM_BACKUP', '1') != '0'
+BACKUP_DIR = os.environ.get(
+    'EXAM_BACKUP_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'backups'))
+BACKUP_INTERVAL = int(os.environ.get('EXAM_BACKUP_INTERVAL', 300))
+BACKUP_KEEP = int(os.environ.get('EXAM_BACKUP_KEEP', 12))
+BACKUP_STEP_PAGES = 64
+BACKUP_STEP_PAUSE = 0.005          # seconds between steps
+
+
+def copy_database(path, source_path=None):
+    """
+    Write a consistent copy of the live database (or the exam shard at
+    `source_path`) to `path`, a few pages at a time with a pause after each
+    step so auto-saves keep their latency.
+    """
+    # Unique, so two copies to the same path never write the same file
+    temp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    source = get_db_connection(path=source_path)
+    target = sqlite3.connect(temp_path)
+    try:
+        # One read transaction for the whole copy: a stable snapshot
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=BACKUP_STEP_PAGES,
+                      progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_PAUSE))
+        # A self-contained file, without -wal and -shm files next to it
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.rollback()
+        source.close()
+    os.replace(temp_path, path)
+
+
+def backup_database(prefix='backup'):
+    """
+    Write a consistent copy of the live database to BACKUP_DIR and drop the
+    oldest copies with the same prefix (scheduled backups, or the copies
+    taken before restoring) beyond BACKUP_KEEP.
+
+    Returns:
+        str: Path of the new backup
+    """
+    started = time.time()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    path = os.path.join(
+        BACKUP_DIR, f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    copy_database(path)
+    size = os.path.getsize(path)
+    for exam_id in records.live_scopes()[1:]:
+        shard_backup = f"{path[:-len('.db')]}.exam_{exam_id}.db"
+        copy_database(shard_backup, records.shard_path(exam_id))
+        size += os.path.getsize(shard_backup)
+
+    backups = sorted(name for name in os.listdir(BACKUP_DIR)
+                     if name.startswith(f"{prefix}_") and name.endswith('.db')
+                     and '.exam_' not in name)
+    for name in backups[:-BACKUP_KEEP]:
+        for shard_backup in _shard_backups(os.path.join(BACKUP_DIR, name)).values():
+            os.remove(shard_backup)
+        os.remove(os.path.join(BACKUP_DIR, name))
+
+    _record_maintenance('backup', started, {
+        'file': os.path.basename(path), 'size': size})
+    return path
+
+
+def _shard_backups(backup_path):
+    """Copies of exam shards taken with a backup, as {exam id: path}"""
+    folder, name = os.path.split(backup_path)
+    prefix = name[:-len('.db')] + '.exam_'
+    return {int(shard[len(prefix):-len('.db')]): os.path.join(folder, shard)
+            for shard in os.listdir(folder or '.')
+            if shard.startswith(prefix) and shard.endswith('.db')
+            and shard[len(prefix):-len('.db')].isdigit()}
+
+
+def _open_backup(backup_path):
+    """
+    Read-only connection to a backup, after checking it.
+
+    Raises:
+        ValueError: If the backup is missing or damaged
+    """
+    if not os.path.isfile(backup_path):
+        raise ValueError(f"{backup_path} does not exist")
+    source = sqlite3.connect(
+        f"file:{pathname2url(os.path.abspath(backup_path))}?mode=ro", uri=True)
+    try:
+        check = source.execute("PRAGMA quick_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        source.close()
+        raise ValueError(f"{backup_path} is not a usable database: {str(e)}")
+    if check != 'ok':
+        source.close()
+        raise ValueError(f"{backup_path} is damaged: {check}")
+    return source
+
+
+def restore_database(backup_path):
+    """
+    Replace the live database's contents, and those of the exam shards
+    backed up with it, with a backup, after checking the backup and saving
+    the current contents next to it. The server must not be running.
+
+    Raises:
+        ValueError: If the backup is missing or damaged
+    """
+    shard_backups = _shard_backups(backup_path)
+    sources = {None: _open_backup(backup_path)}
+    try:
+        for exam_id, shard_backup in shard_backups.items():
+            sources[exam_id] = _open_backup(shard_backup)
+
+        pre_restore = backup_database(prefix='pre_restore')
+        print(f"Saved the current database to {pre_restore}")
+
+        # Through the backup API, so the live file's WAL stays consistent
+        target = sqlite3.connect(DATABASE_PATH)
+        try:
+            sources[None].backup(target)
+            shard_paths = dict(target.execute(
+                "SELECT id, shard_path FROM exams WHERE shard_path IS NOT NULL").fetchall())
+        finally:
+            target.close()
+
+        # Each shard goes back where the restored database expects it
+        for exam_id in shard_backups:
+            if exam_id not in shard_paths:
+                continue
+            os.makedirs(os.path.dirname(shard_paths[exam_id]) or '.', exist_ok=True)
+            target = sqlite3.connect(shard_paths[exam_id])
+            try:
+                sources[exam_id].backup(target)
+            finally:
+                target.close()
+    finally:
+        for source in sources.values():
+            source.close()
+
+
+def _database_backup():
+    """Take a backup every BACKUP_INTERVAL seconds until the server stops"""
+    while True:
+        time.sleep(BACKUP_INTERVAL)
+        try:
+            backup_database()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Backup failed: {str(e)}")
+
+
+
+@app.cli.command('backup-database')
+def backup_database_command():
+    """Write a backup of the database now."""
+    click.echo(f"Backup written to {backup_database()}")
+
+
+@app.cli.command('restore-backup')
+@click.argument('backup_path', type=click.Path())
+def restore_backup_command(backup_path):
+    """Restore the database from a backup (stop the server first)."""
+    try:
+        restore_database(backup_path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Database restored from {backup_path}")
+
+
+# Reporting snapshot
+#
+# With EXAM_REPORTING_SNAPSHOT=1 the reports across all exams (all grades and
+# its Excel export) read a copy of the database refreshed every
+# REPORTING_SNAPSHOT_INTERVAL seconds instead of the live file, so the
+# heaviest reports do no I/O on the file students write to. They may then be
+# that far behind; the pages of a single exam always read the live database.
+REPORTING_SNAPSHOT_ENABLED = os.environ.get('EXAM_REPORTING_SNAPSHOT', '0') == '1'
+REPORTING_SNAPSHOT_INTERVAL = int(os.environ.get('EXAM_REPORTING_SNAPSHOT_INTERVAL', 60))
+REPORTING_SNAPSHOT_DIR = os.path.join(
+    os.path.dirname(DATABASE_PATH) or '.', 'snapshots')
+
+_reporting_snapshot = None         # newest complete snapshot, if any
+
+
+def refresh_reporting_snapshot():
+    """Take a new reporting snapshot and remove the older ones"""
+    global _reporting_snapshot
+    started = time.time()
+    os.makedirs(REPORTING_SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(REPORTING_SNAPSHOT_DIR,
+                        f"reporting_{int(time.time() * 1000)}.db")
+    copy_database(path)
+    _reporting_snapshot = path
+
+    for name in os.listdir(REPORTING_SNAPSHOT_DIR):
+        if name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(REPORTING_SNAPSHOT_DIR, name))
+            except OSError:
+                pass  # Still open in a report (Windows); removed next time
+    _record_maintenance('reporting_snapshot', started, {
+        'file': os.path.basename(path)})
+
+
+def _reporting_snapshots():
+    """Refresh the reporting snapshot every REPORTING_SNAPSHOT_INTERVAL seconds"""
+    while True:
+        try:
+            refresh_reporting_snapshot()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Reporting snapshot failed: {str(e)}")
+        time.sleep(REPORTING_SNAPSHOT_INTERVAL)
+
+
+
+@app.route('/teacher/maintenance')
+def maintenance_status():
+    if 'role' not in session or session['role'] != 'teacher':
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    with _maintenance_lock:
+        runs = dict(_maintenance_runs)
+    return jsonify({
+        'enabled': DB_MAINTENANCE_ENABLED,
+        'wal_size': wal_size(),
+        'tasks': runs
+    })
+
+# Static assets
+#
+# Stylesheets and the vendored CodeMirror editor are served under content-hashed
+# names (css/style.3f9a1c2b7d.css) from static/dist, written at startup together
+# with gzip and, when the brotli package is installed, brotli variants. A name
+# changes whenever its content does, so browsers may cache assets for good and a
+# lab of 300 machines fetches the editor from this server only once. Templates
+# link assets with asset_url().
+ASSET_SOURCES = ['css', 'vendor']      # folders under static/ to fingerprint
+ASSET_EXTENSIONS = ('.css', '.js')
+ASSET_BUILD_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_MAX_AGE = 365 * 24 * 3600        # one year, the longest browsers honour
+
+# Pre-compressed variants, in order of preference
+ASSET_ENCODINGS = [('gzip', '.gz', lambda content: gzip.compress(content, 9, mtime=0))]
+if brotli:
+    ASSET_ENCODINGS.insert(0, ('br', '.br', brotli.compress))
+
+
+def _write_asset(path, content):
+    """Write a build file atomically, so a half-written asset is never served"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as asset_file:
+        asset_file.write(content)
+    os.replace(temp_path, path)
+
+
+def build_assets():
+    """
+    Write fingerprinted and pre-compressed copies of the static assets.
+
+    Returns:
+        dict: Original filename -> fingerprinted filename, both relative to
+        static/ and static/dist respectively
+    """
+    manifest = {}
+    for source in ASSET_SOURCES:
+        for root, _, files in os.walk(os.path.join(app.static_folder, source)):
+            for name in files:
+                if not name.endswith(ASSET_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                filename = os.path.relpath(
+                    path, app.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as asset_file:
+                    content = asset_file.read()
+
+                stem, extension = os.path.splitext(filename)
+                digest = hashlib.sha256(content).hexdigest()[:10]
+                fingerprinted = f"{stem}.{digest}{extension}"
+
+                # Files from earlier starts are reused; their names prove they
+                # hold the same content
+                target = os.path.join(ASSET_BUILD_DIR, fingerprinted)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if not os.path.exists(target):
+                    _write_asset(target, content)
+                for _, suffix, compress in ASSET_ENCODINGS:
+                    if not os.path.exists(target + suffix):
+                        _write_asset(target + suffix, compress(content))
+
+                manifest[filename] = fingerprinted
+    return manifest
+
+
+try:
+    _asset_manifest = build_assets()
+except OSError as e:
+    # Assets are then linked from static/ under their plain names
+    print(f"Could not build static assets: {str(e)}")
+    _asset_manifest = {}
+_fingerprinted_assets = set(_asset_manifest.values())
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static asset: fingerprinted when it was built, plain otherwise"""
+    if filename in _asset_manifest:
+        return url_for('asset', filename=_asset_manifest[filename])
+    return url_for('static', filename=filename)
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted asset, pre-compressed when the browser accepts it"""
+    if filename not in _fingerprinted_assets:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix, _ in ASSET_ENCODINGS:
+        if request.accept_encodings[encoding]:
+            response = send_from_directory(
+                ASSET_BUILD_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(
+            ASSET_BUILD_DIR, filename, mimetype=mimetype)
+
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Response compression
+#
+# HTML and JSON responses of at least COMPRESSION_MIN_SIZE bytes are sent
+# brotli (when installed) or gzip compressed, whichever the browser accepts.
+# Compressed bodies are cached by a hash of the original body, so a page that
+# many clients receive identically (the login pages, a report that has not
+# changed since the last refresh) is only compressed once.
+# EXAM_COMPRESSION=0 turns compression off.
+COMPRESSION_ENABLED = os.environ.get('EXAM_COMPRESSION', '1') != '0'
+COMPRESSION_MIN_SIZE = int(os.environ.get('EXAM_COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('EXAM_COMPRESSION_LEVEL', '6'))   # gzip, 1-9
+BROTLI_QUALITY = int(os.environ.get('EXAM_BROTLI_QUALITY', '4'))         # brotli, 0-11
+COMPRESSION_MIMETYPES = {'text/html', 'application/json'}
+COMPRESSION_CACHE_SIZE = 256       # compressed bodies kept, least recently used dropped
+
+_compression_cache = OrderedDict()
+_compression_cache_lock = threading.Lock()
+
+
+def _compress_body(body, encoding):
+    """Compress a response body, re-using the result for identical bodies"""
+    key = (hashlib.sha1(body).digest(), encoding)
+    with _compression_cache_lock:
+        compressed = _compression_cache.get(key)
+        if compressed is not None:
+            _compression_cache.move_to_end(key)
+            return compressed
+
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, COMPRESSION_LEVEL, mtime=0)
+
+    with _compression_cache_lock:
+        _compression_cache[key] = compressed
+        while len(_compression_cache) > COMPRESSION_CACHE_SIZE:
+            _compression_cache.popitem(last=False)
+    return compressed
+
+
+def _response_encoding():
+    """The supported encoding the client accepts with the highest preference"""
+    supported = ['br', 'gzip'] if brotli else ['gzip']
+    # On equal preference brotli wins, being listed first
+    encoding = max(supported, key=lambda name: request.accept_encodings[name])
+    return encoding if request.accept_encodings[encoding] else None
+
+
+if COMPRESSION_ENABLED:
+    @app.after_request
+    def _compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSION_MIMETYPES):
+            return response
+
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _response_encoding()
+        if encoding:
+            response.set_data(_compress_body(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+# Active exams
+#
+# Any number of exams can be active at once, e.g. one per room or course. At
+# login a student's exam is the active exam whose code they entered
+# (exams.access_code), else the one whose IP ranges (exams.ip_ranges, CIDR
+# networks such as 10.1.2.0/24) hold their address, the narrowest network
+# winning, else the only active exam that has neither. The active exams are
+# kept in memory, indexed by code and by network, so finding a student's exam
+# takes a few dictionary lookups however many are active. The index is
+# rebuilt whenever an exam is activated, deactivated or changed. Each active
+# exam also keeps its model ids, for assigning one at login, and counts its
+# logins, auto-saves and final submissions (shown on the dashboard and at
+# /teacher/exam_load).
+EXAM_LOAD_EVENTS = ('logins', 'auto_saves', 'submissions')
+
+_active_exams = None
+_active_exams_lock = threading.Lock()
+_exam_load = {}
+_exam_load_lock = threading.Lock()
+
+
+def parse_ip_ranges(text):
+    """
+    Networks in a comma or whitespace separated list of CIDR ranges.
+
+    Raises:
+        ValueError: If a range is not a valid network
+    """
+    return [ipaddress.ip_network(item, strict=False)
+            for item in text.replace(',', ' ').split()]
+
+
+def _network_key(network):
+    """Index key of a network: (IP version, prefix length, network address)"""
+    return network.version, network.prefixlen, int(network.network_address)
+
+
+def build_exam_index(exams, models):
+    """
+    Index active exams (rows of exams) by code and network, with their
+    models (rows with id and exam_id).
+    """
+    index = {'exams': {}, 'codes': {}, 'networks': {}, 'prefixes': set(),
+             'default': None}
+    open_exams = []
+    for exam in exams:
+        index['exams'][exam['id']] = {'exam': dict(exam), 'model_ids': []}
+        if exam['access_code']:
+            index['codes'][exam['access_code'].casefold()] = exam['id']
+        for network in parse_ip_ranges(exam['ip_ranges'] or ''):
+            index['networks'][_network_key(network)] = exam['id']
+            index['prefixes'].add((network.version, network.prefixlen))
+        if not exam['access_code'] and not exam['ip_ranges']:
+            open_exams.append(exam['id'])
+    for model in models:
+        if model['exam_id'] in index['exams']:
+            index['exams'][model['exam_id']]['model_ids'].append(model['id'])
+    # Narrowest networks are tried first
+    index['prefixes'] = sorted(index['prefixes'], key=lambda prefix: -prefix[1])
+    if len(open_exams) == 1:
+        index['default'] = open_exams[0]
+    return index
+
+
+def refresh_active_exams():
+    """Rebuild the index of active exams from the database"""
+    global _active_exams
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM exams WHERE is_active = 1")
+        exams = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT id, exam_id FROM exam_models
+            WHERE exam_id IN (SELECT id FROM exams WHERE is_active = 1)
+            ORDER BY id
+            """)
+        models = cursor.fetchall()
+    index = build_exam_index(exams, models)
+
+    with _active_exams_lock:
+        _active_exams = index
+    # Exam pages of exams that are no longer active are not needed any more
+    with _exam_contents_lock:
+        for key in [key for key in _exam_contents if key[0] not in index['exams']]:
+            del _exam_contents[key]
+    return index
+
+
+def active_exams():
+    """The index of active exams, built on first use"""
+    with _active_exams_lock:
+        index = _active_exams
+    return index if index is not None else refresh_active_exams()
+
+
+def find_student_exam(access_code, ip_address):
+    """
+    The active exam a student logging in with `access_code` (may be empty)
+    from `ip_address` takes, as {'exam': row, 'model_ids': [...]}.
+
+    Raises:
+        ValueError: With the reason no exam was found, for the student
+    """
+    index = active_exams()
+    if not index['exams']:
+        raise ValueError('No active exam available')
+
+    if access_code:
+        exam_id = index['codes'].get(access_code.strip().casefold())
+        if exam_id is None:
+            raise ValueError('Unknown exam code. Please check it with your teacher.')
+        return index['exams'][exam_id]
+
+    try:
+        address = ipaddress.ip_address(ip_address.split(',')[0].strip())
+    except ValueError:
+        address = None
+    if address is not None:
+        bits = address.max_prefixlen
+        for version, prefixlen in index['prefixes']:
+            if version != address.version:
+                continue
+            network_address = int(address) >> (bits - prefixlen) << (bits - prefixlen)
+            exam_id = index['networks'].get((version, prefixlen, network_address))
+            if exam_id is not None:
+                return index['exams'][exam_id]
+
+    if index['default'] is None:
+        raise ValueError('Please enter the exam code given by your teacher')
+    return index['exams'][index['default']]
+
+
+def access_conflict(exam, others):
+    """
+    Why `exam` (a row or dict of exams) cannot be active together with the
+    `others`, or None if it can.
+    """
+    if exam['access_code']:
+        for other in others:
+            if (other['access_code'] or '').casefold() == exam['access_code'].casefold():
+                return f"the code {exam['access_code']} is used by {other['title']}"
+    networks = {_network_key(network)
+                for network in parse_ip_ranges(exam['ip_ranges'] or '')}
+    for other in others:
+        if networks & {_network_key(network)
+                       for network in parse_ip_ranges(other['ip_ranges'] or '')}:
+            return f"its IP ranges are used by {other['title']}"
+    if not exam['access_code'] and not exam['ip_ranges']:
+        for other in others:
+            if not other['access_code'] and not other['ip_ranges']:
+                return f"{other['title']} is already open to every student"
+    return None
+
+
+def count_exam_load(exam_id, event):
+    """Count a login, auto-save or submission for an exam's load figures"""
+    with _exam_load_lock:
+        load = _exam_load.get(exam_id)
+        if load is None:
+            load = _exam_load[exam_id] = dict.fromkeys(EXAM_LOAD_EVENTS, 0)
+        load[event] += 1
+
+
+def exam_load():
+    """Load figures of every exam counted since the server started"""
+    with _exam_load_lock:
+        return {exam_id: dict(load) for exam_id, load in _exam_load.items()}
+
 # Login route
 
 
@@ -243,6 +1807,164 @@ def teacher_login():
 
     return render_template('login.html', error=error)
 
+# Login admission
+#
+# When an exam is activated, a whole lab logs in within seconds, and each
+# login reads and writes the database several times. At most LOGIN_CONCURRENCY
+# logins (EXAM_LOGIN_CONCURRENCY) are processed at once; students beyond that
+# are given a place in a queue and sent to a waiting page, which checks
+# /api/login_status: every WAITING_POLL_INTERVAL seconds at the back of the
+# queue, down to every WAITING_FRONT_POLL_INTERVAL seconds at the front, so
+# free slots are taken quickly. The queue is served in order and lives in
+# memory, so a check costs no database work until the student is admitted;
+# their login, and with it the exam timer, starts then.
+# A place not checked for WAITING_TIMEOUT seconds (a closed tab) is given up
+# once it reaches the front. Places are numbered in arrival order, so a
+# student's place is their number minus that of the front of the queue, at
+# constant cost however long the queue; places given up further back still
+# count until then, so a place shown may be a little too far back.
+# EXAM_LOGIN_ADMISSION=0 processes every login straight away.
+LOGIN_ADMISSION_ENABLED = os.environ.get('EXAM_LOGIN_ADMISSION', '1') != '0'
+LOGIN_CONCURRENCY = int(os.environ.get('EXAM_LOGIN_CONCURRENCY', 8))
+WAITING_POLL_INTERVAL = 2          # seconds between a waiting student's checks
+WAITING_FRONT_POLL_INTERVAL = 0.25 # the same, for the next LOGIN_CONCURRENCY students
+WAITING_TIMEOUT = 30               # seconds without a check before a place is given up
+
+_logins_in_flight = 0
+_waiting_logins = OrderedDict()    # ticket -> queued login, oldest first
+_next_waiting_number = 0
+_admission_lock = threading.Lock()
+
+
+def _drop_stale_tickets(now):
+    while _waiting_logins:
+        front = next(iter(_waiting_logins.values()))
+        if now - front['checked'] <= WAITING_TIMEOUT:
+            break
+        _waiting_logins.popitem(last=False)
+
+
+def admit_login():
+    """Take a login slot for a new login if one is free and nobody is queued"""
+    global _logins_in_flight
+    with _admission_lock:
+        _drop_stale_tickets(time.time())
+        if _logins_in_flight < LOGIN_CONCURRENCY and not _waiting_logins:
+            _logins_in_flight += 1
+            return True
+    return False
+
+
+def queue_login(login):
+    """Give a login (dict of log_in_student's arguments) a place in the queue"""
+    global _next_waiting_number
+    ticket = secrets.token_urlsafe(16)
+    with _admission_lock:
+        _waiting_logins[ticket] = {'login': login, 'checked': time.time(),
+                                   'number': _next_waiting_number}
+        _next_waiting_number += 1
+    return ticket
+
+
+def admit_queued_login(ticket):
+    """
+    Take a login slot for a queued login whose turn has come.
+
+    Returns:
+        tuple: (queued login, None) once admitted, (None, place in the queue
+        counting from 1) while waiting, (None, None) for an unknown ticket
+    """
+    global _logins_in_flight
+    now = time.time()
+    with _admission_lock:
+        _drop_stale_tickets(now)
+        if ticket not in _waiting_logins:
+            return None, None
+        front = next(iter(_waiting_logins.values()))
+        position = _waiting_logins[ticket]['number'] - front['number']
+        if position < LOGIN_CONCURRENCY - _logins_in_flight:
+            _logins_in_flight += 1
+            return _waiting_logins.pop(ticket)['login'], None
+        _waiting_logins[ticket]['checked'] = now
+        return None, position + 1
+
+
+def release_login():
+    """Give back the slot of a finished login"""
+    global _logins_in_flight
+    with _admission_lock:
+        _logins_in_flight -= 1
+
+
+def log_in_student(name, student_number, access_code, ip_address):
+    """
+    Start or resume a student's exam session and store it in the Flask
+    session.
+
+    Returns:
+        str: Why the student cannot log in, or None once logged in
+    """
+    try:
+        # The student's exam, by code, room or the only open exam
+        try:
+            active_exam = find_student_exam(access_code, ip_address)
+        except ValueError as e:
+            return str(e)
+        exam = active_exam['exam']
+
+        # Check IP address
+        ip_restriction = records.ip_policy(ip_address)
+
+        if ip_restriction and ip_restriction['is_blocked'] and not ip_restriction['approved']:
+            return 'Your IP address is blocked. Please contact the teacher.'
+
+        # Check for existing session
+        existing_session = records.open_session(student_number, exam['id'])
+
+        if not existing_session:
+            if not active_exam['model_ids']:
+                # Create a default model if none exists (for backwards compatibility)
+                with get_db_connection(timeout=10) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "INSERT INTO exam_models (exam_id, model_name) VALUES (?, ?)",
+                        (exam['id'], "Default Model")
+                    )
+                    model_id = cursor.lastrowid
+                    conn.commit()
+                invalidate_model_content(exam['id'])
+                refresh_active_exams()
+            else:
+                # Randomly select a model from available models
+                model_id = random.choice(active_exam['model_ids'])
+
+            # Create new exam session
+            start_time = datetime.now()
+            end_time = start_time + timedelta(minutes=exam['duration'])
+
+            session_id = records.start_session(
+                name, student_number, exam['id'], model_id,
+                start_time, end_time, ip_address)
+            session['model_id'] = model_id
+        else:
+            session_id = existing_session['id']
+            session['model_id'] = existing_session['model_id']
+
+        session['student_name'] = name
+        session['student_number'] = student_number
+        session['exam_id'] = exam['id']
+        session['session_id'] = session_id
+
+        # Record IP address
+        if not ip_restriction:
+            records.record_ip(ip_address)
+
+        count_exam_load(exam['id'], 'logins')
+        return None
+    except DATABASE_BUSY_ERRORS as e:
+        print(f"Database error in student_login: {str(e)}")
+        return 'Database is busy. Please try again in a moment.'
+
 # Student login route (separate from teacher login)
 
 
@@ -252,104 +1974,144 @@ def student_login():
     if request.method == 'POST':
         name = request.form['name']
         student_number = request.form['student_number']
-        exam_id = request.form.get('exam_id')
+        access_code = request.form.get('exam_code', '')
 
         if not name or not student_number:
             error = 'Please enter both name and student number'
             return render_template('student_login.html', error=error)
 
-        # Check if an exam is active using our improved connection handler
-        try:
-            with get_db_connection(timeout=10) as conn:
-                cursor = conn.cursor()
-
-                # Get active exam
-                cursor.execute("SELECT * FROM exams WHERE is_active = 1")
-                exam = cursor.fetchone()
-
-                if not exam:
-                    error = 'No active exam available'
-                    return render_template('student_login.html', error=error)
-
-                # Check IP address
-                ip_address = get_real_ip()
-                cursor.execute(
-                    "SELECT * FROM ip_restrictions WHERE ip_address = ?", (ip_address,))
-                ip_restriction = cursor.fetchone()
-
-                if ip_restriction and ip_restriction['is_blocked'] and not ip_restriction['approved']:
-                    error = 'Your IP address is blocked. Please contact the teacher.'
-                    return render_template('student_login.html', error=error)
-
-                # Check for existing session
-                cursor.execute(
-                    """
-                    SELECT * FROM exam_sessions 
-                    WHERE student_number = ? AND exam_id = ? AND end_time > ?
-                    """,
-                    (student_number, exam['id'], datetime.now())
-                )
-                existing_session = cursor.fetchone()
+        login = {'name': name, 'student_number': student_number,
+                 'access_code': access_code, 'ip_address': get_real_ip()}
+        if LOGIN_ADMISSION_ENABLED and not admit_login():
+            # A mistyped code is reported now rather than after the wait
+            try:
+                find_student_exam(access_code, login['ip_address'])
+            except ValueError as e:
+                return render_template('student_login.html', error=str(e))
+            session['login_ticket'] = queue_login(login)
+            return redirect(url_for('waiting_room'))
 
-                if not existing_session:
-                    # Get available models for this exam
-                    cursor.execute(
-                        "SELECT * FROM exam_models WHERE exam_id = ?",
-                        (exam['id'],)
-                    )
-                    available_models = cursor.fetchall()
+        try:
+            error = log_in_student(**login)
+        finally:
+            if LOGIN_ADMISSION_ENABLED:
+                release_login()
+        if error:
+            return render_template('student_login.html', error=error)
+        return redirect(url_for('take_exam'))
 
-                    if not available_models:
-                        # Create a default model if none exists (for backwards compatibility)
-                        cursor.execute(
-                            "INSERT INTO exam_models (exam_id, model_name) VALUES (?, ?)",
-                            (exam['id'], "Default Model")
-                        )
-                        model_id = cursor.lastrowid
-                    else:
-                        # Randomly select a model from available models
-                        model = random.choice(available_models)
-                        model_id = model['id']
+    return render_template('student_login.html', error=error)
 
-                    # Create new exam session
-                    start_time = datetime.now()
-                    end_time = start_time + timedelta(minutes=exam['duration'])
+# Waiting room for logins beyond LOGIN_CONCURRENCY
 
-                    cursor.execute(
-                        """
-                        INSERT INTO exam_sessions 
-                        (student_name, student_number, exam_id, model_id, start_time, end_time, ip_address) 
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (name, student_number, exam['id'], model_id,
-                         start_time, end_time, ip_address)
-                    )
-                    session_id = cursor.lastrowid
-                    session['model_id'] = model_id
-                else:
-                    session_id = existing_session['id']
-                    session['model_id'] = existing_session['model_id']
 
-                session['student_name'] = name
-                session['student_number'] = student_number
-                session['exam_id'] = exam['id']
-                session['session_id'] = session_id
+@app.route('/waiting')
+def waiting_room():
+    if 'login_ticket' not in session:
+        return redirect(url_for('student_login'))
+    return render_template('waiting_room.html',
+                           poll_interval=WAITING_POLL_INTERVAL)
+
+
+@app.route('/api/login_status')
+def login_status():
+    ticket = session.get('login_ticket')
+    if not ticket:
+        return jsonify({'error': 'Not waiting to log in',
+                        'redirect': url_for('student_login')}), 404
+
+    login, position = admit_queued_login(ticket)
+    if login is None and position is None:
+        session.pop('login_ticket', None)
+        return jsonify({'error': 'Your place in the queue has expired, please log in again',
+                        'redirect': url_for('student_login')}), 404
+    if login is None:
+        batches_ahead = (position - 1) // LOGIN_CONCURRENCY + 1
+        response = jsonify({
+            'position': position,
+            'retry_after': min(WAITING_POLL_INTERVAL,
+                               WAITING_FRONT_POLL_INTERVAL * batches_ahead)})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    # Admitted: the login, and the exam timer, start now
+    session.pop('login_ticket', None)
+    try:
+        error = log_in_student(**login)
+    finally:
+        release_login()
+    if error:
+        return jsonify({'error': error, 'redirect': url_for('student_login')}), 409
+    return jsonify({'admitted': True, 'redirect': url_for('take_exam')})
+
+# Exam content of each (exam, model), shared by all students on that model:
+# the title, the question list and the rendered question panels, with a hash
+# of what they were built from as the version (the ETag). Requests are served
+# from memory; adding models or questions and finishing image processing call
+# invalidate_model_content(), and content built while that happened is not kept.
+_exam_contents = {}
+_exam_contents_lock = threading.Lock()
+_exam_contents_generation = 0
+
+
+def invalidate_model_content(exam_id=None):
+    """Drop the cached content of an exam's models (of every exam if None)"""
+    global _exam_contents_generation
+    with _exam_contents_lock:
+        _exam_contents_generation += 1
+        for key in [key for key in _exam_contents
+                    if exam_id is None or key[0] == exam_id]:
+            del _exam_contents[key]
+
+
+def model_content(exam_id, model_id):
+    """
+    The exam page content of a model, built once until invalidated.
 
-                # Record IP address
-                if not ip_restriction:
-                    cursor.execute(
-                        "INSERT INTO ip_restrictions (ip_address, is_blocked, approved) VALUES (?, 0, 1)",
-                        (ip_address,)
-                    )
+    Returns:
+        tuple: (version, payload), or (None, None) if the exam is gone
+    """
+    with _exam_contents_lock:
+        cached = _exam_contents.get((exam_id, model_id))
+        generation = _exam_contents_generation
+    if cached:
+        return cached
 
-                conn.commit()
-                return redirect(url_for('take_exam'))
-        except sqlite3.OperationalError as e:
-            print(f"Database error in student_login: {str(e)}")
-            error = 'Database is busy. Please try again in a moment.'
-            return render_template('student_login.html', error=error)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT title FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+        cursor.execute(
+            "SELECT model_name FROM exam_models WHERE id = ?", (model_id,))
+        model = cursor.fetchone()
+        cursor.execute("""
+            SELECT id, question_text, image_filename FROM questions
+            WHERE exam_id = ? AND model_id = ?
+            ORDER BY id
+            """, (exam_id, model_id))
+        questions = cursor.fetchall()
 
-    return render_template('student_login.html', error=error)
+    if not exam:
+        return None, None
+
+    content = [exam['title'], model['model_name'] if model else None,
+               [[question['id'], question['question_text'], question['image_filename'],
+                 question_image_urls(question['image_filename'])
+                 if question['image_filename'] else None]
+                for question in questions]]
+    version = hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+    payload = {
+        'exam': {'id': exam_id, 'title': exam['title']},
+        'model': {'id': model_id, 'name': model['model_name']} if model else None,
+        'questions': [{'id': question['id'], 'number': number}
+                      for number, question in enumerate(questions, 1)],
+        'html': render_template('exam_questions.html', questions=questions)
+    }
+    with _exam_contents_lock:
+        if generation == _exam_contents_generation:
+            _exam_contents[(exam_id, model_id)] = (version, payload)
+    return version, payload
 
 # Student exam page
 
@@ -359,87 +2121,181 @@ def take_exam():
     if 'student_name' not in session or 'student_number' not in session or 'exam_id' not in session or 'model_id' not in session:
         return redirect(url_for('student_login'))
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    # The page is the same for every student: its script loads the questions
+    # from /api/exam/content and the timer and answers from /api/exam/state
+    response = make_response(render_template('exam.html'))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
-        # Get exam details
-        cursor.execute("SELECT * FROM exams WHERE id = ?",
-                       (session['exam_id'],))
-        exam = cursor.fetchone()
+# Exam content API endpoints
 
-        # Get exam model
-        cursor.execute("SELECT * FROM exam_models WHERE id = ?",
-                       (session['model_id'],))
-        model = cursor.fetchone()
 
-        # Get questions for this specific model
-        cursor.execute("""
-            SELECT * FROM questions 
-            WHERE exam_id = ? AND model_id = ?
-            ORDER BY id
-            """,
-                       (session['exam_id'], session['model_id'])
-                       )
-        questions = cursor.fetchall()
+@app.route('/api/exam/content')
+def exam_content():
+    if 'student_name' not in session or 'student_number' not in session or 'exam_id' not in session or 'model_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
 
-        # Get student's session info
-        cursor.execute("SELECT * FROM exam_sessions WHERE id = ?",
-                       (session['session_id'],))
-        exam_session = cursor.fetchone()
+    try:
+        version, payload = model_content(session['exam_id'], session['model_id'])
+    except DATABASE_BUSY_ERRORS as e:
+        print(f"Database error in exam_content: {str(e)}")
+        return jsonify({'error': 'Database is busy, please try again'}), 503
 
-        if not exam_session:
-            return redirect(url_for('student_login'))
+    if payload is None:
+        return jsonify({'error': 'Exam not found'}), 404
 
-        end_time = exam_session['end_time']
-        remaining_seconds = max(0, (datetime.fromisoformat(
-            end_time) - datetime.now()).total_seconds())
+    # Identical for every student on the model; a weak validator because the
+    # body may be sent compressed
+    response = jsonify(payload)
+    response.set_etag(version, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
-        # Get previous submission if exists
-        cursor.execute(
-            """
-            SELECT * FROM submissions 
-            WHERE student_number = ? AND exam_id = ? AND model_id = ?
-            ORDER BY submission_time DESC LIMIT 1
-            """,
-            (session['student_number'],
-             session['exam_id'], session['model_id'])
-        )
-        submission = cursor.fetchone()
 
-        # Initialize with empty answers
-        answers = {}
-        for question in questions:
-            answers[question['id']] = ""
+@app.route('/api/exam/state')
+def exam_state():
+    if 'student_name' not in session or 'student_number' not in session or 'exam_id' not in session or 'model_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        end_time = records.session_end_time(session.get('session_id'), session['exam_id'])
+        if not end_time:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        # Latest saved answers, if the student has saved before
+        version, answers = records.latest_answers(
+            session['student_number'], session['exam_id'], session['model_id'])
+    except DATABASE_BUSY_ERRORS as e:
+        print(f"Database error in exam_state: {str(e)}")
+        return jsonify({'error': 'Database is busy, please try again'}), 503
 
-        # If submission exists, get the answers for each question
-        if submission:
-            # For backwards compatibility, store the old full submission
-            prev_code = submission['code_content']
+    remaining_seconds = max(0, (end_time - datetime.now()).total_seconds())
+
+    response = jsonify({
+        'remaining_seconds': int(remaining_seconds),
+        'save_interval': autosave_interval(),
+        'answers': answers,
+        'version': version
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Auto-save rate limiting
+#
+# The exam page auto-saves every AUTOSAVE_INTERVAL seconds
+# (EXAM_AUTOSAVE_INTERVAL). Two token buckets keep a misbehaving page or a
+# save storm from piling onto the database: each exam session may save
+# AUTOSAVE_SESSION_RATE times per second with bursts of AUTOSAVE_SESSION_BURST
+# (429 beyond that), and all students together AUTOSAVE_GLOBAL_RATE times per
+# second with bursts of AUTOSAVE_GLOBAL_BURST (503 beyond that). Refused and
+# busy saves carry Retry-After, and every answer suggests when to save next
+# (next_save, in seconds): longer while the global bucket is below half full.
+# The page waits that long, backing off with jitter after each refusal, so
+# overload turns into slower saves instead of a wave of retries. Final
+# submissions are never limited. EXAM_AUTOSAVE_LIMIT=0 turns the limits off.
+AUTOSAVE_LIMIT_ENABLED = os.environ.get('EXAM_AUTOSAVE_LIMIT', '1') != '0'
+AUTOSAVE_INTERVAL = int(os.environ.get('EXAM_AUTOSAVE_INTERVAL', 600))
+AUTOSAVE_SESSION_RATE = float(os.environ.get('EXAM_AUTOSAVE_SESSION_RATE', 0.2))
+AUTOSAVE_SESSION_BURST = 5
+AUTOSAVE_GLOBAL_RATE = float(os.environ.get('EXAM_AUTOSAVE_GLOBAL_RATE', 100))
+AUTOSAVE_GLOBAL_BURST = int(os.environ.get('EXAM_AUTOSAVE_GLOBAL_BURST', 300))
+AUTOSAVE_BUSY_RETRY = 5            # seconds to wait after a busy database
+AUTOSAVE_BUCKETS_MAX = 10000       # session buckets kept before dropping idle ones
+
+# Buckets are [tokens, last refill (time.monotonic())]
+_session_save_buckets = {}
+_global_save_bucket = [AUTOSAVE_GLOBAL_BURST, time.monotonic()]
+_save_buckets_lock = threading.Lock()
+
+
+def _take_token(bucket, rate, burst, now):
+    """
+    Refill a bucket for the time passed and take a token from it.
 
-            # Get individual answers for each question
-            cursor.execute(
-                """
-                SELECT question_id, answer_content FROM question_answers
-                WHERE submission_id = ?
-                """,
-                (submission['id'],)
-            )
-            question_answers = cursor.fetchall()
+    Returns:
+        float: 0 if a token was taken, else seconds until one is available
+    """
+    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        return 0
+    return (1 - bucket[0]) / rate
 
-            for answer in question_answers:
-                answers[answer['question_id']] = answer['answer_content']
-        else:
-            prev_code = ""
-
-        return render_template(
-            'exam.html',
-            exam=exam,
-            model=model,
-            questions=questions,
-            remaining_seconds=int(remaining_seconds),
-            prev_code=prev_code,
-            answers=answers
-        )
+
+def take_autosave_token(session_key):
+    """
+    Take a token from an exam session's bucket and from the global one.
+
+    Returns:
+        tuple: (None, 0) if the save may go ahead, else (429 or 503, seconds
+        until it may be tried again)
+    """
+    now = time.monotonic()
+    with _save_buckets_lock:
+        if len(_session_save_buckets) > AUTOSAVE_BUCKETS_MAX:
+            # Buckets that have refilled completely are the same as new ones
+            idle = AUTOSAVE_SESSION_BURST / AUTOSAVE_SESSION_RATE
+            for key in [key for key, bucket in _session_save_buckets.items()
+                        if now - bucket[1] > idle]:
+                del _session_save_buckets[key]
+
+        bucket = _session_save_buckets.setdefault(
+            session_key, [AUTOSAVE_SESSION_BURST, now])
+        wait = _take_token(bucket, AUTOSAVE_SESSION_RATE, AUTOSAVE_SESSION_BURST, now)
+        if wait:
+            return 429, wait
+        wait = _take_token(_global_save_bucket, AUTOSAVE_GLOBAL_RATE,
+                           AUTOSAVE_GLOBAL_BURST, now)
+        if wait:
+            bucket[0] += 1  # Not saved, so not spent
+            return 503, wait
+    return None, 0
+
+
+def autosave_interval():
+    """Seconds the exam page should wait before its next auto-save"""
+    if not AUTOSAVE_LIMIT_ENABLED:
+        return AUTOSAVE_INTERVAL
+    with _save_buckets_lock:
+        tokens, updated = _global_save_bucket
+    tokens += (time.monotonic() - updated) * AUTOSAVE_GLOBAL_RATE
+    # Saves are coming in faster than the global rate: spread them out more
+    if tokens < AUTOSAVE_GLOBAL_BURST / 2:
+        return AUTOSAVE_INTERVAL * 2
+    return AUTOSAVE_INTERVAL
+
+
+def autosave_refused(error, status, retry_after):
+    """A refused auto-save, telling the page when to try again"""
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'error': error, 'retry_after': retry_after,
+                        'next_save': autosave_interval()})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def submitted_answers():
+    """
+    The answers (question id -> text) and combined code sent with an
+    auto-save or submission.
+
+    Returns:
+        tuple: (answers, combined code), or (None, None) if the body does not
+        have that shape
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return None, None
+    answers = payload.get('answers', {})  # Get answers for each question
+    combined_code = payload.get('combinedCode', '')  # For backward compatibility
+    if (not isinstance(answers, dict) or not isinstance(combined_code, str)
+            or not all(str(question_id).isdigit() and isinstance(answer, str)
+                       for question_id, answer in answers.items())):
+        return None, None
+    return answers, combined_code
 
 # Auto-save submission API endpoint
 
@@ -449,65 +2305,33 @@ def auto_save():
     if 'student_name' not in session or 'student_number' not in session or 'exam_id' not in session or 'model_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    answers = request.json.get('answers', {})  # Get answers for each question
-    combined_code = request.json.get(
-        'combinedCode', '')  # For backward compatibility
-    ip_address = get_real_ip()
-
-    # Use the new connection helper with retry mechanism
-    try:
-        with get_db_connection(timeout=30, max_retries=3) as conn:
-            cursor = conn.cursor()
-
-            # Get most recent version number
-            cursor.execute(
-                """
-                SELECT MAX(version) as max_version FROM submissions 
-                WHERE student_number = ? AND exam_id = ? AND model_id = ?
-                """,
-                (session['student_number'],
-                 session['exam_id'], session['model_id'])
-            )
-            result = cursor.fetchone()
-            new_version = (result[0] or 0) + 1
+    answers, combined_code = submitted_answers()
+    if answers is None:
+        return jsonify({'error': 'Invalid answers'}), 400
 
-            # Insert new submission
-            cursor.execute(
-                """
-                INSERT INTO submissions 
-                (student_name, student_number, exam_id, model_id, submission_time, ip_address, code_content, version) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    session['student_name'],
-                    session['student_number'],
-                    session['exam_id'],
-                    session['model_id'],
-                    datetime.now(),
-                    ip_address,
-                    combined_code,
-                    new_version
-                )
-            )
-            submission_id = cursor.lastrowid
+    if AUTOSAVE_LIMIT_ENABLED:
+        status, retry_after = take_autosave_token(
+            (session['exam_id'], session.get('session_id')))
+        if status == 429:
+            return autosave_refused('Saving too often, please wait', 429, retry_after)
+        if status == 503:
+            return autosave_refused('Server is busy, saving again shortly', 503, retry_after)
 
-            # Save individual answers for each question
-            for question_id, answer_content in answers.items():
-                cursor.execute(
-                    """
-                    INSERT INTO question_answers
-                    (submission_id, question_id, answer_content)
-                    VALUES (?, ?, ?)
-                    """,
-                    (submission_id, int(question_id), answer_content)
-                )
+    ip_address = get_real_ip()
 
-            conn.commit()
-            return jsonify({'success': True, 'version': new_version})
-    except sqlite3.OperationalError as e:
+    try:
+        new_version = records.save_submission(
+            session['student_name'], session['student_number'],
+            session['exam_id'], session['model_id'],
+            ip_address, combined_code, answers)
+        count_exam_load(session['exam_id'], 'auto_saves')
+        return jsonify({'success': True, 'version': new_version,
+                        'next_save': autosave_interval()})
+    except DATABASE_BUSY_ERRORS as e:
         # Log the error for debugging
         print(f"Database error in auto_save: {str(e)}")
-        return jsonify({'error': 'Database is busy, please try again'}), 503
+        return autosave_refused('Database is busy, please try again', 503,
+                                AUTOSAVE_BUSY_RETRY)
 
 # Final submission endpoint
 
@@ -517,80 +2341,30 @@ def submit_exam():
     if 'student_name' not in session or 'student_number' not in session or 'exam_id' not in session or 'model_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    answers = request.json.get('answers', {})  # Get answers for each question
-    combined_code = request.json.get(
-        'combinedCode', '')  # For backward compatibility
+    answers, combined_code = submitted_answers()
+    if answers is None:
+        return jsonify({'error': 'Invalid answers'}), 400
     ip_address = get_real_ip()
 
     try:
-        with get_db_connection(timeout=30, max_retries=3) as conn:
-            cursor = conn.cursor()
-
-            # Get most recent version number
-            cursor.execute(
-                """
-                SELECT MAX(version) as max_version FROM submissions 
-                WHERE student_number = ? AND exam_id = ? AND model_id = ?
-                """,
-                (session['student_number'],
-                 session['exam_id'], session['model_id'])
-            )
-            result = cursor.fetchone()
-            new_version = (result[0] or 0) + 1
-
-            # Insert final submission
-            cursor.execute(
-                """
-                INSERT INTO submissions 
-                (student_name, student_number, exam_id, model_id, submission_time, ip_address, code_content, version) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    session['student_name'],
-                    session['student_number'],
-                    session['exam_id'],
-                    session['model_id'],
-                    datetime.now(),
-                    ip_address,
-                    combined_code,
-                    new_version
-                )
-            )
-            submission_id = cursor.lastrowid
-
-            # Save individual answers for each question
-            for question_id, answer_content in answers.items():
-                cursor.execute(
-                    """
-                    INSERT INTO question_answers
-                    (submission_id, question_id, answer_content)
-                    VALUES (?, ?, ?)
-                    """,
-                    (submission_id, int(question_id), answer_content)
-                )
-
-            # Block IP after submission
-            cursor.execute(
-                """
-                UPDATE ip_restrictions 
-                SET is_blocked = 1, blocked_time = ?, approved = 0 
-                WHERE ip_address = ?
-                """,
-                (datetime.now(), ip_address)
-            )
-
-            # Clear session
-            session.pop('student_name', None)
-            session.pop('student_number', None)
-            session.pop('exam_id', None)
-            session.pop('model_id', None)
-            session.pop('session_id', None)
-
-            conn.commit()
-            return jsonify({'success': True})
-    except sqlite3.OperationalError as e:
+        # Saved as final, and the IP address is blocked after submission
+        records.save_submission(
+            session['student_name'], session['student_number'],
+            session['exam_id'], session['model_id'],
+            ip_address, combined_code, answers, final=True)
+    except DATABASE_BUSY_ERRORS as e:
         print(f"Database error in submit_exam: {str(e)}")
         return jsonify({'error': 'Database is busy, please try again'}), 503
+    count_exam_load(session['exam_id'], 'submissions')
+
+    # Clear session
+    session.pop('student_name', None)
+    session.pop('student_number', None)
+    session.pop('exam_id', None)
+    session.pop('model_id', None)
+    session.pop('session_id', None)
+
+    return jsonify({'success': True})
 
 # Teacher dashboard route
 
@@ -605,7 +2379,9 @@ def teacher_dashboard():
         cursor.execute("SELECT * FROM exams ORDER BY id DESC")
         exams = cursor.fetchall()
 
-    return render_template('teacher_dashboard.html', exams=exams)
+    return render_template('teacher_dashboard.html', exams=exams,
+                           exam_load=exam_load(),
+                           message=request.args.get('message'))
 
 # Create exam route
 
@@ -719,6 +2495,9 @@ def create_exam_models(exam_id):
 
             conn.commit()
 
+        # An active exam assigns the new models from now on
+        invalidate_model_content(exam_id)
+        refresh_active_exams()
         return redirect(url_for('teacher_dashboard'))
 
     # For GET request, show form to create models
@@ -775,39 +2554,155 @@ def view_exam_models(exam_id):
             for q in questions_rows:
                 questions.append(dict(q))
 
-            model_questions[model_id] = questions
-            print(
-                f"Model {model_id}: {model['model_name']} has {len(questions)} questions")
+            model_questions[model_id] = questions
+            print(
+                f"Model {model_id}: {model['model_name']} has {len(questions)} questions")
+
+    return render_template(
+        'view_exam_models.html',
+        exam=exam,
+        models=models_list,
+        model_questions=model_questions
+    )
+
+# Activate exam route
+
+
+@app.route('/teacher/activate_exam/<int:exam_id>')
+def activate_exam(exam_id):
+    if 'role' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
+
+    # A new exam's submissions go to a shard of their own, if enabled
+    if SHARDS_ENABLED and STORAGE_BACKEND == 'sqlite':
+        assign_exam_shard(exam_id)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Archived exams cannot take new submissions
+        cursor.execute("SELECT * FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+        if not exam or exam['archive_path']:
+            return redirect(url_for('teacher_dashboard'))
+
+        # Other active exams stay active, as long as students can still tell
+        # them apart at login. An exam without code or IP ranges takes over
+        # from the one that was open to everyone before.
+        index = active_exams()
+        replaced = None
+        if not exam['access_code'] and not exam['ip_ranges']:
+            replaced = index['default']
+        conflict = access_conflict(
+            exam, [entry['exam'] for other_id, entry in index['exams'].items()
+                   if other_id not in (exam_id, replaced)])
+        if conflict:
+            return redirect(url_for(
+                'teacher_dashboard', message=f"Could not activate {exam['title']}: {conflict}"))
+
+        if replaced is not None and replaced != exam_id:
+            cursor.execute(
+                "UPDATE exams SET is_active = 0 WHERE id = ?", (replaced,))
+
+        # Activate selected exam
+        cursor.execute(
+            "UPDATE exams SET is_active = 1 WHERE id = ?", (exam_id,))
+
+        conn.commit()
+
+    refresh_active_exams()
+    return redirect(url_for('teacher_dashboard'))
+
+# Deactivate exam route
+
 
-    return render_template(
-        'view_exam_models.html',
-        exam=exam,
-        models=models_list,
-        model_questions=model_questions
-    )
+@app.route('/teacher/deactivate_exam/<int:exam_id>')
+def deactivate_exam(exam_id):
+    if 'role' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
 
-# Activate exam route
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE exams SET is_active = 0 WHERE id = ?", (exam_id,))
+        conn.commit()
 
+    refresh_active_exams()
+    return redirect(url_for('teacher_dashboard'))
 
-@app.route('/teacher/activate_exam/<int:exam_id>')
-def activate_exam(exam_id):
+# Exam access route (code and IP ranges that select the exam at login)
+
+
+@app.route('/teacher/exam_access/<int:exam_id>', methods=['POST'])
+def exam_access(exam_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
+    access_code = request.form.get('access_code', '').strip() or None
+    ip_ranges = request.form.get('ip_ranges', '').strip()
+    try:
+        # Stored normalised, one network per range
+        ip_ranges = ', '.join(str(network) for network in parse_ip_ranges(ip_ranges)) or None
+    except ValueError as e:
+        return redirect(url_for('teacher_dashboard', message=f"Invalid IP range: {str(e)}"))
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute("SELECT * FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+        if not exam:
+            return redirect(url_for('teacher_dashboard'))
 
-        # Deactivate all exams
-        cursor.execute("UPDATE exams SET is_active = 0")
+        if exam['is_active']:
+            conflict = access_conflict(
+                dict(exam, access_code=access_code, ip_ranges=ip_ranges),
+                [entry['exam'] for other_id, entry in active_exams()['exams'].items()
+                 if other_id != exam_id])
+            if conflict:
+                return redirect(url_for(
+                    'teacher_dashboard', message=f"Could not change {exam['title']}: {conflict}"))
 
-        # Activate selected exam
         cursor.execute(
-            "UPDATE exams SET is_active = 1 WHERE id = ?", (exam_id,))
-
+            "UPDATE exams SET access_code = ?, ip_ranges = ? WHERE id = ?",
+            (access_code, ip_ranges, exam_id))
         conn.commit()
 
+    refresh_active_exams()
     return redirect(url_for('teacher_dashboard'))
 
+# Exam load route (per-exam counters since the server started)
+
+
+@app.route('/teacher/exam_load')
+def exam_load_status():
+    if 'role' not in session or session['role'] != 'teacher':
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    load = exam_load()
+    return jsonify({
+        'active_exams': sorted(active_exams()['exams']),
+        'exams': {str(exam_id): counts for exam_id, counts in load.items()}
+    })
+
+# Archive exam route
+
+
+@app.route('/teacher/archive_exam/<int:exam_id>', methods=['POST'])
+def archive_finished_exam(exam_id):
+    if 'role' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
+
+    try:
+        archived = archive_exam(exam_id)
+        message = f"Archived {archived} submissions"
+    except ValueError as e:
+        message = f"Could not archive the exam: {str(e)}"
+    except sqlite3.OperationalError as e:
+        print(f"Database error in archive_exam: {str(e)}")
+        message = "Database is busy, please try again"
+
+    return redirect(url_for('teacher_dashboard', message=message))
+
 # View submissions route
 
 
@@ -816,7 +2711,7 @@ def view_submissions(exam_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
 
         # Get exam details
@@ -831,53 +2726,44 @@ def view_submissions(exam_id):
         # Convert to dictionary for easy lookup in template
         models = {model['id']: model for model in exam_models}
 
-        # Get all unique students who submitted
-        cursor.execute(
-            """
-            SELECT DISTINCT student_name, student_number, ip_address 
-            FROM submissions 
-            WHERE exam_id = ?
-            """,
-            (exam_id,)
-        )
-        students = cursor.fetchall()
+    if not exam:
+        return redirect(url_for('teacher_dashboard'))
 
-        # Get latest submissions for each student (now showing all instead of just 3)
-        student_submissions = {}
-        for student in students:
-            cursor.execute(
-                """
-                SELECT * FROM submissions 
-                WHERE student_number = ? AND exam_id = ? 
-                ORDER BY submission_time DESC
-                """,
-                (student['student_number'], exam_id)
-            )
-            submissions = cursor.fetchall()
-
-            # Mark the first one (most recent) as the latest
-            if submissions:
-                # Convert submissions to list to allow modifications
-                submissions_list = []
-                for i, sub in enumerate(submissions):
-                    # Convert Row to dict
-                    sub_dict = dict(sub)
-                    # Add is_latest flag
-                    # Only the first (most recent) is latest
-                    sub_dict['is_latest'] = (i == 0)
-                    submissions_list.append(sub_dict)
-
-                student_submissions[student['student_number']
-                                    ] = submissions_list
-            else:
-                student_submissions[student['student_number']] = []
+    # Archived exams are read from their archive file
+    students, student_submissions, checks = records.exam_submissions(exam)
+
+    # Pre-check outcome of each student's latest submission: its most
+    # serious answer status
+    latest_ids = {subs[0]['id']: number
+                  for number, subs in student_submissions.items() if subs}
+    check_statuses = {}
+    for submission_id, status in checks:
+        status = status or sql_grader.CHECK_PENDING
+        number = latest_ids[submission_id]
+        current = check_statuses.get(number, sql_grader.CHECK_OK)
+        check_statuses[number] = min(
+            status, current, key=sql_grader.CHECK_SEVERITY.index)
+
+    # Filter and sort students by pre-check status
+    check_filter = request.args.get('check', '')
+    sort_by = request.args.get('sort', '')
+    if check_filter:
+        students = [student for student in students
+                    if check_statuses.get(student['student_number']) == check_filter]
+    if sort_by == 'check':
+        students = sorted(students, key=lambda student: sql_grader.CHECK_SEVERITY.index(
+            check_statuses.get(student['student_number'], sql_grader.CHECK_PENDING)))
 
     return render_template(
         'submissions.html',
         exam=exam,
         students=students,
         student_submissions=student_submissions,
-        models=models
+        models=models,
+        check_statuses=check_statuses,
+        check_options=sql_grader.CHECK_SEVERITY,
+        check_filter=check_filter,
+        sort_by=sort_by
     )
 
 # Grade submission route
@@ -888,92 +2774,31 @@ def grade_submission(submission_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-
-        # Get submission details
-        cursor.execute("SELECT * FROM submissions WHERE id = ?",
-                       (submission_id,))
-        submission = cursor.fetchone()
+    # Submissions of archived or sharded exams are only found in the exam's
+    # own database
+    exam = None
+    if request.args.get('exam_id', type=int):
+        with get_read_connection() as conn:
+            exam = conn.execute(
+                "SELECT * FROM exams WHERE id = ?",
+                (request.args.get('exam_id', type=int),)).fetchone()
+    archived_exam = exam if exam and exam['archive_path'] else None
+
+    details = records.submission_details(submission_id, exam=exam)
+    # Submission ids are only unique within one database
+    if not details or (exam and details['submission']['exam_id'] != exam['id']):
+        return redirect(url_for('teacher_dashboard'))
+    submission = details['submission']
+    is_latest = details['is_latest']
 
-        if not submission:
-            return redirect(url_for('teacher_dashboard'))
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
 
         # Get the model info for this submission
         cursor.execute("SELECT * FROM exam_models WHERE id = ?",
                        (submission['model_id'],))
         model = cursor.fetchone()
 
-        # Check if this is the latest submission for this student/exam
-        cursor.execute(
-            """
-            SELECT id FROM submissions 
-            WHERE student_number = ? AND exam_id = ? 
-            ORDER BY submission_time DESC LIMIT 1
-            """,
-            (submission['student_number'], submission['exam_id'])
-        )
-        latest_submission = cursor.fetchone()
-        is_latest = latest_submission and latest_submission['id'] == submission_id
-
-        # For POST requests (when submitting a grade)
-        if request.method == 'POST':
-            # Only allow grading if this is the latest submission
-            if not is_latest:
-                return render_template(
-                    'grade.html',
-                    submission=submission,
-                    model=model,
-                    error_message="Only the latest submission can be graded. This is not the latest submission.",
-                    is_latest=is_latest,
-                    can_grade=False
-                )
-
-            mark = request.form['mark']
-            comment = request.form['comment']
-
-            # Try to convert mark to float if it looks like a number
-            try:
-                # Check if it's numeric
-                if mark and mark.replace('.', '', 1).isdigit():
-                    mark = float(mark)
-            except (ValueError, TypeError):
-                # If conversion fails, keep it as a string
-                pass
-
-            # Check if grade already exists
-            cursor.execute(
-                "SELECT * FROM grades WHERE submission_id = ?", (submission_id,))
-            existing_grade = cursor.fetchone()
-
-            if existing_grade:
-                cursor.execute(
-                    """
-                    UPDATE grades 
-                    SET mark = ?, comment = ?, graded_by = ?, graded_at = ? 
-                    WHERE submission_id = ?
-                    """,
-                    (mark, comment, session['user_id'],
-                     datetime.now(), submission_id)
-                )
-            else:
-                cursor.execute(
-                    """
-                    INSERT INTO grades 
-                    (submission_id, mark, comment, graded_by, graded_at) 
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (submission_id, mark, comment,
-                     session['user_id'], datetime.now())
-                )
-
-            return redirect(url_for('view_submissions', exam_id=submission['exam_id']))
-
-        # Get existing grade if any
-        cursor.execute(
-            "SELECT * FROM grades WHERE submission_id = ?", (submission_id,))
-        grade = cursor.fetchone()
-
         # Get exam questions for this specific model
         cursor.execute(
             """
@@ -985,106 +2810,264 @@ def grade_submission(submission_id):
         )
         questions = cursor.fetchall()
 
-        # Get individual question answers
-        cursor.execute(
-            """
-            SELECT question_id, answer_content FROM question_answers
-            WHERE submission_id = ?
-            """,
-            (submission_id,)
-        )
-        question_answers_rows = cursor.fetchall()
+    # For POST requests (when submitting a grade)
+    if request.method == 'POST':
+        # Only allow grading if this is the latest submission
+        if not is_latest:
+            return render_template(
+                'grade.html',
+                submission=submission,
+                model=model,
+                error_message="Only the latest submission can be graded. This is not the latest submission.",
+                is_latest=is_latest,
+                can_grade=False
+            )
+
+        if archived_exam:
+            return render_template(
+                'grade.html',
+                submission=submission,
+                model=model,
+                error_message="This exam is archived. Its grades can no longer be changed.",
+                is_latest=is_latest,
+                can_grade=False
+            )
+
+        mark = request.form['mark']
+        comment = request.form['comment']
 
-        # Convert to dictionary for easier access in template
-        question_answers = {}
-        for row in question_answers_rows:
-            question_answers[row['question_id']] = row['answer_content']
+        # Try to convert mark to float if it looks like a number
+        try:
+            # Check if it's numeric
+            if mark and mark.replace('.', '', 1).isdigit():
+                mark = float(mark)
+        except (ValueError, TypeError):
+            # If conversion fails, keep it as a string
+            pass
+
+        records.save_grade(submission_id, mark, comment, session['user_id'],
+                           exam_id=submission['exam_id'])
+        return redirect(url_for('view_submissions', exam_id=submission['exam_id']))
+
+    # Convert to dictionary for easier access in template
+    question_answers = {}
+    answer_checks = {}
+    for row in details['answers']:
+        question_answers[row['question_id']] = row['answer_content']
+        answer_checks[row['question_id']] = row
+
+    # Suggested marks from the SQL auto-grader, if it has been run
+    auto_grades = details['auto_grades']
 
     return render_template(
         'grade.html',
         submission=submission,
         model=model,
-        grade=grade,
+        grade=details['grade'],
         questions=questions,
         question_answers=question_answers,
+        answer_checks=answer_checks,
+        auto_grades=auto_grades,
+        suggested_total=sum(ag['suggested_mark'] or 0
+                            for ag in auto_grades.values()),
         is_latest=is_latest,
-        can_grade=is_latest
+        can_grade=is_latest and not archived_exam
     )
 
-# IP management route
+# SQL auto-grader setup route
 
 
-@app.route('/teacher/ip_management')
-def ip_management():
+@app.route('/teacher/autograde/<int:exam_id>', methods=['GET', 'POST'])
+def autograde_setup(exam_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
-        # Get all IP restrictions
-        cursor.execute("SELECT * FROM ip_restrictions ORDER BY id DESC")
-        ip_restrictions = cursor.fetchall()
-
-        # Convert to list of dictionaries for easier manipulation
-        ip_data = []
-        for ip in ip_restrictions:
-            ip_dict = dict(ip)
-
-            # Get the last student who logged in with this IP
-            cursor.execute("""
-                SELECT student_name, student_number, submission_time 
-                FROM submissions 
-                WHERE ip_address = ? 
-                ORDER BY submission_time DESC 
-                LIMIT 1
-            """, (ip['ip_address'],))
-
-            last_student = cursor.fetchone()
-            if last_student:
-                ip_dict['last_student_name'] = last_student['student_name']
-                ip_dict['last_student_number'] = last_student['student_number']
-                ip_dict['last_login_time'] = last_student['submission_time']
-            else:
-                # Also check exam_sessions for cases where students logged in but didn't submit
-                cursor.execute("""
-                    SELECT student_name, student_number, start_time 
-                    FROM exam_sessions 
-                    WHERE ip_address = ? 
-                    ORDER BY start_time DESC 
-                    LIMIT 1
-                """, (ip['ip_address'],))
-
-                last_session = cursor.fetchone()
-                if last_session:
-                    ip_dict['last_student_name'] = last_session['student_name']
-                    ip_dict['last_student_number'] = last_session['student_number']
-                    ip_dict['last_login_time'] = last_session['start_time']
-                else:
-                    ip_dict['last_student_name'] = None
-                    ip_dict['last_student_number'] = None
-                    ip_dict['last_login_time'] = None
+        cursor.execute("SELECT * FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
 
-            ip_data.append(ip_dict)
+        if not exam:
+            return redirect(url_for('teacher_dashboard'))
 
-    return render_template('ip_management.html', ip_restrictions=ip_data)
+        cursor.execute(
+            "SELECT * FROM questions WHERE exam_id = ? ORDER BY model_id, id", (exam_id,))
+        questions = cursor.fetchall()
 
-# Approve IP route
+        # Save the reference dataset and expected query of every question
+        if request.method == 'POST':
+            changed_schemas = []
+            for question in questions:
+                qid = question['id']
+                dataset_sql = request.form.get(
+                    f'dataset_sql_{qid}', '').strip() or None
+                try:
+                    points = float(request.form.get(f'points_{qid}', 1))
+                except ValueError:
+                    points = 1
+
+                # Answers were pre-checked against the old schema
+                if dataset_sql != question['dataset_sql']:
+                    changed_schemas.append(qid)
+
+                cursor.execute(
+                    """
+                    UPDATE questions
+                    SET dataset_sql = ?, expected_query = ?, order_sensitive = ?, points = ?
+                    WHERE id = ?
+                    """,
+                    (
+                        dataset_sql,
+                        request.form.get(f'expected_query_{qid}', '').strip() or None,
+                        1 if request.form.get(f'order_sensitive_{qid}') else 0,
+                        points,
+                        qid
+                    )
+                )
+            conn.commit()
+            for qid in changed_schemas:
+                records.reset_answer_checks(qid, exam_id)
+            if changed_schemas:
+                _answer_recheck.set()
+            return redirect(url_for('autograde_setup', exam_id=exam_id))
+
+        cursor.execute(
+            "SELECT * FROM exam_models WHERE exam_id = ? ORDER BY id", (exam_id,))
+        models = [dict(model) for model in cursor.fetchall()]
 
+        model_questions = {model['id']: [] for model in models}
+        for question in questions:
+            model_questions.setdefault(
+                question['model_id'], []).append(dict(question))
 
-@app.route('/teacher/approve_ip/<int:ip_id>')
-def approve_ip(ip_id):
+    # Outcome of the last grading run over the latest submissions
+    status_counts = records.auto_grade_counts(exam_id)
+
+    return render_template(
+        'autograde.html',
+        exam=exam,
+        models=models,
+        model_questions=model_questions,
+        status_counts=status_counts,
+        summary=request.args.get('summary')
+    )
+
+# Run SQL auto-grader route
+
+
+@app.route('/teacher/autograde/<int:exam_id>/run', methods=['POST'])
+def run_autograde(exam_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                """
+                SELECT id, dataset_sql, expected_query, order_sensitive, points
+                FROM questions
+                WHERE exam_id = ? AND expected_query IS NOT NULL
+                """,
+                (exam_id,)
+            )
+            questions = {
+                row['id']: {
+                    'dataset_sql': row['dataset_sql'],
+                    'expected_query': row['expected_query'],
+                    'order_sensitive': bool(row['order_sensitive']),
+                    'points': row['points'] if row['points'] is not None else 1
+                }
+                for row in cursor.fetchall()
+            }
+
+            # Only each student's latest submission is graded
+            answers = records.latest_exam_answers(exam_id)
+
+            # Earlier outcomes for the current version of each question;
+            # outcomes for older versions can never be used again, and time
+            # and memory failures are retried
+            cache = {}
+            retried = ','.join('?' * len(sql_grader.UNCACHED_STATUSES))
+            for question_id, spec in questions.items():
+                reference = sql_grader.reference_hash(spec)
+                cursor.execute(
+                    f"""
+                    DELETE FROM autograde_cache WHERE question_id = ?
+                    AND (reference_hash != ? OR status IN ({retried}))
+                    """,
+                    (question_id, reference) + sql_grader.UNCACHED_STATUSES
+                )
+                cursor.execute(
+                    """
+                    SELECT answer_hash, status, detail FROM autograde_cache
+                    WHERE question_id = ? AND reference_hash = ?
+                    """,
+                    (question_id, reference)
+                )
+                for row in cursor.fetchall():
+                    cache[(question_id, reference, row['answer_hash'])] = (
+                        row['status'], row['detail'])
+            conn.commit()
+            known = set(cache)
+    except DATABASE_BUSY_ERRORS as e:
+        print(f"Database error in run_autograde: {str(e)}")
+        return redirect(url_for('autograde_setup', exam_id=exam_id,
+                                summary="Database is busy, please try again"))
+
+    # Runs outside the connection so grading never holds a database lock
+    started = time.time()
+    results = sql_grader.grade_answers(questions, answers, cache=cache)
+    elapsed = time.time() - started
+
+    records.save_auto_grades(results, datetime.now(), exam_id)
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE ip_restrictions SET is_blocked = 0, approved = 1 WHERE id = ?",
-            (ip_id,)
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO autograde_cache
+            (question_id, reference_hash, answer_hash, status, detail)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [key + outcome for key, outcome in cache.items()
+             if key not in known]
         )
         conn.commit()
 
+    correct = sum(1 for r in results if r['status']
+                  == sql_grader.STATUS_CORRECT)
+    executed = sum(1 for r in results if not r['cached'])
+    summary = (f"Graded {len(results)} answers in {elapsed:.1f}s: "
+               f"{correct} correct, {executed} executed, "
+               f"{len(results) - executed} from cache")
+    print(f"Auto-grader: exam {exam_id}: {summary}")
+    return redirect(url_for('autograde_setup', exam_id=exam_id, summary=summary))
+
+# IP management route
+
+
+@app.route('/teacher/ip_management')
+def ip_management():
+    if 'role' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
+
+    # Every IP restriction, with the last student who logged in with it
+    ip_data = records.ip_policies()
+
+    return render_template('ip_management.html', ip_restrictions=ip_data)
+
+# Approve IP route
+
+
+@app.route('/teacher/approve_ip/<int:ip_id>')
+def approve_ip(ip_id):
+    if 'role' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
+
+    records.approve_ip(ip_id)
+
     return redirect(url_for('ip_management'))
 
 # Block IP route
@@ -1095,13 +3078,7 @@ def block_ip(ip_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE ip_restrictions SET is_blocked = 1, blocked_time = ?, approved = 0 WHERE id = ?",
-            (datetime.now(), ip_id)
-        )
-        conn.commit()
+    records.block_ip(ip_id)
 
     return redirect(url_for('ip_management'))
 
@@ -1113,23 +3090,13 @@ def all_grades():
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
+    with get_read_connection(snapshot=True) as conn:
         cursor = conn.cursor()
 
         # Get all exams
         cursor.execute("SELECT * FROM exams ORDER BY id DESC")
         exams = cursor.fetchall()
 
-        # Get all students who have submissions
-        cursor.execute(
-            """
-            SELECT DISTINCT student_name, student_number 
-            FROM submissions 
-            ORDER BY student_name
-            """
-        )
-        students = cursor.fetchall()
-
         # Get all exam models
         cursor.execute("SELECT * FROM exam_models")
         exam_models_rows = cursor.fetchall()
@@ -1141,90 +3108,61 @@ def all_grades():
                 exam_models[model['exam_id']] = {}
             exam_models[model['exam_id']][model['id']] = model['model_name']
 
-        # Get grades only from the latest submissions for each student/exam
-        cursor.execute(
-            """
-            WITH latest_submissions AS (
-                SELECT s.id, s.student_number, s.exam_id, s.student_name, s.model_id,
-                       ROW_NUMBER() OVER (PARTITION BY s.student_number, s.exam_id 
-                                         ORDER BY s.submission_time DESC) AS submission_rank
-                FROM submissions s
-            )
-            SELECT g.*, ls.student_name, ls.student_number, ls.exam_id, ls.model_id, e.title as exam_title
-            FROM grades g
-            JOIN latest_submissions ls ON g.submission_id = ls.id AND ls.submission_rank = 1
-            JOIN exams e ON ls.exam_id = e.id
-            ORDER BY e.id DESC, ls.student_name ASC
-            """
-        )
-        all_grades = cursor.fetchall()
-
-        # Organize grades by exam and student for easier display
-        grades_by_exam = {}
-        for exam in exams:
-            grades_by_exam[exam['id']] = {
-                'exam_title': exam['title'],
-                'students': {}
-            }
-
-        for grade in all_grades:
-            exam_id = grade['exam_id']
-            student_number = grade['student_number']
-            model_id = grade['model_id']
+    # Get all students who have submissions, and grades only from the
+    # latest submissions for each student/exam, live and archived
+    students, all_grades = records.grade_report(exams, snapshot=True)
+    students = sorted(students)
+    all_grades.sort(key=lambda grade: (-grade['exam_id'], grade['student_name']))
+
+    # Organize grades by exam and student for easier display
+    grades_by_exam = {}
+    for exam in exams:
+        grades_by_exam[exam['id']] = {
+            'exam_title': exam['title'],
+            'students': {}
+        }
+
+    for grade in all_grades:
+        exam_id = grade['exam_id']
+        student_number = grade['student_number']
+        model_id = grade['model_id']
+
+        # Get model name if available
+        model_name = None
+        if exam_id in exam_models and model_id in exam_models[exam_id]:
+            model_name = exam_models[exam_id][model_id]
+
+        if exam_id in grades_by_exam:
+            if student_number not in grades_by_exam[exam_id]['students']:
+                grades_by_exam[exam_id]['students'][student_number] = {
+                    'student_name': grade['student_name'],
+                    'student_number': student_number,
+                    'grade': grade['mark'],
+                    'comment': grade['comment'],
+                    'model_name': model_name
+                }
+
+    # Get list of students who haven't been graded for each exam (only check latest submissions)
+    # Now include the submission id for direct linking
+    ungraded_students = {}
+    for exam in exams:
+        ungraded_rows = records.ungraded_submissions(exam, snapshot=True)
+
+        # Add model information to ungraded students
+        ungraded_with_models = []
+        for student in ungraded_rows:
+            student_dict = dict(student)
 
             # Get model name if available
             model_name = None
-            if exam_id in exam_models and model_id in exam_models[exam_id]:
-                model_name = exam_models[exam_id][model_id]
-
-            if exam_id in grades_by_exam:
-                if student_number not in grades_by_exam[exam_id]['students']:
-                    grades_by_exam[exam_id]['students'][student_number] = {
-                        'student_name': grade['student_name'],
-                        'student_number': student_number,
-                        'grade': grade['mark'],
-                        'comment': grade['comment'],
-                        'model_name': model_name
-                    }
-
-        # Get list of students who haven't been graded for each exam (only check latest submissions)
-        # Now include the submission id for direct linking
-        ungraded_students = {}
-        for exam in exams:
-            cursor.execute(
-                """
-                WITH latest_submissions AS (
-                    SELECT s.id, s.student_name, s.student_number, s.model_id,
-                           ROW_NUMBER() OVER (PARTITION BY s.student_number, s.exam_id 
-                                             ORDER BY s.submission_time DESC) AS submission_rank
-                    FROM submissions s
-                    WHERE s.exam_id = ?
-                )
-                SELECT ls.id as submission_id, ls.student_name, ls.student_number, ls.model_id
-                FROM latest_submissions ls
-                LEFT JOIN grades g ON g.submission_id = ls.id
-                WHERE ls.submission_rank = 1 AND g.id IS NULL
-                ORDER BY ls.student_name
-                """,
-                (exam['id'],)
-            )
-            ungraded_rows = cursor.fetchall()
-
-            # Add model information to ungraded students
-            ungraded_with_models = []
-            for student in ungraded_rows:
-                student_dict = dict(student)
+            model_id = student['model_id']
+            if exam['id'] in exam_models and model_id in exam_models[exam['id']]:
+                model_name = exam_models[exam['id']][model_id]
 
-                # Get model name if available
-                model_name = None
-                model_id = student['model_id']
-                if exam['id'] in exam_models and model_id in exam_models[exam['id']]:
-                    model_name = exam_models[exam['id']][model_id]
+            student_dict['model_name'] = model_name
+            ungraded_with_models.append(student_dict)
 
-                student_dict['model_name'] = model_name
-                ungraded_with_models.append(student_dict)
-
-            ungraded_students[exam['id']] = ungraded_with_models
+        ungraded_students[exam['id']] = ungraded_with_models
 
     return render_template(
         'admin_grades.html',
@@ -1243,30 +3181,20 @@ def export_grades():
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
+    with get_read_connection(snapshot=True) as conn:
         cursor = conn.cursor()
 
         # Get all exams
         cursor.execute("SELECT * FROM exams ORDER BY id DESC")
         exams = cursor.fetchall()
 
-        # Get grades only from the latest submissions for each student/exam
-        cursor.execute(
-            """
-            WITH latest_submissions AS (
-                SELECT s.id, s.student_number, s.exam_id, s.student_name,
-                       ROW_NUMBER() OVER (PARTITION BY s.student_number, s.exam_id 
-                                         ORDER BY s.submission_time DESC) AS submission_rank
-                FROM submissions s
-            )
-            SELECT g.*, ls.student_name, ls.student_number, ls.exam_id, e.title as exam_title
-            FROM grades g
-            JOIN latest_submissions ls ON g.submission_id = ls.id AND ls.submission_rank = 1
-            JOIN exams e ON ls.exam_id = e.id
-            ORDER BY e.id DESC, ls.student_name ASC
-            """
-        )
-        all_grades = cursor.fetchall()
+    # Get grades only from the latest submissions for each student/exam,
+    # live and archived
+    exam_titles = {exam['id']: exam['title'] for exam in exams}
+    _, grades = records.grade_report(exams, snapshot=True)
+    all_grades = [dict(grade, exam_title=exam_titles[grade['exam_id']])
+                  for grade in grades if grade['exam_id'] in exam_titles]
+    all_grades.sort(key=lambda grade: (-grade['exam_id'], grade['student_name']))
 
     # Create an Excel workbook and sheet
     wb = Workbook()
@@ -1323,7 +3251,7 @@ def export_grades_excel(exam_id):
     if 'role' not in session or session['role'] != 'teacher':
         return redirect(url_for('login'))
 
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
 
         # Get exam details
@@ -1346,34 +3274,9 @@ def export_grades_excel(exam_id):
         # Create a model lookup dictionary
         models = {model['id']: model['model_name'] for model in models_data}
 
-        # Get grades only from the latest submissions for each student for this specific exam
-        cursor.execute(
-            """
-            WITH latest_submissions AS (
-                SELECT s.id, s.student_number, s.student_name, s.submission_time, s.ip_address, s.model_id,
-                       ROW_NUMBER() OVER (PARTITION BY s.student_number 
-                                         ORDER BY s.submission_time DESC) AS submission_rank
-                FROM submissions s
-                WHERE s.exam_id = ?
-            )
-            SELECT 
-                ls.id AS submission_id,
-                ls.student_name, 
-                ls.student_number, 
-                ls.submission_time,
-                ls.ip_address,
-                ls.model_id,
-                g.mark, 
-                g.comment, 
-                g.graded_at
-            FROM latest_submissions ls
-            LEFT JOIN grades g ON g.submission_id = ls.id
-            WHERE ls.submission_rank = 1
-            ORDER BY ls.student_name
-            """,
-            (exam_id,)
-        )
-        student_data = cursor.fetchall()
+        # Get grades only from the latest submissions for each student for
+        # this specific exam (archived exams are read from their archive file)
+        student_data = records.latest_submission_grades(exam)
 
         # Create a workbook and add a worksheet
         wb = Workbook()
@@ -1495,6 +3398,115 @@ def logout():
 
 # Helper functions for handling file uploads
 
+UPLOAD_FOLDER = os.path.join('static', 'uploads')
+# Uploads are named by the first characters of their SHA-256 (see save_image)
+IMAGE_HASH_LENGTH = 32
+# Unreferenced uploads younger than this are not garbage-collected (seconds)
+IMAGE_ORPHAN_GRACE = 3600
+
+# Question image processing
+#
+# Uploads are kept as sent, and a worker pool writes re-encoded variants next
+# to them: 'display' (at most IMAGE_DISPLAY_SIZE, for students) and 'thumb'
+# (for teacher pages), each as WebP when Pillow supports it plus a JPEG (PNG
+# for images with transparency) for other browsers. Until the variants exist,
+# pages show the original upload. Without Pillow, originals are always used.
+IMAGE_DISPLAY_SIZE = (1600, 1600)
+IMAGE_THUMBNAIL_SIZE = (320, 320)
+IMAGE_QUALITY = 82
+IMAGE_WORKERS = 2
+IMAGE_VARIANTS = {'display': IMAGE_DISPLAY_SIZE, 'thumb': IMAGE_THUMBNAIL_SIZE}
+
+_image_pool = ThreadPoolExecutor(
+    max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+
+
+def _variant_name(filename, variant, extension):
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}.{variant}{extension}"
+
+
+def _save_variant(image, filename, image_format, **options):
+    """Encode one variant atomically, so pages never link a half-written file"""
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    temp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    image.save(temp_path, image_format, **options)
+    os.replace(temp_path, path)
+
+
+def process_image(filename):
+    """Write the downscaled, re-encoded variants of an uploaded image"""
+    try:
+        with Image.open(os.path.join(UPLOAD_FOLDER, filename)) as upload:
+            # Animations would lose all but their first frame
+            if getattr(upload, 'is_animated', False):
+                return
+            # Phone photos store their rotation in EXIF
+            image = ImageOps.exif_transpose(upload)
+            has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        for variant, size in IMAGE_VARIANTS.items():
+            scaled = image.copy()
+            scaled.thumbnail(size, Image.LANCZOS)
+            # WebP first: the fallback existing means the variant is complete
+            if IMAGE_WEBP_SUPPORTED:
+                _save_variant(scaled, _variant_name(filename, variant, '.webp'),
+                              'WEBP', quality=IMAGE_QUALITY, method=4)
+            if has_alpha:
+                _save_variant(scaled, _variant_name(filename, variant, '.png'),
+                              'PNG', optimize=True)
+            else:
+                _save_variant(scaled, _variant_name(filename, variant, '.jpg'),
+                              'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+        # Exam pages link the variants from now on
+        invalidate_model_content()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Could not process image {filename}: {str(e)}")
+
+
+def queue_image_processing(filename):
+    """Process an upload in the background; pages use the original meanwhile"""
+    if Image:
+        _image_pool.submit(process_image, filename)
+
+
+@app.template_global()
+def question_image_urls(filename, variant='display'):
+    """
+    URLs for showing a question image.
+
+    Returns:
+        dict: 'src' (processed JPEG/PNG, or the original while processing
+        is unfinished) and 'webp' (None when there is no WebP variant yet)
+    """
+    for extension in ('.jpg', '.png'):
+        fallback = _variant_name(filename, variant, extension)
+        if os.path.exists(os.path.join(UPLOAD_FOLDER, fallback)):
+            webp = _variant_name(filename, variant, '.webp')
+            has_webp = os.path.exists(os.path.join(UPLOAD_FOLDER, webp))
+            return {
+                'src': url_for('uploaded_image', filename=fallback),
+                'webp': url_for('uploaded_image', filename=webp) if has_webp else None
+            }
+    return {'src': url_for('uploaded_image', filename=filename), 'webp': None}
+
+
+def process_pending_images():
+    """Queue uploads saved before processing existed (or interrupted by a restart)"""
+    if not Image or not os.path.isdir(UPLOAD_FOLDER):
+        return
+    files = set(os.listdir(UPLOAD_FOLDER))
+    for filename in files:
+        stem, _ = os.path.splitext(filename)
+        if '.' in stem or not allowed_file(filename):
+            continue    # a variant (name.display.jpg) or a temporary file
+        processed = any(_variant_name(filename, 'thumb', extension) in files
+                        for extension in ('.jpg', '.png'))
+        if not processed:
+            queue_image_processing(filename)
+
+
 
 def allowed_file(filename):
     """Check if file extension is allowed (images only)"""
@@ -1504,26 +3516,161 @@ def allowed_file(filename):
 
 
 def save_image(file):
-    """Save uploaded image to the uploads folder with a secure name"""
+    """
+    Save an uploaded image under a name derived from its content, so the same
+    image uploaded for several questions is stored (and downloaded) once.
+    """
     if file and allowed_file(file.filename):
-        # Generate a secure filename
-        filename = secure_filename(file.filename)
-        # Add random string to avoid name collisions
-        random_hex = secrets.token_hex(8)
-        _, file_extension = os.path.splitext(filename)
-        secure_name = random_hex + file_extension
+        content = file.read()
+        _, file_extension = os.path.splitext(secure_filename(file.filename))
+        content_name = hashlib.sha256(
+            content).hexdigest()[:IMAGE_HASH_LENGTH] + file_extension.lower()
 
         # Create uploads directory if it doesn't exist
-        upload_folder = os.path.join('static', 'uploads')
-        os.makedirs(upload_folder, exist_ok=True)
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-        # Save the file
-        file_path = os.path.join(upload_folder, secure_name)
-        file.save(file_path)
+        # Save the file, unless the same image was uploaded before
+        file_path = os.path.join(UPLOAD_FOLDER, content_name)
+        if not os.path.exists(file_path):
+            temp_path = f"{file_path}.{secrets.token_hex(4)}.tmp"
+            with open(temp_path, 'wb') as image_file:
+                image_file.write(content)
+            os.replace(temp_path, file_path)
 
-        return secure_name
+            # Downscaling and re-encoding happen off the request
+            queue_image_processing(content_name)
+
+        return content_name
     return None
 
 
+def _is_content_addressed(filename):
+    stem, _ = os.path.splitext(filename)
+    return len(stem) == IMAGE_HASH_LENGTH and all(c in '0123456789abcdef' for c in stem)
+
+
+def _upload_hash(filename):
+    """
+    The content hash naming an upload (hash.jpg) or one of its variants
+    (hash.display.webp), or None for any other file in the uploads folder.
+    """
+    parts = filename.split('.')
+    if len(parts) == 3 and parts[1] not in IMAGE_VARIANTS:
+        return None
+    if len(parts) not in (2, 3) or parts[-1] not in ('png', 'jpg', 'jpeg', 'gif', 'webp'):
+        return None
+    return parts[0] if _is_content_addressed(parts[0]) else None
+
+
+@app.route('/uploads/<path:filename>')
+def uploaded_image(filename):
+    """
+    Serve a question image or one of its variants. Content-addressed names
+    never change content, so browsers may keep them for good; uploads from
+    before content addressing are revalidated.
+    """
+    upload_folder = os.path.abspath(UPLOAD_FOLDER)
+    if _is_content_addressed(filename):
+        # The name is the content hash: a strong validator for free
+        response = send_from_directory(
+            upload_folder, filename, etag=os.path.splitext(filename)[0])
+    else:
+        # Variants and uploads from before content addressing
+        response = send_from_directory(upload_folder, filename)
+    if _upload_hash(filename):
+        response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def collect_orphan_images():
+    """
+    Delete uploads that no question refers to any more, with their variants.
+    Only content-addressed files (see _upload_hash) are considered, and
+    recent ones are kept: their question may not be committed yet.
+
+    Returns:
+        int: Number of files deleted
+    """
+    if not os.path.isdir(UPLOAD_FOLDER):
+        return 0
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT image_filename FROM questions WHERE image_filename IS NOT NULL")
+        referenced = {os.path.splitext(row['image_filename'])[0]
+                      for row in cursor.fetchall()}
+
+    deleted = 0
+    cutoff = time.time() - IMAGE_ORPHAN_GRACE
+    for filename in os.listdir(UPLOAD_FOLDER):
+        # hash.jpg and hash.display.webp both belong to hash
+        upload = _upload_hash(filename)
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if upload is None or upload in referenced or os.path.getmtime(path) > cutoff:
+            continue
+        try:
+            os.remove(path)
+            deleted += 1
+        except OSError as e:
+            print(f"Could not delete orphaned upload {filename}: {str(e)}")
+    return deleted
+
+
+@app.cli.command('collect-orphan-images')
+def collect_orphan_images_command():
+    """Delete uploaded images that no question refers to any more."""
+    click.echo(f"Deleted {collect_orphan_images()} orphaned upload files")
+
+# Background jobs
+#
+# The answer checker, autosave compactor, database maintenance, backups,
+# reporting snapshots and the startup tasks run in the process that serves
+# requests, started once by start_background_jobs(): by `python app.py`, or
+# by wsgi.py for a WSGI server. Importing app (flask commands,
+# replay_traffic.py --wsgi, spawned pool workers) starts none of them.
+_background_jobs_started = False
+_background_jobs_lock = threading.Lock()
+
+
+def _start_thread(target, name):
+    threading.Thread(target=target, name=name, daemon=True).start()
+
+
+def start_background_jobs():
+    """Start the server's background threads and startup tasks, once per process"""
+    global _background_jobs_started
+    with _background_jobs_lock:
+        if _background_jobs_started:
+            return
+        _background_jobs_started = True
+
+    if STORAGE_BACKEND == 'postgresql':
+        # Connect now, so a wrong EXAM_POSTGRES_DSN shows at startup
+        records.open()
+    else:
+        upgrade_shards()
+        _start_thread(compress_stored_answers, 'answer-compression')
+        if RETENTION_ENABLED:
+            _start_thread(_submission_compactor, 'submission-compactor')
+
+    if ANSWER_CHECK_ENABLED:
+        _start_thread(_answer_checker, 'answer-checker')
+    if DB_MAINTENANCE_ENABLED:
+        _start_thread(_database_maintainer, 'db-maintenance')
+    if BACKUP_ENABLED:
+        _start_thread(_database_backup, 'db-backup')
+    if REPORTING_SNAPSHOT_ENABLED:
+        _start_thread(_reporting_snapshots, 'reporting-snapshot')
+
+    process_pending_images()
+
+
 if __name__ == '__main__':
+    # Debug mode's reloader runs this file twice: a watcher that only restarts
+    # the server when code changes, and the server (WERKZEUG_RUN_MAIN set)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay for Helwan Exam System
+This script re-issues a traffic log recorded by app.py (see EXAM_TRAFFIC_LOG)
+against a test instance, over HTTP or in-process through Flask's WSGI test
+client, and compares the replayed latencies with the recorded ones.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from stress_test import LatencyHistogram, extract_questions_from_content
+
+# Configuration
+DEFAULT_URL = "http://localhost:5000"
+DEFAULT_SPEED = 1.0
+DEFAULT_TEACHER_USERNAME = "teacher"
+DEFAULT_TEACHER_PASSWORD = "admin123"
+
+# Student endpoints that need a logged-in exam session
+STUDENT_SESSION_ENDPOINTS = {'take_exam', 'exam_content', 'exam_state',
+                             'auto_save', 'submit_exam'}
+
+# Requests that change state whose bodies are not recorded (or whose ids
+# would not match the test instance) are skipped
+SKIPPED_ENDPOINTS = {'activate_exam', 'approve_ip', 'block_ip', 'create_exam',
+                     'create_exam_models', 'static'}
+
+# ANSI color codes for better console output
+GREEN = '\033[92m'
+RED = '\033[91m'
+YELLOW = '\033[93m'
+BLUE = '\033[94m'
+PURPLE = '\033[95m'
+CYAN = '\033[96m'
+ENDC = '\033[0m'
+
+
+# Both clients replay each recorded request on its own: redirects are not
+# followed, because the browser's follow-up request was recorded separately.
+# They return (status, body text, redirect location).
+
+
+class HTTPClient:
+    """Replays requests against a running server"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, headers, data=None, json_body=None):
+        response = self.session.request(method, self.base_url + path, headers=headers,
+                                        data=data, json=json_body, timeout=120,
+                                        allow_redirects=False)
+        return response.status_code, response.text, response.headers.get('Location', '')
+
+
+class WSGIClient:
+    """Replays requests in-process through the Flask test client"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, headers, data=None, json_body=None):
+        response = self.client.open(path, method=method, headers=headers, data=data,
+                                    json=json_body)
+        return response.status_code, response.get_data(as_text=True), response.headers.get('Location', '')
+
+
+def load_traffic(path):
+    """Read a traffic log and group its records by identity, in time order"""
+    records = []
+    with open(path, encoding='utf-8') as log_file:
+        for line in log_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record['t'])
+
+    by_identity = {}
+    for record in records:
+        by_identity.setdefault(record['who'], []).append(record)
+    return records, by_identity
+
+
+def fake_ip(value):
+    """Stable made-up IP address for an (anonymised) recorded address"""
+    digest = hashlib.sha256(value.encode()).digest()
+    return f"10.{digest[0]}.{digest[1]}.{digest[2] % 254 + 1}"
+
+
+def build_answers(question_ids, sizes):
+    """Answers and combinedCode with the recorded answer sizes"""
+    question_ids = list(question_ids)
+    next_id = max(question_ids, default=0) + 1
+    while len(question_ids) < len(sizes):
+        question_ids.append(next_id)
+        next_id += 1
+
+    answers = {}
+    combined_code = []
+    for q_id, size in zip(question_ids, sizes):
+        answer = ("SELECT * FROM replay WHERE id = 1;\n" * (size // 34 + 1))[:size]
+        answers[str(q_id)] = answer
+        combined_code.append(f"-- Question {q_id}:\n{answer}\n\n")
+    return answers, ''.join(combined_code)
+
+
+class ReplayResults:
+    """Thread-safe per-endpoint latencies: recorded vs replayed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recorded = {}
+        self.replayed = {}
+        self.errors = {}
+        self.skipped = 0
+
+    def record(self, endpoint, recorded_ms, replayed_seconds, status, recorded_status):
+        with self._lock:
+            self.recorded.setdefault(endpoint, LatencyHistogram()).record(
+                recorded_ms / 1000)
+            self.replayed.setdefault(endpoint, LatencyHistogram()).record(
+                replayed_seconds)
+            # Only count statuses that differ from what production returned
+            if status != recorded_status:
+                key = f"{endpoint}:{recorded_status}->{status}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+
+def logged_in_by(status, location):
+    """A successful login redirects away from the login page"""
+    return status in (301, 302, 303) and 'login' not in location
+
+
+def replay_identity(identity, records, client, start, first_t, speed, options, results):
+    """Replay one identity's requests in order, each at its recorded offset"""
+    headers = {}
+    student_data = None
+    if identity.startswith('s:'):
+        number = identity[2:]
+        student_data = {'name': f"Replay {number}", 'student_number': number}
+    logged_in = False
+    question_ids = []
+
+    def login():
+        if student_data:
+            status, _, location = client.request(
+                'POST', '/student_login', headers, data=student_data)
+        else:
+            status, _, location = client.request(
+                'POST', '/teacher_login', headers,
+                data={'username': options['username'], 'password': options['password']})
+        return logged_in_by(status, location)
+
+    for record in records:
+        endpoint = record['ep']
+        method = record['m']
+        if endpoint is None or endpoint in SKIPPED_ENDPOINTS or (
+                method == 'POST' and endpoint not in ('student_login', 'teacher_login',
+                                                      'auto_save', 'submit_exam')):
+            results.skip()
+            continue
+
+        headers['X-Forwarded-For'] = fake_ip(record.get('ip', identity))
+
+        # Open-loop: wait for the recorded offset, but never wait for a late request
+        delay = start + (record['t'] - first_t) / speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        # The capture may start mid-exam; log in (untimed) before the first request
+        if student_data:
+            needs_login = endpoint in STUDENT_SESSION_ENDPOINTS
+        else:
+            needs_login = identity.startswith('t:') and endpoint != 'teacher_login'
+        if needs_login and not logged_in:
+            logged_in = login()
+
+        path = record['p']
+        if options['exam_id'] and 'exam_id' in record.get('args', {}):
+            path = re.sub(r'/\d+$', f"/{options['exam_id']}", path)
+
+        data = json_body = None
+        if endpoint == 'student_login' and method == 'POST':
+            data = student_data
+        elif endpoint == 'teacher_login' and method == 'POST':
+            data = {'username': options['username'],
+                    'password': options['password']}
+        elif endpoint in ('auto_save', 'submit_exam'):
+            answers, combined_code = build_answers(
+                question_ids, record.get('ans', []))
+            json_body = {'answers': answers, 'combinedCode': combined_code}
+
+        request_start = time.time()
+        try:
+            status, text, location = client.request(
+                method, path, headers, data=data, json_body=json_body)
+        except Exception as e:
+            print(f"{RED}{identity} {method} {path}: {str(e)}{ENDC}")
+            status, text, location = 0, "", ""
+        results.record(endpoint, record['ms'], time.time() - request_start,
+                       status, record['st'])
+
+        if endpoint in ('student_login', 'teacher_login') and method == 'POST':
+            logged_in = logged_in_by(status, location)
+        if endpoint == 'exam_content' and status == 200:
+            question_ids = extract_questions_from_content(
+                json.loads(text)) or question_ids
+        if endpoint == 'submit_exam':
+            logged_in = False
+
+
+def run_replay(traffic_file, client_factory, speed, options):
+    """Replay a traffic log with one thread per recorded identity"""
+    records, by_identity = load_traffic(traffic_file)
+    if not records:
+        print(f"{RED}No requests in {traffic_file}{ENDC}")
+        return None
+
+    first_t = records[0]['t']
+    span = records[-1]['t'] - first_t
+    print(f"{BLUE}Replaying {len(records)} requests from {len(by_identity)} identities{ENDC}")
+    print(f"{BLUE}Recorded over {span:.1f}s, replaying at {speed:g}x (~{span / speed:.1f}s){ENDC}")
+
+    results = ReplayResults()
+    start = time.time() + 0.5
+    threads = []
+    for identity, identity_records in by_identity.items():
+        thread = threading.Thread(target=replay_identity, args=(
+            identity, identity_records, client_factory(), start, first_t, speed,
+            options, results), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    total_time = time.time() - start
+    return report_replay(results, total_time, {
+        "traffic_file": traffic_file,
+        "speed": speed,
+        "requests": len(records),
+        "identities": len(by_identity),
+        "recorded_seconds": span
+    })
+
+
+def report_replay(results, total_time, configuration):
+    """Print recorded vs replayed latency per endpoint and save a JSON report"""
+    print(f"\n{PURPLE}=== Replay Results ({total_time:.2f} seconds) ==={ENDC}")
+    # Recorded times are measured inside the server, replayed ones at the client
+    print(f"{'endpoint':<20} {'count':>6}  {'recorded p50/p99':>18}  {'replayed p50/p99':>18}")
+
+    endpoints = {}
+    for endpoint in sorted(results.replayed):
+        recorded = results.recorded[endpoint].summary()
+        replayed = results.replayed[endpoint].summary()
+        endpoints[endpoint] = {"recorded": recorded, "replayed": replayed}
+        slower = replayed['p99'] > recorded['p99']
+        color = RED if slower else GREEN
+        print(f"{endpoint:<20} {replayed['count']:>6}  "
+              f"{recorded['p50']:>8.3f}/{recorded['p99']:<8.3f}  "
+              f"{color}{replayed['p50']:>8.3f}/{replayed['p99']:<8.3f}{ENDC}")
+
+    if results.errors:
+        print(f"\n{PURPLE}=== Status Differences (recorded -> replayed) ==={ENDC}")
+        for key, count in sorted(results.errors.items()):
+            print(f"{RED}{key} x {count}{ENDC}")
+    if results.skipped:
+        print(f"{YELLOW}Skipped {results.skipped} state-changing requests{ENDC}")
+
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    report = {
+        "timestamp": timestamp,
+        "configuration": configuration,
+        "total_time_seconds": total_time,
+        "endpoints": endpoints,
+        "status_differences": results.errors,
+        "skipped": results.skipped
+    }
+    report_file = f"replay_results_{timestamp}.json"
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n{GREEN}Detailed results saved to {report_file}{ENDC}")
+    return report
+
+
+def main():
+    """Main function to replay a traffic log"""
+    parser = argparse.ArgumentParser(
+        description='Traffic Replay for Helwan Exam System')
+    parser.add_argument('traffic_file',
+                        help='Traffic log written by app.py (EXAM_TRAFFIC_LOG)')
+    parser.add_argument('-u', '--url', default=DEFAULT_URL,
+                        help=f'Base URL of the test instance (default: {DEFAULT_URL})')
+    parser.add_argument('--wsgi', action='store_true',
+                        help='Replay in-process through the Flask test client instead of HTTP')
+    parser.add_argument('--database', default=None,
+                        help='With --wsgi: copy of an exam database to replay into (required)')
+    parser.add_argument('-s', '--speed', type=float, default=DEFAULT_SPEED,
+                        help=f'Replay speed multiplier, e.g. 2 = twice as fast (default: {DEFAULT_SPEED:g})')
+    parser.add_argument('--exam-id', type=int, default=None,
+                        help='Exam id to use for teacher pages on the test instance (default: as recorded)')
+    parser.add_argument('--teacher-username', default=DEFAULT_TEACHER_USERNAME,
+                        help=f'Teacher account on the test instance (default: {DEFAULT_TEACHER_USERNAME})')
+    parser.add_argument('--teacher-password', default=DEFAULT_TEACHER_PASSWORD,
+                        help='Password of the teacher account')
+
+    args = parser.parse_args()
+
+    print(f"{BLUE}Helwan Exam System - Traffic Replay Utility{ENDC}")
+    print(f"{BLUE}-------------------------------------------{ENDC}\n")
+
+    if args.speed <= 0:
+        print(f"{RED}--speed must be positive{ENDC}")
+        return 1
+
+    if args.wsgi:
+        if not args.database:
+            print(f"{RED}--wsgi needs --database: a copy of an exam database with an active exam{ENDC}")
+            return 1
+        # Point the app at the copy (and don't capture the replay) before importing it
+        os.environ['EXAM_DATABASE_PATH'] = args.database
+        os.environ.pop('EXAM_TRAFFIC_LOG', None)
+        import app as exam_app
+        print(f"{BLUE}In-process replay using {exam_app.DATABASE_PATH}{ENDC}")
+
+        def client_factory():
+            return WSGIClient(exam_app.app)
+    else:
+        def client_factory():
+            return HTTPClient(args.url.rstrip('/'))
+
+    options = {
+        'exam_id': args.exam_id,
+        'username': args.teacher_username,
+        'password': args.teacher_password
+    }
+
+    try:
+        report = run_replay(args.traffic_file, client_factory, args.speed, options)
+        return 0 if report is not None else 1
+    except KeyboardInterrupt:
+        print(f"\n{YELLOW}Replay interrupted by user{ENDC}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@
 #   ./run.sh           - Run the application
 #   ./run.sh test      - Run the test system
 #   ./run.sh install   - Install dependencies
+#   ./run.sh vendor    - Download the vendored CodeMirror files (needs internet)
 #   ./run.sh help      - Show this help message
 
 # Set the script to exit immediately if a command exits with a non-zero status
@@ -45,10 +46,29 @@ if [ "$1" == "help" ]; then
   echo "  ./run.sh           - Run the application"
   echo "  ./run.sh test      - Run the test system"
   echo "  ./run.sh install   - Install dependencies"
+  echo "  ./run.sh vendor    - Download the vendored CodeMirror files (needs internet)"
   echo "  ./run.sh help      - Show this help message"
   exit 0
 fi
 
+# Download the minified CodeMirror release the templates used to load from the
+# CDN into static/vendor, under the paths the templates link to
+if [ "$1" == "vendor" ]; then
+  CODEMIRROR_VERSION="5.63.0"
+  CODEMIRROR_URL="https://cdnjs.cloudflare.com/ajax/libs/codemirror/$CODEMIRROR_VERSION"
+  VENDOR_DIR="static/vendor/codemirror"
+  echo "Downloading CodeMirror $CODEMIRROR_VERSION..."
+  for file in lib/codemirror.js lib/codemirror.css theme/monokai.css \
+              mode/sql/sql.js mode/python/python.js mode/javascript/javascript.js \
+              mode/clike/clike.js; do
+    source_file="${file#lib/}"
+    curl -fsSL "$CODEMIRROR_URL/${source_file%.*}.min.${file##*.}" -o "$VENDOR_DIR/$file"
+  done
+  echo "$CODEMIRROR_VERSION" > "$VENDOR_DIR/VERSION"
+  echo "CodeMirror $CODEMIRROR_VERSION downloaded to $VENDOR_DIR."
+  exit 0
+fi
+
 # Run test system if requested
 if [ "$1" == "test" ]; then
   echo "Running test system..."
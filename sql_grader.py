@@ -0,0 +1,568 @@
+"""
+SQL Auto-Grader for Helwan Exam System
+
+Checks students' SQL answers against a reference dataset and an expected-result
+query that the teacher defines per question. Every answer runs in a worker
+process on its own in-memory copy of the dataset, with a time limit and a
+memory limit, so a slow or hostile query cannot touch the exam database, the
+server process or any other answer. The outcome is a suggested mark only; the
+teacher still enters the final grade.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Limits applied to every student query
+DEFAULT_TIME_LIMIT = 2.0                    # seconds per answer
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024     # bytes of SQLite heap per answer
+MAX_RESULT_ROWS = 10000                     # larger results are not compared
+PROGRESS_STEPS = 1000                       # VM steps between time-limit checks
+CONNECTION_HEAP = 256 * 1024                # bytes of heap an empty connection needs
+
+# Floats are rounded before comparing so AVG() and friends match reliably
+FLOAT_PRECISION = 6
+
+# Grading outcomes stored in auto_grades.status
+STATUS_CORRECT = 'correct'
+STATUS_WRONG = 'wrong'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+STATUS_MEMORY = 'memory'
+STATUS_NO_ANSWER = 'no_answer'
+STATUS_REFERENCE_ERROR = 'reference_error'
+# Outcomes that depend on the machine's load as much as on the answer; they
+# are never cached, so the next run executes the answer again
+UNCACHED_STATUSES = (STATUS_TIMEOUT, STATUS_MEMORY)
+
+# Answer pre-check outcomes stored in question_answers.check_status, from the
+# most to the least serious; answers not checked yet count as pending
+CHECK_SYNTAX_ERROR = 'syntax_error'
+CHECK_INVALID = 'invalid'
+CHECK_EMPTY = 'empty'
+CHECK_PENDING = 'pending'
+CHECK_OK = 'ok'
+CHECK_SEVERITY = [CHECK_SYNTAX_ERROR, CHECK_INVALID,
+                  CHECK_EMPTY, CHECK_PENDING, CHECK_OK]
+
+# Tokens that normalise_answer() leaves untouched, and what ends them
+_QUOTE_PAIRS = {"'": "'", '"': '"', '`': '`', '[': ']'}
+_PLAIN_TEXT = re.compile(r"[^'\"`\[\-/]+|.", re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING = re.compile(r'[\s;]+$')
+
+# Errors SQLite reports when a statement does not parse at all
+_SYNTAX_ERRORS = re.compile(r'syntax error|incomplete input|unrecognized token')
+# Statements the pre-check applies (and rolls back) so later ones can use them
+_SCHEMA_CHANGES = re.compile(r'\s*(create|drop|alter)\b', re.IGNORECASE)
+# CREATE TABLE ... AS SELECT fills its table by running the query, so the
+# pre-check never applies it (matched on the normalised statement)
+_CREATE_TABLE_AS = re.compile(r'create (?:temp |temporary )?table\b[^(]*?\bas\b')
+
+# Students may not reach outside their private copy or change its limits
+_DENIED_ACTIONS = {sqlite3.SQLITE_ATTACH,
+                   sqlite3.SQLITE_DETACH, sqlite3.SQLITE_PRAGMA}
+
+
+class QueryLimitExceeded(Exception):
+    """Raised when a query runs past its time limit"""
+
+
+class CheckTimeout(Exception):
+    """Raised when a pre-check pool does not return a result in time"""
+
+
+def split_statements(sql):
+    """
+    Split a script into complete SQL statements, ignoring semicolons inside
+    string literals and comments.
+    """
+    statements = []
+    start = 0
+    for index, char in enumerate(sql):
+        if char == ';' and sqlite3.complete_statement(sql[start:index + 1]):
+            statements.append(sql[start:index + 1].strip())
+            start = index + 1
+    remainder = sql[start:].strip()
+    if remainder:
+        statements.append(remainder)
+    return [statement for statement in statements if statement.strip(';')]
+
+
+def normalise_answer(sql):
+    """
+    Canonical form of an answer for the result cache: comments removed,
+    whitespace collapsed, keywords and names lower-cased, trailing semicolons
+    dropped. Quoted strings and identifiers are kept exactly as written.
+    """
+    pieces = []
+    plain = []
+    index, length = 0, len(sql)
+    while index < length:
+        char = sql[index]
+        if char in _QUOTE_PAIRS:
+            end = sql.find(_QUOTE_PAIRS[char], index + 1)
+            end = length if end == -1 else end + 1
+            pieces.append(_normalise_plain(plain))
+            pieces.append(sql[index:end])
+            plain = []
+        elif sql.startswith('--', index):
+            end = sql.find('\n', index)
+            end = length if end == -1 else end
+            plain.append(' ')
+        elif sql.startswith('/*', index):
+            end = sql.find('*/', index + 2)
+            end = length if end == -1 else end + 2
+            plain.append(' ')
+        else:
+            end = _PLAIN_TEXT.match(sql, index).end()
+            plain.append(sql[index:end])
+        index = end
+    pieces.append(_normalise_plain(plain))
+    return _TRAILING.sub('', ''.join(pieces)).lstrip()
+
+
+def _normalise_plain(plain):
+    return _WHITESPACE.sub(' ', ''.join(plain)).lower()
+
+
+def answer_hash(sql):
+    """Hash of the normalised answer, so equivalent spellings share a cache entry"""
+    return hashlib.sha256(normalise_answer(sql or '').encode()).hexdigest()
+
+
+def reference_hash(spec):
+    """
+    Version of a question's reference: changes whenever the dataset, the
+    expected query or the order sensitivity changes (but not the points).
+    """
+    reference = '\0'.join([spec['dataset_sql'] or '', spec['expected_query'] or '',
+                           '1' if spec['order_sensitive'] else '0'])
+    return hashlib.sha256(reference.encode()).hexdigest()
+
+
+def _authorizer(action, *args):
+    if action in _DENIED_ACTIONS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _normalise_value(value):
+    if isinstance(value, float):
+        return round(value, FLOAT_PRECISION)
+    return value
+
+
+def run_query(conn, sql, time_limit, sandboxed=True):
+    """
+    Run every statement in `sql` and return the columns and rows produced by
+    the last statement that returns rows.
+
+    Raises:
+        QueryLimitExceeded: If the statements run longer than `time_limit`
+        ValueError: If there are no statements or the result is too large
+        sqlite3.Error, MemoryError: If SQLite rejects or cannot run the query
+    """
+    statements = split_statements(sql)
+    if not statements:
+        raise ValueError("No SQL statement found")
+
+    deadline = time.monotonic() + time_limit
+    timed_out = []
+
+    def check_deadline():
+        if time.monotonic() > deadline:
+            timed_out.append(True)
+            return 1
+        return 0
+
+    conn.set_progress_handler(check_deadline, PROGRESS_STEPS)
+    if sandboxed:
+        conn.set_authorizer(_authorizer)
+
+    columns, rows = None, None
+    try:
+        for statement in statements:
+            cursor = conn.execute(statement)
+            if cursor.description is None:
+                continue
+            columns = len(cursor.description)
+            rows = cursor.fetchmany(MAX_RESULT_ROWS + 1)
+            if len(rows) > MAX_RESULT_ROWS:
+                raise ValueError(
+                    f"Result has more than {MAX_RESULT_ROWS} rows")
+    except sqlite3.OperationalError:
+        if timed_out:
+            raise QueryLimitExceeded(
+                f"Query exceeded the {time_limit:g}s time limit")
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+        conn.set_authorizer(None)
+
+    if rows is None:
+        raise ValueError("The last statement does not return any rows")
+    return columns, [tuple(_normalise_value(v) for v in row) for row in rows]
+
+
+def compare_results(expected, actual, order_sensitive):
+    """
+    Compare two (columns, rows) results.
+
+    Returns:
+        tuple: (matches, detail) where detail explains a mismatch
+    """
+    expected_columns, expected_rows = expected
+    actual_columns, actual_rows = actual
+
+    if expected_columns != actual_columns:
+        return False, f"Expected {expected_columns} columns, got {actual_columns}"
+    if len(expected_rows) != len(actual_rows):
+        return False, f"Expected {len(expected_rows)} rows, got {len(actual_rows)}"
+
+    if order_sensitive:
+        for index, (expected_row, actual_row) in enumerate(zip(expected_rows, actual_rows), 1):
+            if expected_row != actual_row:
+                return False, f"Row {index} differs (order matters for this question)"
+        return True, f"{len(actual_rows)} rows match"
+
+    missing = Counter(expected_rows) - Counter(actual_rows)
+    if missing:
+        return False, f"{sum(missing.values())} expected rows are missing"
+    return True, f"{len(actual_rows)} rows match"
+
+
+def _no_rows(action, arg1, arg2, db_name, trigger):
+    """Authorizer that lets a dataset create its schema but not fill it"""
+    if action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE) and not arg1.startswith('sqlite_'):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _schema_connection(dataset_sql):
+    """
+    An in-memory database with the tables and views of a dataset, but no rows.
+    The dataset's INSERTs and UPDATEs are refused rather than run, so a large
+    dataset costs no more than a small one.
+    """
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.set_authorizer(_no_rows)
+    try:
+        for statement in split_statements(dataset_sql or ''):
+            try:
+                conn.execute(statement)
+            except (sqlite3.Error, MemoryError):
+                # Refused and broken statements leave the rest of the schema
+                pass
+    finally:
+        conn.set_authorizer(None)
+    return conn
+
+
+def check_answer(conn, answer, has_schema, time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Compile every statement of an answer without running it.
+
+    Statements are prepared with EXPLAIN against the question's schema. Plain
+    schema changes (CREATE TABLE with columns, views, indexes, DROP, ALTER)
+    are applied inside a savepoint so later statements can use them, and
+    rolled back afterwards; they touch no rows, the schema having none.
+    CREATE TABLE ... AS SELECT would run its query, so it is only compiled,
+    and the statements after it are only checked for syntax. Without a
+    schema, only syntax is checked. The statements get `time_limit` seconds
+    together.
+
+    Returns:
+        tuple: (status, error message or None)
+    """
+    statements = split_statements(answer or '')
+    if not statements:
+        return CHECK_EMPTY, None
+
+    deadline = time.monotonic() + time_limit
+    timed_out = []
+
+    def check_deadline():
+        if time.monotonic() > deadline:
+            timed_out.append(True)
+            return 1
+        return 0
+
+    conn.set_progress_handler(check_deadline, PROGRESS_STEPS)
+    conn.execute("SAVEPOINT answer_check")
+    conn.set_authorizer(_authorizer)
+    try:
+        for statement in statements:
+            try:
+                conn.execute("EXPLAIN " + statement)
+                if _SCHEMA_CHANGES.match(statement):
+                    if _CREATE_TABLE_AS.match(normalise_answer(statement)):
+                        has_schema = False
+                    else:
+                        conn.execute(statement)
+            except MemoryError:
+                return CHECK_INVALID, "The check exceeded the memory limit"
+            except sqlite3.Error as e:
+                if timed_out:
+                    return CHECK_INVALID, f"The check exceeded the {time_limit:g}s time limit"
+                message = str(e)
+                if _SYNTAX_ERRORS.search(message):
+                    return CHECK_SYNTAX_ERROR, message
+                if has_schema or message == 'not authorized':
+                    return CHECK_INVALID, message
+    finally:
+        conn.set_authorizer(None)
+        conn.set_progress_handler(None, 0)
+        conn.execute("ROLLBACK TO answer_check")
+        conn.execute("RELEASE answer_check")
+    return CHECK_OK, None
+
+
+# Worker processes are started without forking the (multithreaded) server
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def _set_heap_limit(limit):
+    """
+    Cap SQLite's heap in this process. The cap covers every connection and
+    SQLite only ever lowers it, so it is set once per worker.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"PRAGMA hard_heap_limit = {int(limit)}")
+    conn.close()
+
+
+# Pre-check worker state: one schema-only database per dataset
+_worker_schemas = {}
+
+
+def _init_check_worker(memory_limit):
+    """Pool initializer: cap SQLite's heap (schemas hold no rows, so the cap
+    is left to the answers)"""
+    _set_heap_limit(memory_limit)
+
+
+def check_pool(processes, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """
+    A process pool for check_answers whose workers cap SQLite's heap at
+    `memory_limit` while checking. A multiprocessing.Pool, so a stuck check
+    can be stopped with terminate().
+    """
+    return POOL_CONTEXT.Pool(processes, initializer=_init_check_worker,
+                             initargs=(memory_limit,))
+
+
+def _check_task(task):
+    """Pre-check one answer in a worker process"""
+    dataset_sql, answer = task
+    key = hashlib.sha256((dataset_sql or '').encode()).hexdigest()
+    if key not in _worker_schemas:
+        _worker_schemas[key] = _schema_connection(dataset_sql)
+    return check_answer(_worker_schemas[key], answer, bool(dataset_sql))
+
+
+def check_answers(pool, answers, cache, timeout=None):
+    """
+    Pre-check answers in an existing process pool.
+
+    Args:
+        pool (multiprocessing.pool.Pool): Pool to run the checks in (see
+            check_pool)
+        answers (list): (dataset_sql, answer_content) tuples
+        cache (dict): (dataset hash, answer hash) -> (status, error) from
+            earlier checks; autosaves repeat the same answers many times, so
+            only answers not found here are compiled, and new outcomes are
+            added to it
+        timeout (float): Seconds to wait for each outcome
+
+    Returns:
+        list: (status, error) for each answer, in order
+
+    Raises:
+        CheckTimeout: If an outcome took longer than `timeout`. The answer is
+            cached as invalid, so a retry does not wait for it again; the
+            pool is still busy with it and should be terminated.
+    """
+    keys = [(hashlib.sha256((dataset_sql or '').encode()).hexdigest(), answer_hash(answer))
+            for dataset_sql, answer in answers]
+
+    pending = {}
+    for key, task in zip(keys, answers):
+        if key not in cache:
+            pending.setdefault(key, task)
+    if pending:
+        outcomes = pool.imap(_check_task, pending.values())
+        for key in pending:
+            try:
+                cache[key] = outcomes.next(timeout)
+            except multiprocessing.TimeoutError:
+                cache[key] = (CHECK_INVALID, f"The check took longer than {timeout:g}s")
+                raise CheckTimeout(f"No pre-check outcome within {timeout:g}s")
+
+    return [cache[key] for key in keys]
+
+
+# Worker process state: question specs handed over by the pool initializer,
+# and each question's dataset and expected result, built once per worker
+_worker_questions = {}
+_worker_references = {}
+_worker_time_limit = DEFAULT_TIME_LIMIT
+
+
+def _database_heap(conn):
+    """Rough bytes of SQLite heap taken by an in-memory database"""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size * 5 // 4 + CONNECTION_HEAP
+
+
+def _init_worker(questions, time_limit, memory_limit):
+    """
+    Pool initializer: build the references, then cap SQLite's heap.
+
+    The cap covers every connection in the worker and can only be lowered, so
+    it is set once the references are built: their size, plus a sandbox copy
+    of the largest, plus `memory_limit` for the answer itself.
+    """
+    global _worker_questions, _worker_time_limit
+    _worker_questions = questions
+    _worker_time_limit = time_limit
+    sizes = [_database_heap(dataset)
+             for dataset, _, _ in map(_load_reference, questions) if dataset]
+    _set_heap_limit(memory_limit + sum(sizes) + max(sizes, default=0))
+
+
+def _load_reference(question_id):
+    """Build the reference dataset and expected result for a question"""
+    if question_id not in _worker_references:
+        spec = _worker_questions[question_id]
+        dataset = sqlite3.connect(':memory:')
+        try:
+            if spec['dataset_sql']:
+                dataset.executescript(spec['dataset_sql'])
+            expected = run_query(dataset, spec['expected_query'],
+                                 _worker_time_limit, sandboxed=False)
+            _worker_references[question_id] = (dataset, expected, None)
+        except (sqlite3.Error, MemoryError, ValueError, QueryLimitExceeded) as e:
+            dataset.close()
+            _worker_references[question_id] = (None, None, str(e))
+    return _worker_references[question_id]
+
+
+def _grade_task(task):
+    """Grade one answer in a worker process"""
+    question_id, answer = task
+    spec = _worker_questions[question_id]
+
+    if not answer or not answer.strip():
+        return STATUS_NO_ANSWER, "No answer provided"
+
+    dataset, expected, reference_error = _load_reference(question_id)
+    if reference_error:
+        return (STATUS_REFERENCE_ERROR,
+                f"Reference dataset or expected query failed: {reference_error}")
+
+    # A private copy, so statements that modify data only affect this answer
+    sandbox = sqlite3.connect(':memory:')
+    try:
+        dataset.backup(sandbox)
+        actual = run_query(sandbox, answer, _worker_time_limit)
+        matches, detail = compare_results(
+            expected, actual, spec['order_sensitive'])
+        status = STATUS_CORRECT if matches else STATUS_WRONG
+    except QueryLimitExceeded as e:
+        status, detail = STATUS_TIMEOUT, str(e)
+    except MemoryError:
+        status, detail = STATUS_MEMORY, "Query exceeded the memory limit"
+    except (sqlite3.Error, ValueError) as e:
+        status, detail = STATUS_ERROR, str(e)
+    finally:
+        sandbox.close()
+
+    return status, detail
+
+
+def grade_answers(questions, answers, processes=None, time_limit=DEFAULT_TIME_LIMIT,
+                  memory_limit=DEFAULT_MEMORY_LIMIT, cache=None):
+    """
+    Grade answers in a pool of worker processes.
+
+    Args:
+        questions (dict): question_id -> {'dataset_sql', 'expected_query',
+            'order_sensitive', 'points'}
+        answers (list): (submission_id, question_id, answer_content) tuples
+        processes (int): Worker processes (default: one per CPU)
+        time_limit (float): Seconds allowed per query
+        memory_limit (int): Bytes of SQLite heap allowed per answer, on top
+            of the reference datasets
+        cache (dict): (question_id, reference_hash, answer_hash) ->
+            (status, detail) from earlier runs. Answers found there are not
+            executed again, and new outcomes are added to it, except those
+            in UNCACHED_STATUSES.
+
+    Returns:
+        list: dicts with submission_id, question_id, status, detail,
+        suggested_mark and cached (False only for answers that were executed)
+    """
+    cache = {} if cache is None else cache
+    references = {question_id: reference_hash(spec)
+                  for question_id, spec in questions.items()}
+
+    # Identical answers to the same question are executed only once
+    keyed_answers = []
+    pending = {}
+    for submission_id, question_id, answer in answers:
+        if question_id not in questions:
+            continue
+        key = (question_id, references[question_id], answer_hash(answer))
+        keyed_answers.append((submission_id, key))
+        if key not in cache:
+            pending.setdefault(key, answer)
+
+    outcomes = dict(cache)
+    executed = set()
+    if pending:
+        keys = list(pending)
+        tasks = [(key[0], pending[key]) for key in keys]
+        # Workers build the references of these questions only
+        needed = {question_id: questions[question_id] for question_id, _ in tasks}
+        processes = min(processes or os.cpu_count() or 1, len(tasks))
+        chunksize = max(1, len(tasks) // (processes * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=POOL_CONTEXT,
+                                     initializer=_init_worker,
+                                     initargs=(needed, time_limit, memory_limit)) as pool:
+                for key, outcome in zip(keys, pool.map(_grade_task, tasks, chunksize=chunksize)):
+                    outcomes[key] = outcome
+                    if outcome[0] not in UNCACHED_STATUSES:
+                        cache[key] = outcome
+                    executed.add(key)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); keep what was graded and
+            # leave the rest uncached so the next run tries them again
+            pass
+
+    results = []
+    for submission_id, key in keyed_answers:
+        status, detail = outcomes.get(
+            key, (STATUS_ERROR, "Grading worker crashed"))
+        points = questions[key[0]]['points']
+        results.append({
+            'submission_id': submission_id,
+            'question_id': key[0],
+            'status': status,
+            'detail': detail,
+            'suggested_mark': points if status == STATUS_CORRECT else 0,
+            # The first answer with an executed key is the one that ran
+            'cached': key not in executed
+        })
+        executed.discard(key)
+
+    return results
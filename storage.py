@@ -0,0 +1,936 @@
+"""
+Storage backends for Helwan Exam System
+
+What students and teachers write during an exam - exam sessions, submissions
+with their answer to each question, grades and IP policies - is read and
+written through a storage backend instead of SQL in the routes. Users, exams,
+models and questions always stay in the SQLite exam database.
+
+SQLiteStorage keeps everything in the exam database, as before, except for
+exams with a shard database of their own, and reads archived exams from their
+archive file. PostgresStorage keeps the exam data
+in PostgreSQL behind a connection pool, for exams with more concurrent
+students than SQLite's single writer keeps up with. Rows come back as
+mappings (sqlite3.Row or dict), so callers only use column names.
+"""
+
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from time import monotonic
+
+# Optional: psycopg 3 with its connection pool, for the PostgreSQL backend
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+    from psycopg_pool import ConnectionPool, PoolTimeout
+except ImportError:
+    psycopg = None
+
+BACKENDS = ('sqlite', 'postgresql')
+
+# Seconds to remember that an exam has no shard, before asking the database
+# again in case another process (such as a flask command) gave it one
+NO_SHARD_TTL = 5
+
+# Tables holding one exam's data, in its shard or archive file if it has one
+EXAM_TABLES = ('submissions', 'exam_sessions', 'question_answers',
+               'grades', 'auto_grades')
+
+# A final submission blocks the IP address it came from
+_BLOCK_SUBMITTED_IP = """
+    UPDATE ip_restrictions
+    SET is_blocked = 1, blocked_time = ?, approved = 0
+    WHERE ip_address = ?
+    """
+
+
+# Quoted text and comments, question marks, and percent signs in queries
+_SQL_TOKENS = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|\?|%""", re.DOTALL)
+
+
+def _postgres_token(match):
+    token = match.group()
+    if token == '?':
+        return '%s'
+    # psycopg reads % as the start of a placeholder anywhere in a query
+    return token.replace('%', '%%')
+
+
+@lru_cache(maxsize=512)
+def _postgres_sql(query):
+    """A query with ? placeholders in psycopg's %s style"""
+    return _SQL_TOKENS.sub(_postgres_token, query)
+
+
+def _as_datetime(value):
+    """SQLite returns stored timestamps as text, PostgreSQL as datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class Storage(ABC):
+    """
+    The queries of all backends. Subclasses provide connections
+    (_connection), their placeholder style (_sql), ids of inserted rows
+    (_insert), the stored form of answers (_stored_answer) and the lock
+    that numbers submission versions (_lock_versions).
+    """
+
+    name = None
+    # Exceptions meaning the database is busy or out of reach for now
+    busy_errors = ()
+
+    @abstractmethod
+    def _connection(self, write=False, exam=None, exam_id=None, snapshot=False):
+        """
+        Context manager for a connection that commits at the end of the block.
+        The exam the queries are about is given as its row (`exam`) or id;
+        neither means IP policies, or the exams without a database of their
+        own. `snapshot` allows reading a slightly older copy, for reports
+        across all exams.
+        """
+
+    def _report_scopes(self, exams):
+        """Exams (None: all the others) to read separately for a report on all of them"""
+        return [None]
+
+    def _holds_ip_policies(self, exam_id):
+        """Whether an exam's data is stored with the IP policies"""
+        return True
+
+    def live_scopes(self):
+        """
+        Exam ids to read separately to cover all exams that are not archived;
+        None stands for the exams without a database of their own.
+        """
+        return [None]
+
+    def _sql(self, query):
+        return query
+
+    def _execute(self, conn, query, params=()):
+        return conn.execute(self._sql(query), params)
+
+    def _executemany(self, conn, query, rows):
+        conn.cursor().executemany(self._sql(query), rows)
+
+    @abstractmethod
+    def _insert(self, conn, query, params):
+        """Run an INSERT and return the new row's id"""
+
+    @abstractmethod
+    def _lock_versions(self, conn, student_number, exam_id):
+        """
+        Keep other transactions from saving a version for the student until
+        this one ends, so no two saves get the same version number
+        """
+
+    def _stored_answer(self, text):
+        return text
+
+    # IP policies
+
+    def ip_policy(self, ip_address):
+        """The recorded policy of an IP address, if any"""
+        with self._connection() as conn:
+            return self._execute(
+                conn, "SELECT * FROM ip_restrictions WHERE ip_address = ?",
+                (ip_address,)).fetchone()
+
+    def record_ip(self, ip_address):
+        """Remember an IP address students logged in from, as approved"""
+        with self._connection(write=True) as conn:
+            self._execute(
+                conn,
+                """
+                INSERT INTO ip_restrictions (ip_address, is_blocked, approved)
+                VALUES (?, 0, 1)
+                ON CONFLICT (ip_address) DO NOTHING
+                """,
+                (ip_address,))
+
+    def ip_policies(self):
+        """
+        Every recorded IP address, newest first, as dicts with the student who
+        used it last: from their latest submission, or from their exam session
+        if they never saved.
+        """
+        last_saves = {}
+        last_logins = {}
+        for scope in self.live_scopes():
+            with self._connection(exam_id=scope) as conn:
+                for latest, table, time_column in (
+                        (last_saves, 'submissions', 'submission_time'),
+                        (last_logins, 'exam_sessions', 'start_time')):
+                    for row in self._execute(
+                            conn,
+                            f"""
+                            SELECT ip_address, student_name, student_number, login_time FROM (
+                                SELECT ip_address, student_name, student_number,
+                                       {time_column} AS login_time,
+                                       ROW_NUMBER() OVER (PARTITION BY ip_address
+                                                          ORDER BY {time_column} DESC) AS position
+                                FROM {table}
+                            ) latest
+                            WHERE position = 1
+                            """).fetchall():
+                        known = latest.get(row['ip_address'])
+                        if not known or row['login_time'] > known['login_time']:
+                            latest[row['ip_address']] = row
+
+        with self._connection() as conn:
+            ips = self._execute(
+                conn, "SELECT * FROM ip_restrictions ORDER BY id DESC").fetchall()
+
+        policies = []
+        for ip in ips:
+            policy = dict(ip)
+            last_student = (last_saves.get(ip['ip_address'])
+                            or last_logins.get(ip['ip_address']))
+            for column in ('student_name', 'student_number', 'login_time'):
+                policy[f'last_{column}'] = last_student[column] if last_student else None
+            policies.append(policy)
+        return policies
+
+    def approve_ip(self, ip_id):
+        with self._connection(write=True) as conn:
+            self._execute(
+                conn,
+                "UPDATE ip_restrictions SET is_blocked = 0, approved = 1 WHERE id = ?",
+                (ip_id,))
+
+    def block_ip(self, ip_id):
+        with self._connection(write=True) as conn:
+            self._execute(
+                conn,
+                "UPDATE ip_restrictions SET is_blocked = 1, blocked_time = ?, approved = 0 WHERE id = ?",
+                (datetime.now(), ip_id))
+
+    # Exam sessions
+
+    def open_session(self, student_number, exam_id):
+        """The student's exam session that has not ended yet, if any"""
+        with self._connection(exam_id=exam_id) as conn:
+            return self._execute(
+                conn,
+                """
+                SELECT * FROM exam_sessions
+                WHERE student_number = ? AND exam_id = ? AND end_time > ?
+                """,
+                (student_number, exam_id, datetime.now())).fetchone()
+
+    def start_session(self, student_name, student_number, exam_id, model_id,
+                      start_time, end_time, ip_address):
+        """Record a new exam session and return its id"""
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            return self._insert(
+                conn,
+                """
+                INSERT INTO exam_sessions
+                (student_name, student_number, exam_id, model_id, start_time, end_time, ip_address)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (student_name, student_number, exam_id, model_id,
+                 start_time, end_time, ip_address))
+
+    def session_end_time(self, session_id, exam_id):
+        """When an exam session ends, or None if there is no such session"""
+        with self._connection(exam_id=exam_id) as conn:
+            row = self._execute(
+                conn, "SELECT end_time FROM exam_sessions WHERE id = ?",
+                (session_id,)).fetchone()
+        return _as_datetime(row['end_time']) if row else None
+
+    def sessions_running(self, exam_id=None):
+        """
+        Whether any student is still taking an exam: their session has not
+        ended and they have not handed in a final submission. Without
+        `exam_id`, any of the exams without a database of their own.
+        """
+        exam_filter = "exam_id = ? AND" if exam_id is not None else ""
+        params = (exam_id,) if exam_id is not None else ()
+        with self._connection(exam_id=exam_id) as conn:
+            return self._execute(
+                conn,
+                f"""
+                SELECT 1 FROM exam_sessions
+                WHERE {exam_filter} end_time > ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM submissions
+                      WHERE submissions.student_number = exam_sessions.student_number
+                        AND submissions.exam_id = exam_sessions.exam_id
+                        AND submissions.is_final = 1)
+                LIMIT 1
+                """,
+                params + (datetime.now(),)).fetchone() is not None
+
+    # Submissions and answers
+
+    def save_submission(self, student_name, student_number, exam_id, model_id,
+                        ip_address, combined_code, answers, final=False):
+        """
+        Save a new version of a student's answers (question id -> answer) and
+        return its version number. A final submission also blocks the IP
+        address it came from, in the same transaction.
+        """
+        now = datetime.now()
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            self._lock_versions(conn, student_number, exam_id)
+            row = self._execute(
+                conn,
+                """
+                SELECT MAX(version) AS max_version FROM submissions
+                WHERE student_number = ? AND exam_id = ? AND model_id = ?
+                """,
+                (student_number, exam_id, model_id)).fetchone()
+            version = (row['max_version'] or 0) + 1
+
+            submission_id = self._insert(
+                conn,
+                """
+                INSERT INTO submissions
+                (student_name, student_number, exam_id, model_id, submission_time, ip_address, code_content, version, is_final)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (student_name, student_number, exam_id, model_id, now, ip_address,
+                 self._stored_answer(combined_code), version, 1 if final else 0))
+
+            self._executemany(
+                conn,
+                """
+                INSERT INTO question_answers
+                (submission_id, question_id, answer_content)
+                VALUES (?, ?, ?)
+                """,
+                [(submission_id, int(question_id), self._stored_answer(answer))
+                 for question_id, answer in answers.items()])
+
+            if final and self._holds_ip_policies(exam_id):
+                self._execute(conn, _BLOCK_SUBMITTED_IP, (now, ip_address))
+
+        # Kept elsewhere: blocked once the submission is safely stored
+        if final and not self._holds_ip_policies(exam_id):
+            with self._connection(write=True) as conn:
+                self._execute(conn, _BLOCK_SUBMITTED_IP, (now, ip_address))
+        return version
+
+    def latest_answers(self, student_number, exam_id, model_id):
+        """
+        The student's latest saved answers.
+
+        Returns:
+            tuple: (version, {question id: answer}), (0, {}) before the first save
+        """
+        with self._connection(exam_id=exam_id) as conn:
+            submission = self._execute(
+                conn,
+                """
+                SELECT id, version FROM submissions
+                WHERE student_number = ? AND exam_id = ? AND model_id = ?
+                ORDER BY submission_time DESC LIMIT 1
+                """,
+                (student_number, exam_id, model_id)).fetchone()
+            if not submission:
+                return 0, {}
+
+            rows = self._execute(
+                conn,
+                """
+                SELECT question_id, answer_content FROM question_answers
+                WHERE submission_id = ?
+                """,
+                (submission['id'],)).fetchall()
+        return submission['version'], {row['question_id']: row['answer_content']
+                                       for row in rows}
+
+    def exam_submissions(self, exam):
+        """
+        An exam's submissions, grouped by student.
+
+        Returns:
+            tuple: (students who submitted, {student number: their submissions
+            as dicts, newest first, the first with is_latest set},
+            [(submission id, check status) of the answers of each student's
+            latest submission])
+        """
+        with self._connection(exam=exam) as conn:
+            students = self._execute(
+                conn,
+                """
+                SELECT DISTINCT student_name, student_number, ip_address
+                FROM submissions
+                WHERE exam_id = ?
+                """,
+                (exam['id'],)).fetchall()
+
+            student_submissions = {student['student_number']: []
+                                   for student in students}
+            for submission in self._execute(
+                    conn,
+                    "SELECT * FROM submissions WHERE exam_id = ? ORDER BY submission_time DESC",
+                    (exam['id'],)).fetchall():
+                submissions = student_submissions[submission['student_number']]
+                submission = dict(submission)
+                submission['is_latest'] = not submissions
+                submissions.append(submission)
+
+            latest_ids = [submissions[0]['id']
+                          for submissions in student_submissions.values() if submissions]
+            checks = []
+            if latest_ids:
+                placeholders = ','.join('?' * len(latest_ids))
+                checks = [(row['submission_id'], row['check_status'])
+                          for row in self._execute(
+                              conn,
+                              f"""
+                              SELECT submission_id, check_status FROM question_answers
+                              WHERE submission_id IN ({placeholders})
+                              """,
+                              latest_ids).fetchall()]
+        return students, student_submissions, checks
+
+    def submission_details(self, submission_id, exam=None):
+        """
+        A submission with everything the grading page shows of it, or None
+        if there is no such submission.
+
+        Returns:
+            dict: 'submission', 'is_latest' (whether it is the student's latest
+            submission), 'grade', 'answers' (rows of question_id,
+            answer_content, check_status, check_error) and 'auto_grades'
+            (question id -> suggested mark row)
+        """
+        with self._connection(exam=exam) as conn:
+            submission = self._execute(
+                conn, "SELECT * FROM submissions WHERE id = ?",
+                (submission_id,)).fetchone()
+            if not submission:
+                return None
+
+            latest = self._execute(
+                conn,
+                """
+                SELECT id FROM submissions
+                WHERE student_number = ? AND exam_id = ?
+                ORDER BY submission_time DESC LIMIT 1
+                """,
+                (submission['student_number'], submission['exam_id'])).fetchone()
+            grade = self._execute(
+                conn, "SELECT * FROM grades WHERE submission_id = ?",
+                (submission_id,)).fetchone()
+            answers = self._execute(
+                conn,
+                """
+                SELECT question_id, answer_content, check_status, check_error
+                FROM question_answers
+                WHERE submission_id = ?
+                """,
+                (submission_id,)).fetchall()
+            auto_grades = self._execute(
+                conn, "SELECT * FROM auto_grades WHERE submission_id = ?",
+                (submission_id,)).fetchall()
+
+        return {
+            'submission': submission,
+            'is_latest': bool(latest) and latest['id'] == submission_id,
+            'grade': grade,
+            'answers': answers,
+            'auto_grades': {row['question_id']: row for row in auto_grades}
+        }
+
+    # Answer pre-check
+
+    def answers_to_check(self, after_submission_id, limit, exam_id=None):
+        """
+        The answers saved with the next `limit` submissions after the given
+        id, in the database of `exam_id` (see live_scopes).
+
+        Returns:
+            tuple: (id of the last submission in the batch, number of
+            submissions in it, answer rows with the submission's
+            student_number and exam_id)
+        """
+        with self._connection(exam_id=exam_id) as conn:
+            batch = self._execute(
+                conn,
+                """
+                SELECT MAX(id) AS last_id, COUNT(*) AS count FROM (
+                    SELECT id FROM submissions WHERE id > ? ORDER BY id LIMIT ?
+                ) batch
+                """,
+                (after_submission_id, limit)).fetchone()
+            if not batch['count']:
+                return after_submission_id, 0, []
+
+            rows = self._execute(
+                conn,
+                """
+                SELECT qa.id, qa.submission_id, qa.question_id, qa.answer_content,
+                       qa.check_status, s.student_number, s.exam_id
+                FROM question_answers qa
+                JOIN submissions s ON s.id = qa.submission_id
+                WHERE qa.submission_id > ? AND qa.submission_id <= ?
+                """,
+                (after_submission_id, batch['last_id'])).fetchall()
+        return batch['last_id'], batch['count'], rows
+
+    def save_answer_checks(self, outcomes, exam_id=None):
+        """Store pre-check outcomes, given as (status, error, answer id)"""
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            self._executemany(
+                conn,
+                "UPDATE question_answers SET check_status = ?, check_error = ? WHERE id = ?",
+                outcomes)
+
+    def reset_answer_checks(self, question_id, exam_id):
+        """Have a question's answers checked again"""
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            self._execute(
+                conn,
+                "UPDATE question_answers SET check_status = NULL, check_error = NULL WHERE question_id = ?",
+                (question_id,))
+
+    # Grades
+
+    def save_grade(self, submission_id, mark, comment, graded_by, exam_id=None):
+        """Grade a submission, replacing an earlier grade of it"""
+        now = datetime.now()
+        # grades.mark is text; numbers are stored as SQLite has always stored them
+        mark = str(mark) if mark is not None else None
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            existing_grade = self._execute(
+                conn, "SELECT id FROM grades WHERE submission_id = ?",
+                (submission_id,)).fetchone()
+            if existing_grade:
+                self._execute(
+                    conn,
+                    """
+                    UPDATE grades
+                    SET mark = ?, comment = ?, graded_by = ?, graded_at = ?
+                    WHERE submission_id = ?
+                    """,
+                    (mark, comment, graded_by, now, submission_id))
+            else:
+                self._execute(
+                    conn,
+                    """
+                    INSERT INTO grades
+                    (submission_id, mark, comment, graded_by, graded_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (submission_id, mark, comment, graded_by, now))
+
+    def latest_exam_answers(self, exam_id):
+        """(submission id, question id, answer) of every student's latest submission"""
+        with self._connection(exam_id=exam_id) as conn:
+            rows = self._execute(
+                conn,
+                """
+                SELECT qa.submission_id, qa.question_id, qa.answer_content
+                FROM question_answers qa
+                JOIN (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY student_number ORDER BY submission_time DESC
+                    ) AS position
+                    FROM submissions
+                    WHERE exam_id = ?
+                ) latest ON latest.id = qa.submission_id AND latest.position = 1
+                """,
+                (exam_id,)).fetchall()
+        return [(row['submission_id'], row['question_id'], row['answer_content'])
+                for row in rows]
+
+    def save_auto_grades(self, results, graded_at, exam_id):
+        """Store the auto-grader's suggested marks, replacing earlier ones"""
+        with self._connection(write=True, exam_id=exam_id) as conn:
+            self._executemany(
+                conn,
+                """
+                INSERT INTO auto_grades
+                (submission_id, question_id, status, detail, suggested_mark, graded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (submission_id, question_id) DO UPDATE SET
+                    status = excluded.status, detail = excluded.detail,
+                    suggested_mark = excluded.suggested_mark,
+                    graded_at = excluded.graded_at
+                """,
+                [(r['submission_id'], r['question_id'], r['status'], r['detail'],
+                  r['suggested_mark'], graded_at) for r in results])
+
+    def auto_grade_counts(self, exam_id):
+        """Number of auto-graded answers of an exam per outcome"""
+        with self._connection(exam_id=exam_id) as conn:
+            rows = self._execute(
+                conn,
+                """
+                SELECT ag.status, COUNT(*) AS count
+                FROM auto_grades ag
+                JOIN submissions s ON s.id = ag.submission_id
+                WHERE s.exam_id = ?
+                GROUP BY ag.status
+                """,
+                (exam_id,)).fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    # Reports
+
+    def grade_report(self, exams, snapshot=False):
+        """
+        The grades of each student's latest submission in every exam.
+
+        Returns:
+            tuple: ({(student name, student number) of everyone who
+            submitted}, grade rows with student_name, student_number, exam_id
+            and model_id)
+        """
+        students = set()
+        grades = []
+        for exam in self._report_scopes(exams):
+            with self._connection(exam=exam, snapshot=snapshot) as conn:
+                students.update(
+                    (row['student_name'], row['student_number'])
+                    for row in self._execute(
+                        conn, "SELECT DISTINCT student_name, student_number FROM submissions"))
+                grades.extend(self._execute(
+                    conn,
+                    """
+                    WITH latest_submissions AS (
+                        SELECT s.id, s.student_number, s.exam_id, s.student_name, s.model_id,
+                               ROW_NUMBER() OVER (PARTITION BY s.student_number, s.exam_id
+                                                 ORDER BY s.submission_time DESC) AS submission_rank
+                        FROM submissions s
+                    )
+                    SELECT g.*, ls.student_name, ls.student_number, ls.exam_id, ls.model_id
+                    FROM grades g
+                    JOIN latest_submissions ls ON g.submission_id = ls.id AND ls.submission_rank = 1
+                    """).fetchall())
+        return students, grades
+
+    def ungraded_submissions(self, exam, snapshot=False):
+        """Each student's latest submission of an exam that has no grade, by name"""
+        with self._connection(exam=exam, snapshot=snapshot) as conn:
+            return self._execute(
+                conn,
+                """
+                WITH latest_submissions AS (
+                    SELECT s.id, s.student_name, s.student_number, s.model_id,
+                           ROW_NUMBER() OVER (PARTITION BY s.student_number, s.exam_id
+                                             ORDER BY s.submission_time DESC) AS submission_rank
+                    FROM submissions s
+                    WHERE s.exam_id = ?
+                )
+                SELECT ls.id as submission_id, ls.student_name, ls.student_number, ls.model_id
+                FROM latest_submissions ls
+                LEFT JOIN grades g ON g.submission_id = ls.id
+                WHERE ls.submission_rank = 1 AND g.id IS NULL
+                ORDER BY ls.student_name
+                """,
+                (exam['id'],)).fetchall()
+
+    def latest_submission_grades(self, exam):
+        """Each student's latest submission of an exam with its grade, if graded"""
+        with self._connection(exam=exam) as conn:
+            return self._execute(
+                conn,
+                """
+                WITH latest_submissions AS (
+                    SELECT s.id, s.student_number, s.student_name, s.submission_time, s.ip_address, s.model_id,
+                           ROW_NUMBER() OVER (PARTITION BY s.student_number
+                                             ORDER BY s.submission_time DESC) AS submission_rank
+                    FROM submissions s
+                    WHERE s.exam_id = ?
+                )
+                SELECT
+                    ls.id AS submission_id,
+                    ls.student_name,
+                    ls.student_number,
+                    ls.submission_time,
+                    ls.ip_address,
+                    ls.model_id,
+                    g.mark,
+                    g.comment,
+                    g.graded_at
+                FROM latest_submissions ls
+                LEFT JOIN grades g ON g.submission_id = ls.id
+                WHERE ls.submission_rank = 1
+                ORDER BY ls.student_name
+                """,
+                (exam['id'],)).fetchall()
+
+
+def _temp_schema(conn, statements):
+    """Run statements on the temp schema, also on a query_only connection"""
+    query_only = conn.execute("PRAGMA query_only").fetchone()[0]
+    conn.execute("PRAGMA query_only = 0")
+    try:
+        for statement in statements:
+            conn.execute(statement)
+    finally:
+        conn.execute(f"PRAGMA query_only = {query_only}")
+
+
+@contextmanager
+def _archive_views(conn, exam):
+    """
+    Point unqualified queries on `conn` at `exam`'s archive while inside the
+    block, if the exam has been archived; otherwise at the live database.
+    Nothing is written to the archive, so read-only connections work too.
+    """
+    if not exam or not exam['archive_path']:
+        yield
+        return
+
+    conn.execute("ATTACH DATABASE ? AS archive", (exam['archive_path'],))
+    try:
+        views = []
+        for table in EXAM_TABLES:
+            # Columns the live table gained after the exam was archived read as NULL
+            archived = {row['name']
+                        for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+            columns = ', '.join(
+                row['name'] if row['name'] in archived else f"NULL AS {row['name']}"
+                for row in conn.execute(f"PRAGMA main.table_info({table})").fetchall())
+            views.append(
+                f"CREATE TEMP VIEW {table} AS SELECT {columns} FROM archive.{table}")
+        _temp_schema(conn, views)
+        yield
+    finally:
+        _temp_schema(conn, [f"DROP VIEW IF EXISTS temp.{table}"
+                            for table in EXAM_TABLES])
+        conn.execute("DETACH DATABASE archive")
+
+
+class SQLiteStorage(Storage):
+    """
+    Exam data in the SQLite exam database. `connect` and `read_connect`
+    open write and read-only connections, to the exam database or to the
+    file at `path`; `read_connect` also takes `snapshot`. `compress` gives
+    the stored form of an answer.
+
+    An exam with a shard database of its own (exams.shard_path) is read and
+    written there. An archived exam is read from its archive file, through
+    temporary views that shadow the live tables, so the queries run
+    unchanged.
+    """
+
+    name = 'sqlite'
+    busy_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, connect, read_connect, compress):
+        self._connect = connect
+        self._read_connect = read_connect
+        self._compress = compress
+        # Exam id -> (its shard database path or None, when a None expires)
+        self._shards = {}
+
+    def shard_path(self, exam_id):
+        """Path of an exam's shard database, or None if its data is in the main one"""
+        if exam_id is None:
+            return None
+        cached = self._shards.get(exam_id)
+        if cached and (cached[1] is None or cached[1] > monotonic()):
+            return cached[0]
+        conn = self._read_connect()
+        try:
+            row = conn.execute(
+                "SELECT shard_path FROM exams WHERE id = ?", (exam_id,)).fetchone()
+        finally:
+            conn.close()
+        path = row['shard_path'] if row else None
+        self.set_shard(exam_id, path)
+        return path
+
+    def set_shard(self, exam_id, path):
+        """Route an exam's data to the shard database at `path` (None: the main one)"""
+        # A shard is never taken away; no shard is only believed for a while
+        self._shards[exam_id] = (path, None if path else monotonic() + NO_SHARD_TTL)
+
+    @contextmanager
+    def _connection(self, write=False, exam=None, exam_id=None, snapshot=False):
+        shard = self.shard_path(exam['id'] if exam else exam_id)
+        if shard:
+            # The shard holds its exam's data, archived or not
+            conn = self._connect(path=shard) if write else self._read_connect(path=shard)
+            exam = None
+        else:
+            conn = self._connect() if write else self._read_connect(snapshot=snapshot)
+        try:
+            with conn, _archive_views(conn, exam):
+                yield conn
+        finally:
+            conn.close()
+
+    def _report_scopes(self, exams):
+        return [None] + [exam for exam in exams
+                         if exam['archive_path'] or self.shard_path(exam['id'])]
+
+    def _holds_ip_policies(self, exam_id):
+        return self.shard_path(exam_id) is None
+
+    def live_scopes(self):
+        conn = self._read_connect()
+        try:
+            rows = conn.execute(
+                "SELECT id FROM exams WHERE shard_path IS NOT NULL AND archive_path IS NULL"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [None] + [row['id'] for row in rows]
+
+    def _insert(self, conn, query, params):
+        return conn.execute(query, params).lastrowid
+
+    def _lock_versions(self, conn, student_number, exam_id):
+        # The database's write lock, before reading the latest version
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+
+    def _stored_answer(self, text):
+        return self._compress(text)
+
+
+class PostgresStorage(Storage):
+    """
+    Exam data in PostgreSQL, through a pool of `min_size` to `max_size`
+    connections that requests wait up to `timeout` seconds for, opened by
+    open() or on first use. Answers are stored as text, since PostgreSQL compresses large
+    values itself.
+    Archiving is a SQLite feature: every exam is read from the same tables.
+    """
+
+    name = 'postgresql'
+
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS exam_sessions (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            student_name TEXT NOT NULL,
+            student_number TEXT NOT NULL,
+            exam_id INTEGER,
+            model_id INTEGER,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            ip_address TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS submissions (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            student_id INTEGER,
+            student_name TEXT NOT NULL,
+            student_number TEXT NOT NULL,
+            exam_id INTEGER,
+            model_id INTEGER,
+            submission_time TIMESTAMP,
+            ip_address TEXT,
+            code_content TEXT,
+            version INTEGER,
+            is_final SMALLINT DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS question_answers (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            submission_id BIGINT REFERENCES submissions (id),
+            question_id INTEGER,
+            answer_content TEXT,
+            check_status TEXT,
+            check_error TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ip_restrictions (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            ip_address TEXT NOT NULL UNIQUE,
+            is_blocked SMALLINT DEFAULT 0,
+            blocked_time TIMESTAMP,
+            approved SMALLINT DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS grades (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            submission_id BIGINT REFERENCES submissions (id),
+            mark TEXT,
+            comment TEXT,
+            graded_by INTEGER,
+            graded_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS auto_grades (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            submission_id BIGINT REFERENCES submissions (id),
+            question_id INTEGER,
+            status TEXT,
+            detail TEXT,
+            suggested_mark DOUBLE PRECISION,
+            graded_at TIMESTAMP,
+            UNIQUE (submission_id, question_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_submissions_student ON submissions (student_number, exam_id, model_id, version)",
+        "CREATE INDEX IF NOT EXISTS idx_submissions_exam ON submissions (exam_id, submission_time)",
+        "CREATE INDEX IF NOT EXISTS idx_question_answers_submission ON question_answers (submission_id)",
+        "CREATE INDEX IF NOT EXISTS idx_exam_sessions_student ON exam_sessions (student_number, exam_id)",
+        "CREATE INDEX IF NOT EXISTS idx_grades_submission ON grades (submission_id)"
+    ]
+
+    def __init__(self, dsn, min_size=2, max_size=20, timeout=10):
+        if psycopg is None:
+            raise RuntimeError(
+                "The PostgreSQL storage backend needs the psycopg and psycopg_pool "
+                "packages (pip install 'psycopg[binary]' psycopg_pool)")
+        self.busy_errors = (psycopg.OperationalError, PoolTimeout)
+        self._pool = ConnectionPool(
+            dsn, min_size=min_size, max_size=max_size, timeout=timeout,
+            kwargs={'row_factory': dict_row}, open=False)
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def open(self):
+        """Open the connection pool and create the tables that do not exist yet"""
+        with self._open_lock:
+            if self._opened:
+                return
+            self._pool.open(wait=True)
+            with self._pool.connection() as conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+            self._opened = True
+
+    @contextmanager
+    def _connection(self, write=False, exam=None, exam_id=None, snapshot=False):
+        # Processes that only import the app never connect
+        if not self._opened:
+            self.open()
+        # The pool commits when the block ends, or rolls back on an error
+        with self._pool.connection() as conn:
+            yield conn
+
+    def _sql(self, query):
+        return _postgres_sql(query)
+
+    def _executemany(self, conn, query, rows):
+        with conn.cursor() as cursor:
+            cursor.executemany(self._sql(query), rows)
+
+    def _insert(self, conn, query, params):
+        return conn.execute(self._sql(query) + " RETURNING id", params).fetchone()['id']
+
+    def _lock_versions(self, conn, student_number, exam_id):
+        # Like SELECT ... FOR UPDATE on the student's submissions, but also
+        # held before their first one; released when the transaction ends
+        self._execute(conn, "SELECT pg_advisory_xact_lock(?, hashtext(?))",
+                      (exam_id, student_number))
+
+    def pool_stats(self):
+        """Connection pool counters (pool_size, pool_available, requests_waiting, ...)"""
+        return self._pool.get_stats()
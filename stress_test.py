@@ -14,9 +14,18 @@ import re
 import argparse
 import sys
 from datetime import datetime
-import statistics
 from requests.exceptions import ProxyError
 import os
+import asyncio
+import multiprocessing
+import threading
+import math
+import csv
+
+try:
+    import aiohttp  # Only needed for the open-loop (--open-loop) mode
+except ImportError:
+    aiohttp = None
 
 # Configuration
 DEFAULT_URL = "http://localhost:5000"
@@ -24,21 +33,331 @@ DEFAULT_NUM_STUDENTS = 100
 DEFAULT_CONCURRENT_STUDENTS = 20  # How many students to run in parallel at once
 DEFAULT_AUTO_SAVES_PER_STUDENT = 3  # Number of auto-saves before final submission
 
+# Open-loop configuration
+DEFAULT_ARRIVAL_RATE = 10.0  # Students starting the exam per second
+DEFAULT_SAVE_INTERVAL = 5.0  # Seconds between scheduled auto-saves of one student
+DEFAULT_PROCESSES = 1  # Worker processes to fan the virtual students out over
+
+# Scenario configuration (seconds of test time)
+DEFAULT_SCENARIO = "constant"
+DEFAULT_EXAM_DURATION = 300.0  # How long each student's exam timer runs
+DEFAULT_LOGIN_WINDOW = 60.0  # Period over which the login storm arrives
+DEFAULT_RECONNECT_WINDOW = 10.0  # Period over which students reconnect after a restart
+DEFAULT_RELOAD_RATE = 0.05  # Chance per save interval that a student reloads the page
+
+# Teacher workload configuration
+DEFAULT_TEACHER_USERNAME = "teacher"
+DEFAULT_TEACHER_PASSWORD = "admin123"
+DEFAULT_TEACHER_INTERVAL = 5.0  # Mean seconds between one teacher's page loads
+DEFAULT_TEACHER_MIX = "submissions=4,all_grades=2,ip_management=2,export=1"
+
+# Teacher pages that run heavy reads while the exam is in progress
+TEACHER_ACTIONS = {
+    "submissions": "/teacher/submissions/{exam_id}",
+    "all_grades": "/teacher/all_grades",
+    "ip_management": "/teacher/ip_management",
+    "export": "/teacher/export_grades/{exam_id}"
+}
+
 # IP Rotation Configuration
 USE_IP_ROTATION = True  # Set to False if you don't want to use IP rotation
 FAKE_IP_HEADER = 'X-Forwarded-For'  # Header for sending custom IP
 
-# Global statistics
-stats = {
-    "login_times": [],
-    "exam_load_times": [],
-    "auto_save_times": [],
-    "submission_times": [],
-    "total_times": [],
-    "failed_requests": 0,
-    "successful_students": 0,
-    "models_assigned": {}  # Track which models are assigned to students
+
+# Actions whose latency is recorded, in report order
+ACTIONS = ["login", "reconnect", "exam_load", "auto_save", "submission", "total"] + \
+    [f"teacher_{name}" for name in TEACHER_ACTIONS]
+ACTION_LABELS = {
+    "login": "Login",
+    "reconnect": "Reconnect login",
+    "exam_load": "Exam load",
+    "auto_save": "Auto-save",
+    "submission": "Final submission",
+    "total": "Total student flow",
+    "teacher": "Teacher",
+    "teacher_submissions": "Teacher: view submissions",
+    "teacher_all_grades": "Teacher: all grades",
+    "teacher_ip_management": "Teacher: IP management",
+    "teacher_export": "Teacher: export grades"
 }
+PERCENTILES = [50, 90, 99, 99.9]
+
+# Regression check configuration
+DEFAULT_REGRESSION_THRESHOLD = 10.0  # Percent a metric may worsen before it is flagged
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram.
+
+    Each bucket is 1% wider than the previous one, so percentiles are accurate
+    to about 1% however many samples are recorded, memory stays constant, and
+    histograms from several threads or processes can simply be added up.
+    """
+
+    GROWTH = 1.01
+    MIN_SECONDS = 0.0001
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            return 0
+        return int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1
+
+    def record(self, seconds):
+        index = self._bucket(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        """Return the latency (seconds) below which pct percent of samples fall"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                # Report the bucket's upper bound, but never above the real max
+                return min(self.MIN_SECONDS * self.GROWTH ** index, self.max)
+        return self.max
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min or 0.0,
+            "max": self.max or 0.0
+        }
+        for pct in PERCENTILES:
+            result[f"p{pct:g}"] = self.percentile(pct)
+        return result
+
+    def to_dict(self):
+        return {
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = {int(index): count for index,
+                             count in data["buckets"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class StatsRecorder:
+    """
+    Thread-safe collector for everything a stress test run measures:
+    latency histograms per action, errors by action and kind (HTTP status,
+    timeout, failed login, ...), requests completed per second, successful
+    students and the exam models handed out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {action: LatencyHistogram() for action in ACTIONS}
+        self.errors = {}  # "action:kind" -> count
+        self.timeline = {}  # Wall-clock second -> {"requests": n, "errors": n}
+        self.successful_students = 0
+        self.models_assigned = {}  # Track which models are assigned to students
+        # Student write latency, split by whether teacher reports overlapped it
+        self.write_latency = {"quiet": LatencyHistogram(),
+                              "reporting": LatencyHistogram()}
+
+    def _tick(self, field):
+        slot = self.timeline.setdefault(
+            int(time.time()), {"requests": 0, "errors": 0})
+        slot[field] += 1
+
+    def record_latency(self, action, seconds):
+        with self._lock:
+            self.latencies[action].record(seconds)
+            if action != "total":
+                self._tick("requests")
+
+    def record_error(self, action, kind):
+        with self._lock:
+            key = f"{action}:{kind}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+            self._tick("errors")
+
+    def record_write_load(self, during_reports, seconds):
+        with self._lock:
+            self.write_latency["reporting" if during_reports else "quiet"].record(
+                seconds)
+
+    def record_success(self):
+        with self._lock:
+            self.successful_students += 1
+
+    def record_model(self, model):
+        with self._lock:
+            self.models_assigned[model] = self.models_assigned.get(
+                model, 0) + 1
+
+    @property
+    def failed_requests(self):
+        return sum(self.errors.values())
+
+    @property
+    def total_requests(self):
+        return sum(self.latencies[action].count for action in ACTIONS if action != "total")
+
+    def errors_by_kind(self):
+        """Aggregate the error counts over all actions"""
+        kinds = {}
+        for key, count in self.errors.items():
+            kind = key.split(":", 1)[1]
+            kinds[kind] = kinds.get(kind, 0) + count
+        return kinds
+
+    def throughput_timeline(self):
+        """Requests and errors per second, relative to the first second"""
+        if not self.timeline:
+            return []
+        first, last = min(self.timeline), max(self.timeline)
+        empty = {"requests": 0, "errors": 0}
+        return [
+            {"second": second - first, **self.timeline.get(second, empty)}
+            for second in range(first, last + 1)
+        ]
+
+    def merge(self, other):
+        """Merge another recorder (e.g. from a worker process) into this one"""
+        with self._lock:
+            for action in ACTIONS:
+                self.latencies[action].merge(other.latencies[action])
+            for key, count in other.errors.items():
+                self.errors[key] = self.errors.get(key, 0) + count
+            for second, slot in other.timeline.items():
+                mine = self.timeline.setdefault(
+                    second, {"requests": 0, "errors": 0})
+                mine["requests"] += slot["requests"]
+                mine["errors"] += slot["errors"]
+            self.successful_students += other.successful_students
+            for model, count in other.models_assigned.items():
+                self.models_assigned[model] = self.models_assigned.get(
+                    model, 0) + count
+            for load, histogram in other.write_latency.items():
+                self.write_latency[load].merge(histogram)
+
+    def to_dict(self):
+        return {
+            "latencies": {action: histogram.to_dict() for action, histogram in self.latencies.items()},
+            "errors": dict(self.errors),
+            "timeline": {str(second): slot for second, slot in self.timeline.items()},
+            "successful_students": self.successful_students,
+            "models_assigned": dict(self.models_assigned),
+            "write_latency": {load: histogram.to_dict() for load, histogram in self.write_latency.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        recorder = cls()
+        recorder.latencies = {action: LatencyHistogram.from_dict(histogram)
+                              for action, histogram in data["latencies"].items()}
+        recorder.errors = dict(data["errors"])
+        recorder.timeline = {int(second): slot for second,
+                             slot in data["timeline"].items()}
+        recorder.successful_students = data["successful_students"]
+        recorder.models_assigned = dict(data["models_assigned"])
+        recorder.write_latency = {load: LatencyHistogram.from_dict(histogram)
+                                  for load, histogram in data["write_latency"].items()}
+        return recorder
+
+
+def response_error_kind(status_code):
+    """Map the status of an unsuccessful response to an error kind"""
+    # The login form is re-rendered with 200 when the login is refused
+    return "login_failed" if status_code == 200 else f"http_{status_code}"
+
+
+def classify_error(exc):
+    """Map an exception raised while sending a request to an error kind"""
+    if isinstance(exc, (requests.Timeout, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, requests.ConnectionError) or (
+            aiohttp is not None and isinstance(exc, aiohttp.ClientConnectionError)):
+        return "connection_error"
+    return type(exc).__name__
+
+
+class ReportingLoad:
+    """
+    Counts teacher requests in flight across threads and worker processes, so
+    every student write can be tagged as overlapping reporting load or not.
+    """
+
+    def __init__(self):
+        self._in_flight = multiprocessing.Value('i', 0)
+        self._started = multiprocessing.Value('i', 0)
+
+    def begin(self):
+        with self._in_flight.get_lock():
+            self._in_flight.value += 1
+        with self._started.get_lock():
+            self._started.value += 1
+
+    def end(self):
+        with self._in_flight.get_lock():
+            self._in_flight.value -= 1
+
+    def snapshot(self):
+        return self._in_flight.value, self._started.value
+
+    def overlapped(self, snapshot):
+        """Whether a teacher request ran at any point since snapshot()"""
+        in_flight, started = snapshot
+        return in_flight > 0 or self._in_flight.value > 0 or self._started.value != started
+
+
+# Global statistics
+stats = StatsRecorder()
+
+# Set while teacher workers run (and inherited by worker processes)
+reporting_load = None
+
+
+def write_load_snapshot():
+    """Capture the teacher load before a student write, if teachers are running"""
+    return reporting_load.snapshot() if reporting_load is not None else None
+
+
+def record_student_write(recorder, action, seconds, snapshot):
+    """Record a student write and whether it overlapped teacher reporting"""
+    recorder.record_latency(action, seconds)
+    if snapshot is not None:
+        recorder.record_write_load(reporting_load.overlapped(snapshot), seconds)
 
 # ANSI color codes for better console output
 GREEN = '\033[92m'
@@ -74,34 +393,34 @@ def generate_random_ip():
     return f"{random.randint(1, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 255)}"
 
 
-def extract_questions_from_html(html_content):
-    """Extract question IDs from the exam HTML page"""
-    # Use regex to find question IDs in data-question-id attributes
-    question_ids = re.findall(r'data-question-id="(\d+)"', html_content)
+def extract_questions_from_content(content):
+    """Extract question IDs from the exam content API payload"""
+    return [question['id'] for question in content.get('questions', [])]
 
-    # If that fails, try an alternative approach by looking for question panels
-    if not question_ids:
-        question_ids = re.findall(r'id="question-panel-(\d+)"', html_content)
 
-    # Convert to integers and return
-    return [int(qid) for qid in question_ids]
+def extract_model_from_content(content):
+    """Extract the exam model name from the exam content API payload"""
+    model = content.get('model')
+    return model['name'] if model else "Unknown Model"
 
 
-def extract_model_from_html(html_content):
-    """Extract the exam model from the HTML page"""
-    # Look for the model-badge class which contains the model name
-    model_pattern = re.search(
-        r'<span class="model-badge">([^<]+)</span>', html_content)
-    if model_pattern:
-        return model_pattern.group(1).strip()
+def wait_for_admission(session, base_url, login_response):
+    """
+    Follow the waiting room after a login that was queued, as its page does.
 
-    # If we can't find the model with the above pattern, try a more generic approach
-    model_pattern = re.search(
-        r'[Mm]odel\s*(?:name|type|)?\s*[: ]?\s*([A-Za-z0-9 ]+)', html_content)
-    if model_pattern:
-        return model_pattern.group(1).strip()
-
-    return "Unknown Model"
+    Returns:
+        bool: Whether the student was admitted (True if never queued)
+    """
+    if "/waiting" not in login_response.url:
+        return True
+    while True:
+        response = session.get(f"{base_url}/api/login_status", timeout=30)
+        if response.status_code != 200:
+            return False
+        status = response.json()
+        if status.get('admitted'):
+            return True
+        time.sleep(status.get('retry_after', 2) * (1 + random.random() / 2))
 
 
 def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
@@ -109,6 +428,7 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
     session = requests.Session()  # Use session to maintain cookies
     student_data = generate_student_data(student_index)
     start_time = time.time()
+    action = "login"  # Action in progress, to attribute exceptions
 
     # Generate a unique IP for this student if IP rotation is enabled
     if USE_IP_ROTATION:
@@ -130,48 +450,55 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
             data=student_data,
             timeout=30
         )
+        admitted = wait_for_admission(session, base_url, login_response)
         login_time = time.time() - login_start
-        stats["login_times"].append(login_time)
+        stats.record_latency("login", login_time)
 
-        if login_response.status_code != 200 or "login" in login_response.url:
+        if login_response.status_code != 200 or "login" in login_response.url or not admitted:
             print(
                 f"{RED}Login failed for student {student_data['student_number']}{ENDC}")
-            stats["failed_requests"] += 1
+            stats.record_error("login", response_error_kind(
+                login_response.status_code))
             return False
 
-        # Step 2: Access the exam page
+        # Step 2: Access the exam page: the page shell, then the model's
+        # questions and the student's own state, as the browser does
+        action = "exam_load"
         exam_start = time.time()
         exam_response = session.get(f"{base_url}/take_exam", timeout=30)
+        if exam_response.status_code == 200:
+            exam_response = session.get(
+                f"{base_url}/api/exam/content", timeout=30)
+        if exam_response.status_code == 200:
+            content = exam_response.json()
+            exam_response = session.get(
+                f"{base_url}/api/exam/state", timeout=30)
         exam_time = time.time() - exam_start
-        stats["exam_load_times"].append(exam_time)
+        stats.record_latency("exam_load", exam_time)
 
         if exam_response.status_code != 200:
             print(
                 f"{RED}Failed to access exam for {student_data['student_number']}{ENDC}")
-            stats["failed_requests"] += 1
+            stats.record_error(
+                "exam_load", response_error_kind(exam_response.status_code))
             return False
 
-        # Extract question IDs from the exam page
-        question_ids = extract_questions_from_html(exam_response.text)
+        # Extract question IDs from the exam content
+        question_ids = extract_questions_from_content(content)
         # Get the actual number of questions from the extracted IDs
         num_questions = len(question_ids)
 
         if num_questions == 0:
             print(
-                f"{YELLOW}Warning: Could not extract question IDs for {student_data['student_number']}. HTML parsing may need adjustment.{ENDC}")
-            # Try to count question panels as a fallback
-            question_panels = re.findall(
-                r'class="question-panel"', exam_response.text)
-            num_questions = len(question_panels) if question_panels else 5
+                f"{YELLOW}Warning: No questions in the exam content for {student_data['student_number']}.{ENDC}")
+            num_questions = 5
             print(f"{YELLOW}Using fallback question count: {num_questions}{ENDC}")
 
         # Extract the model assigned to this student
-        model_assigned = extract_model_from_html(exam_response.text)
+        model_assigned = extract_model_from_content(content)
 
         # Track the model in our statistics
-        if model_assigned not in stats["models_assigned"]:
-            stats["models_assigned"][model_assigned] = 0
-        stats["models_assigned"][model_assigned] += 1
+        stats.record_model(model_assigned)
 
         if verbose:
             print(
@@ -182,12 +509,14 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
                    for q_id in question_ids} if question_ids else generate_random_answers(num_questions, student_index=student_index)
 
         # Step 3: Auto-save answers a few times (simulating work in progress)
+        action = "auto_save"
         for save_num in range(auto_saves):
             # Modify answers slightly for each save to simulate progress
             current_answers = {
                 k: f"Answer from student {student_index} to question {k} (revision {save_num+1})"
                 for k in answers.keys()}
 
+            snapshot = write_load_snapshot()
             auto_save_start = time.time()
             save_response = session.post(
                 f"{base_url}/api/auto_save",
@@ -197,12 +526,13 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
                 timeout=30
             )
             auto_save_time = time.time() - auto_save_start
-            stats["auto_save_times"].append(auto_save_time)
+            record_student_write(stats, "auto_save", auto_save_time, snapshot)
 
             if save_response.status_code != 200:
                 print(
                     f"{RED}Auto-save failed for student {student_data['student_number']}{ENDC}")
-                stats["failed_requests"] += 1
+                stats.record_error(
+                    "auto_save", response_error_kind(save_response.status_code))
                 # Continue anyway as this might be just one failed auto-save
 
             # Add a small delay between auto-saves (100-300ms)
@@ -213,6 +543,8 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
             k: f"Answer from student {student_index} to question {k} (revision {auto_saves+1})"
             for k in answers.keys()}
 
+        action = "submission"
+        snapshot = write_load_snapshot()
         submit_start = time.time()
         submit_response = session.post(
             f"{base_url}/api/submit",
@@ -222,40 +554,126 @@ def simulate_student(student_index, base_url, auto_saves=3, verbose=False):
             timeout=30
         )
         submit_time = time.time() - submit_start
-        stats["submission_times"].append(submit_time)
+        record_student_write(stats, "submission", submit_time, snapshot)
 
         if submit_response.status_code != 200:
             print(
                 f"{RED}Final submission failed for student {student_data['student_number']}{ENDC}")
-            stats["failed_requests"] += 1
+            stats.record_error(
+                "submission", response_error_kind(submit_response.status_code))
             return False
 
         # Calculate total time for this student's exam flow
         total_time = time.time() - start_time
-        stats["total_times"].append(total_time)
+        stats.record_latency("total", total_time)
 
         if verbose:
             print(
                 f"{GREEN}Student {student_data['student_number']} completed exam in {total_time:.2f} seconds{ENDC}")
 
-        stats["successful_students"] += 1
+        stats.record_success()
         return True
 
     except Exception as e:
         print(
             f"{RED}Error for student {student_data['student_number']}: {str(e)}{ENDC}")
-        stats["failed_requests"] += 1
+        stats.record_error(action, classify_error(e))
         return False
 
 
-def run_stress_test(base_url, num_students, max_workers, auto_saves, verbose=False):
+def parse_teacher_mix(text):
+    """Parse 'submissions=4,export=1' into action weights"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in TEACHER_ACTIONS:
+            raise ValueError(
+                f"Unknown teacher action '{name}' (choose from {', '.join(TEACHER_ACTIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def find_active_exam_id(base_url, username, password):
+    """Log in as a teacher and read the active exam's id from the dashboard"""
+    session = requests.Session()
+    response = session.post(f"{base_url}/teacher_login",
+                            data={'username': username, 'password': password}, timeout=30)
+    match = re.search(r'class="active-exam".*?/teacher/submissions/(\d+)',
+                      response.text, re.DOTALL)
+    return int(match.group(1)) if match else None
+
+
+def _teacher_url(base_url, name, exam_id):
+    return base_url + TEACHER_ACTIONS[name].format(exam_id=exam_id)
+
+
+def simulate_teacher(worker_index, base_url, teacher_options, stop_event, verbose=False):
+    """Simulate a teacher browsing heavy report pages until stop_event is set"""
+    session = requests.Session()
+    rng = random.Random(f"teacher-{worker_index}")
+    names = list(teacher_options["mix"])
+    weights = [teacher_options["mix"][name] for name in names]
+
+    try:
+        response = session.post(
+            f"{base_url}/teacher_login",
+            data={'username': teacher_options["username"],
+                  'password': teacher_options["password"]},
+            timeout=30
+        )
+        if response.status_code != 200 or "teacher_login" in response.url:
+            print(f"{RED}Teacher {worker_index} could not log in{ENDC}")
+            stats.record_error("teacher", response_error_kind(
+                response.status_code))
+            return
+    except Exception as e:
+        stats.record_error("teacher", classify_error(e))
+        return
+
+    # Think time is exponential, so page loads arrive as a Poisson process
+    while not stop_event.wait(rng.expovariate(1 / teacher_options["interval"])):
+        name = rng.choices(names, weights)[0]
+        action = f"teacher_{name}"
+        reporting_load.begin()
+        try:
+            start = time.time()
+            response = session.get(_teacher_url(
+                base_url, name, teacher_options["exam_id"]), timeout=120)
+            stats.record_latency(action, time.time() - start)
+            if response.status_code != 200:
+                stats.record_error(
+                    action, response_error_kind(response.status_code))
+            elif verbose:
+                print(f"{CYAN}Teacher {worker_index} loaded {name}{ENDC}")
+        except Exception as e:
+            stats.record_error(action, classify_error(e))
+        finally:
+            reporting_load.end()
+
+
+def run_stress_test(base_url, num_students, max_workers, auto_saves, verbose=False, report_dir=".",
+                    teacher_options=None):
     """Run the stress test with concurrent students"""
+    global reporting_load
+
     print(f"{BLUE}Starting stress test with {num_students} students{ENDC}")
     print(f"{BLUE}Using max {max_workers} concurrent connections{ENDC}")
     print(f"{BLUE}Each student will perform {auto_saves} auto-saves plus final submission{ENDC}")
 
     start_time = time.time()
 
+    # Teachers browse report pages alongside the students until they finish
+    stop_teachers = threading.Event()
+    teacher_threads = []
+    if teacher_options:
+        print(f"{BLUE}Running {teacher_options['teachers']} teacher worker(s) on exam {teacher_options['exam_id']}{ENDC}")
+        reporting_load = ReportingLoad()
+        for i in range(teacher_options["teachers"]):
+            thread = threading.Thread(target=simulate_teacher, args=(
+                i, base_url, teacher_options, stop_teachers, verbose), daemon=True)
+            thread.start()
+            teacher_threads.append(thread)
+
     # Create a thread pool to simulate concurrent students
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         # Submit all student simulation tasks
@@ -285,53 +703,105 @@ def run_stress_test(base_url, num_students, max_workers, auto_saves, verbose=Fal
                 print(
                     f"{RED}Student {student_idx} generated an exception: {str(e)}{ENDC}")
 
+    stop_teachers.set()
+    for thread in teacher_threads:
+        thread.join()
+
     total_time = time.time() - start_time
 
-    # Calculate and print statistics
+    return report_results(total_time, num_students, {
+        "mode": "closed",
+        "num_students": num_students,
+        "concurrent_students": max_workers,
+        "auto_saves_per_student": auto_saves,
+        "base_url": base_url,
+        "teachers": _public_teacher_options(teacher_options)
+    }, report_dir)
+
+
+def _public_teacher_options(teacher_options):
+    """Teacher options for the report, without the password"""
+    if not teacher_options:
+        return None
+    return {key: value for key, value in teacher_options.items() if key != "password"}
+
+
+def report_results(total_time, num_students, configuration, report_dir="."):
+    """Print the collected statistics and save them as JSON and CSV reports"""
+    latency = {action: stats.latencies[action].summary() for action in ACTIONS}
+    total_requests = stats.total_requests
+    requests_per_second = total_requests / total_time if total_time > 0 else 0.0
+    error_rate = stats.failed_requests / max(1, total_requests)
+    timeline = stats.throughput_timeline()
+
     print(f"\n{PURPLE}=== Stress Test Results ==={ENDC}")
     print(f"{GREEN}Total time: {total_time:.2f} seconds{ENDC}")
     print(
-        f"{GREEN}Students: {stats['successful_students']}/{num_students} completed successfully{ENDC}")
-    print(f"{RED}Failed requests: {stats['failed_requests']}{ENDC}")
+        f"{GREEN}Students: {stats.successful_students}/{num_students} completed successfully{ENDC}")
+    print(f"{RED}Failed requests: {stats.failed_requests}{ENDC}")
 
-    # Only calculate stats if we have successful operations
-    if stats["login_times"]:
+    # Only print latency lines for actions that actually happened
+    if any(latency[action]["count"] for action in ACTIONS):
         print(f"\n{PURPLE}=== Performance Statistics (seconds) ==={ENDC}")
-        print(f"Login: avg={statistics.mean(stats['login_times']):.3f}, "
-              f"min={min(stats['login_times']):.3f}, "
-              f"max={max(stats['login_times']):.3f}")
-
-    if stats["exam_load_times"]:
-        print(f"Exam load: avg={statistics.mean(stats['exam_load_times']):.3f}, "
-              f"min={min(stats['exam_load_times']):.3f}, "
-              f"max={max(stats['exam_load_times']):.3f}")
-
-    if stats["auto_save_times"]:
-        print(f"Auto-save: avg={statistics.mean(stats['auto_save_times']):.3f}, "
-              # Fixed extra colon in format specifier
-              f"min={min(stats['auto_save_times']):.3f}, "
-              f"max={max(stats['auto_save_times']):.3f}")
-
-    if stats["submission_times"]:
-        print(f"Final submission: avg={statistics.mean(stats['submission_times']):.3f}, "
-              f"min={min(stats['submission_times']):.3f}, "
-              f"max={max(stats['submission_times']):.3f}")
-
-    if stats["total_times"]:
-        print(f"Total student flow: avg={statistics.mean(stats['total_times']):.3f}, "
-              f"min={min(stats['total_times']):.3f}, "
-              f"max={max(stats['total_times']):.3f}")
+        for action in ACTIONS:
+            summary = latency[action]
+            if summary["count"]:
+                print(f"{ACTION_LABELS[action]}: n={summary['count']}, "
+                      f"avg={summary['mean']:.3f}, "
+                      f"p50={summary['p50']:.3f}, p90={summary['p90']:.3f}, "
+                      f"p99={summary['p99']:.3f}, p99.9={summary['p99.9']:.3f}, "
+                      f"max={summary['max']:.3f}")
+
+    # Break the failures down by action and kind (503, timeout, failed login...)
+    if stats.errors:
+        print(f"\n{PURPLE}=== Errors ==={ENDC}")
+        for key, count in sorted(stats.errors.items()):
+            action, kind = key.split(":", 1)
+            print(f"{ACTION_LABELS.get(action, action)}: {kind} x {count}")
+
+    if timeline:
+        print(f"\n{PURPLE}=== Throughput Over Time (requests/s) ==={ENDC}")
+        # Keep the chart readable for long runs by averaging into <= 30 rows
+        step = max(1, math.ceil(len(timeline) / 30))
+        rows = []
+        for i in range(0, len(timeline), step):
+            chunk = timeline[i:i + step]
+            rows.append((chunk[0]["second"],
+                         sum(slot["requests"] for slot in chunk) / len(chunk),
+                         sum(slot["errors"] for slot in chunk) / len(chunk)))
+        peak = max(row[1] for row in rows) or 1
+        for second, rate, errors in rows:
+            bar = '#' * int(round(40 * rate / peak))
+            error_text = f" {RED}({errors:.1f} errors/s){ENDC}" if errors else ""
+            print(f"{second:>5}s {rate:8.1f} {bar}{error_text}")
+
+    # How much teacher reporting slows down student writes
+    write_latency = {load: histogram.summary()
+                     for load, histogram in stats.write_latency.items()}
+    quiet, reporting = write_latency["quiet"], write_latency["reporting"]
+    if reporting["count"]:
+        print(f"\n{PURPLE}=== Student Writes vs Teacher Reporting Load ==={ENDC}")
+        for label, summary in (("Without reports", quiet), ("During reports", reporting)):
+            if summary["count"]:
+                print(f"{label}: n={summary['count']}, avg={summary['mean']:.3f}, "
+                      f"p50={summary['p50']:.3f}, p90={summary['p90']:.3f}, "
+                      f"p99={summary['p99']:.3f}, max={summary['max']:.3f}")
+        if quiet["count"]:
+            changes = ", ".join(
+                f"{key} {(reporting[key] / quiet[key] - 1) * 100:+.0f}%"
+                for key in ("p50", "p90", "p99") if quiet[key] > 0)
+            print(f"{YELLOW}Degradation under reporting load: {changes}{ENDC}")
 
     # Display model distribution
-    if stats["models_assigned"]:
+    if stats.models_assigned:
         print(f"\n{PURPLE}=== Model Distribution ==={ENDC}")
-        total_models = sum(stats["models_assigned"].values())
-        for model, count in sorted(stats["models_assigned"].items()):
+        total_models = sum(stats.models_assigned.values())
+        for model, count in sorted(stats.models_assigned.items()):
             percentage = (count / total_models) * 100
             print(f"{model}: {count} students ({percentage:.1f}%)")
 
-    print(f"\n{CYAN}Requests per second: {(num_students * (auto_saves + 3)) / total_time:.2f}{ENDC}")
-    print(f"{CYAN}(Each student performs 1 login + 1 exam load + {auto_saves} auto-saves + 1 submission = {auto_saves + 3} requests){ENDC}")
+    print(f"\n{CYAN}Requests per second: {requests_per_second:.2f}{ENDC}")
+    print(f"{CYAN}({total_requests} requests completed in {total_time:.2f} seconds){ENDC}")
 
     # Create a timestamp for the report
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -339,35 +809,530 @@ def run_stress_test(base_url, num_students, max_workers, auto_saves, verbose=Fal
     # Save detailed results to a JSON file
     results = {
         "timestamp": timestamp,
-        "configuration": {
-            "num_students": num_students,
-            "concurrent_students": max_workers,
-            "auto_saves_per_student": auto_saves,
-            "base_url": base_url
-        },
+        "configuration": configuration,
         "summary": {
             "total_time_seconds": total_time,
-            "successful_students": stats["successful_students"],
-            "failed_requests": stats["failed_requests"],
-            "requests_per_second": (num_students * (auto_saves + 3)) / total_time
+            "num_students": num_students,
+            "successful_students": stats.successful_students,
+            "total_requests": total_requests,
+            "failed_requests": stats.failed_requests,
+            "error_rate": error_rate,
+            "requests_per_second": requests_per_second
         },
-        "detailed_stats": {
-            "login_times": stats["login_times"],
-            "exam_load_times": stats["exam_load_times"],
-            "auto_save_times": stats["auto_save_times"],
-            "submission_times": stats["submission_times"],
-            "total_times": stats["total_times"],
-            "models_assigned": stats["models_assigned"]
-        }
+        "latency": latency,
+        "errors": {
+            "by_action": dict(stats.errors),
+            "by_kind": stats.errors_by_kind()
+        },
+        "throughput": timeline,
+        "models_assigned": dict(stats.models_assigned),
+        "write_latency_under_load": write_latency,
+        # Raw histograms, so runs can be merged or re-analysed later
+        "histograms": {action: stats.latencies[action].to_dict() for action in ACTIONS}
     }
 
+    os.makedirs(report_dir, exist_ok=True)
+    base_name = os.path.join(report_dir, f"stress_test_results_{timestamp}")
+
     # Write results to file
-    results_file = f"stress_test_results_{timestamp}.json"
+    results_file = f"{base_name}.json"
     with open(results_file, 'w') as f:
         json.dump(results, f, indent=2)
 
+    # Per-action latency summary as CSV, for spreadsheets
+    csv_file = f"{base_name}.csv"
+    errors_per_action = {}
+    for key, count in stats.errors.items():
+        action = key.split(":", 1)[0]
+        errors_per_action[action] = errors_per_action.get(action, 0) + count
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["action", "count", "mean", "min"] +
+                        [f"p{pct:g}" for pct in PERCENTILES] + ["max", "errors"])
+        for action in ACTIONS:
+            summary = latency[action]
+            writer.writerow([action, summary["count"], f"{summary['mean']:.6f}", f"{summary['min']:.6f}"] +
+                            [f"{summary[f'p{pct:g}']:.6f}" for pct in PERCENTILES] +
+                            [f"{summary['max']:.6f}", errors_per_action.get(action, 0)])
+
+    timeline_file = f"{base_name}_timeline.csv"
+    with open(timeline_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["second", "requests", "errors"])
+        for slot in timeline:
+            writer.writerow([slot["second"], slot["requests"], slot["errors"]])
+
     print(f"\n{GREEN}Detailed results saved to {results_file}{ENDC}")
-    return stats["successful_students"] == num_students
+    print(f"{GREEN}CSV summaries saved to {csv_file} and {timeline_file}{ENDC}")
+    return results
+
+
+def compare_reports(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compare a run against a saved baseline run and print both side by side.
+
+    Returns a list of regressions: latency percentiles or error rate that grew,
+    or throughput that dropped, by more than threshold percent.
+    """
+    limit = 1 + threshold / 100
+    regressions = []
+
+    print(f"\n{PURPLE}=== Comparison With Baseline ({baseline.get('timestamp', '?')}) ==={ENDC}")
+    for action in ACTIONS:
+        before = baseline.get("latency", {}).get(action)
+        after = current.get("latency", {}).get(action)
+        if not before or not after or not before["count"] or not after["count"]:
+            continue
+        cells = []
+        for pct in PERCENTILES:
+            key = f"p{pct:g}"
+            regressed = after[key] > before[key] * limit
+            color = RED if regressed else GREEN
+            cells.append(
+                f"{key}={before[key]:.3f}->{color}{after[key]:.3f}{ENDC}")
+            if regressed:
+                regressions.append(
+                    f"{ACTION_LABELS[action]} {key}: {before[key]:.3f}s -> {after[key]:.3f}s")
+        print(f"{ACTION_LABELS[action]}: " + ", ".join(cells))
+
+    before_summary = baseline.get("summary", {})
+    after_summary = current.get("summary", {})
+
+    before_rate = before_summary.get("error_rate", 0.0)
+    after_rate = after_summary.get("error_rate", 0.0)
+    print(f"Error rate: {before_rate:.2%} -> {after_rate:.2%}")
+    # An error rate that grows from zero is always a regression
+    if after_rate > before_rate * limit and after_rate > 0:
+        regressions.append(
+            f"Error rate: {before_rate:.2%} -> {after_rate:.2%}")
+
+    before_rps = before_summary.get("requests_per_second", 0.0)
+    after_rps = after_summary.get("requests_per_second", 0.0)
+    print(f"Requests per second: {before_rps:.2f} -> {after_rps:.2f}")
+    if after_rps < before_rps / limit:
+        regressions.append(
+            f"Requests per second: {before_rps:.2f} -> {after_rps:.2f}")
+
+    if regressions:
+        print(f"\n{RED}Regressions (more than {threshold:g}% worse than baseline):{ENDC}")
+        for regression in regressions:
+            print(f"{RED}  - {regression}{ENDC}")
+    else:
+        print(f"\n{GREEN}No regressions beyond {threshold:g}% against the baseline{ENDC}")
+
+    return regressions
+
+
+# Open-loop (asyncio) load generation
+#
+# The thread pool above is closed-loop: a student only sends its next request
+# once the previous one returned, so a slow server also slows the load down
+# (coordinated omission). The open-loop mode below schedules every student's
+# actions at fixed times and measures each latency from the *intended* start
+# time, so time spent queued behind a slow server is counted, not hidden.
+
+
+async def _wait_until(loop, when):
+    """Sleep until the given loop time (returns immediately if already late)"""
+    delay = when - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def _timed_request(http, method, url, loop, intended_start, **kwargs):
+    """Issue a request no earlier than intended_start and time it from there"""
+    await _wait_until(loop, intended_start)
+    async with http.request(method, url, timeout=aiohttp.ClientTimeout(total=30), **kwargs) as response:
+        text = await response.text()
+    return response, text, loop.time() - intended_start
+
+
+# Exam-day scenario profiles
+#
+# A scenario turns into a list of (offset seconds, action) events per student.
+# Offsets are relative to the start of the run and all durations are "test
+# time", so a 2 hour exam can be compressed into a few minutes.
+SCENARIOS = {
+    "constant": "Students arrive at --rate per second and save --auto-saves times before submitting",
+    "steady": "Logins, saves and submits spread evenly over the run, with no storms",
+    "ramp": "Login storm that builds up over --login-window, then periodic saves and staggered submits",
+    "spike": "Login storm, periodic saves, then everyone submits when their own timer hits zero",
+    "reconnect": "Like spike, but the server 'restarts' at --restart-at and every student logs in again"
+}
+
+
+def _periodic_events(rng, start, end, save_interval, reload_rate):
+    """Auto-saves every save_interval (random phase) plus occasional page reloads"""
+    events = []
+    t = start + rng.uniform(0, save_interval)
+    while t < end:
+        events.append((t, "auto_save"))
+        if rng.random() < reload_rate:
+            events.append((t + rng.uniform(0, save_interval), "reload"))
+        t += save_interval
+    return [(t, action) for t, action in events if t < end]
+
+
+def build_schedule(scenario, student_index, options):
+    """Return the time-ordered (offset, action) events of one student"""
+    # Seed per student so schedules don't depend on how students are sharded
+    rng = random.Random(f"{options['seed']}-{student_index}")
+    duration = options["duration"]
+    window = options["login_window"]
+    save_interval = options["save_interval"]
+
+    if scenario == "constant":
+        arrival = student_index / options["rate"]
+        events = [(arrival + (k + 1) * save_interval, "auto_save")
+                  for k in range(options["auto_saves"])]
+        finish = arrival + (options["auto_saves"] + 1) * save_interval
+    else:
+        if scenario == "steady":
+            # Everyone works for half the run; starts are spread over the other half
+            arrival = rng.uniform(0, duration / 2)
+            finish = arrival + duration / 2
+        elif scenario == "ramp":
+            # Arrival density grows linearly over the login window
+            arrival = window * math.sqrt(rng.random())
+            finish = arrival + duration * rng.uniform(0.75, 1.0)
+        else:  # spike / reconnect: the exam timer decides when to submit
+            arrival = rng.uniform(0, window)
+            finish = arrival + duration
+
+        events = _periodic_events(rng, arrival, finish, save_interval,
+                                  options["reload_rate"])
+
+        if scenario == "reconnect":
+            restart_at = options["restart_at"]
+            if restart_at is None:
+                restart_at = window + duration / 2
+            reconnect = restart_at + rng.uniform(0, options["reconnect_window"])
+            if arrival < reconnect < finish:
+                # Nothing reaches the server while it is down
+                events = [event for event in events
+                          if not restart_at <= event[0] < reconnect]
+                events.append((reconnect, "reconnect"))
+
+    return [(arrival, "login")] + sorted(events) + [(finish, "submission")]
+
+
+def build_answers(student_index, question_ids, revision, num_questions=None, answer_size=0):
+    """
+    Build the answers and combinedCode payload the exam page would send.
+
+    num_questions pads (with made-up ids) or trims the real question ids and
+    answer_size pads every answer to that many characters, so payload sizes
+    can be matched to a real exam.
+    """
+    question_ids = list(question_ids)
+    if num_questions is not None:
+        next_id = max(question_ids, default=0) + 1
+        question_ids = (question_ids + list(range(next_id, next_id + num_questions)))[:num_questions]
+
+    answers = {}
+    combined_code = []
+    filler = "SELECT name, grade FROM students WHERE grade > 50 ORDER BY name;\n"
+    for q_id in question_ids:
+        header = f"-- Answer from student {student_index} to question {q_id} (revision {revision})\n"
+        answer = header
+        while len(answer) < answer_size:
+            answer += filler
+        answer = answer[:max(answer_size, len(header))]
+        answers[str(q_id)] = answer
+        combined_code.append(f"-- Question {q_id}:\n{answer}\n\n")
+
+    return answers, ''.join(combined_code)
+
+
+async def simulate_student_async(student_index, connector, base_url, start, events, run_stats,
+                                 num_questions=None, answer_size=0, verbose=False):
+    """Play one student's scheduled events against the server, open-loop"""
+    loop = asyncio.get_running_loop()
+    student_data = generate_student_data(student_index)
+    action = "login"  # Action in progress, to attribute exceptions
+
+    headers = {}
+    if USE_IP_ROTATION:
+        headers[FAKE_IP_HEADER] = generate_random_ip()
+
+    def new_http():
+        # Each student gets its own cookie jar but shares the connection pool
+        return aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                     cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                     headers=headers)
+
+    http = new_http()
+    question_ids = []
+    revision = 0
+
+    try:
+        for offset, event in events:
+            intended = start + offset
+
+            if event in ("login", "reconnect"):
+                action = event
+                if event == "reconnect":
+                    # A restarted server has forgotten every session cookie
+                    await http.close()
+                    http = new_http()
+
+                login_response, _, login_time = await _timed_request(
+                    http, 'POST', f"{base_url}/student_login", loop, intended, data=student_data)
+                # A queued login waits its turn, as the waiting page does
+                admitted = True
+                while "/waiting" in str(login_response.url):
+                    status_response, status_json, login_time = await _timed_request(
+                        http, 'GET', f"{base_url}/api/login_status", loop, intended)
+                    status = json.loads(status_json) if status_response.status == 200 else {}
+                    if status.get('admitted') or 'position' not in status:
+                        admitted = bool(status.get('admitted'))
+                        break
+                    await asyncio.sleep(status['retry_after'] * (1 + random.random() / 2))
+                run_stats.record_latency(event, login_time)
+
+                if (login_response.status != 200 or "login" in str(login_response.url)
+                        or not admitted):
+                    print(
+                        f"{RED}Login failed for student {student_data['student_number']}{ENDC}")
+                    run_stats.record_error(
+                        event, response_error_kind(login_response.status))
+                    return False
+
+                # The browser loads the exam page as soon as login returns
+                event, intended = "reload", loop.time()
+
+            if event == "reload":
+                action = "exam_load"
+                exam_response, _, exam_time = await _timed_request(
+                    http, 'GET', f"{base_url}/take_exam", loop, intended)
+                if exam_response.status == 200:
+                    exam_response, content_json, exam_time = await _timed_request(
+                        http, 'GET', f"{base_url}/api/exam/content", loop, intended)
+                if exam_response.status == 200:
+                    exam_response, _, exam_time = await _timed_request(
+                        http, 'GET', f"{base_url}/api/exam/state", loop, intended)
+                run_stats.record_latency("exam_load", exam_time)
+
+                if exam_response.status != 200:
+                    print(
+                        f"{RED}Failed to access exam for {student_data['student_number']}{ENDC}")
+                    run_stats.record_error(
+                        "exam_load", response_error_kind(exam_response.status))
+                    return False
+
+                if not question_ids:
+                    content = json.loads(content_json)
+                    question_ids = extract_questions_from_content(content)
+                    model_assigned = extract_model_from_content(content)
+                    run_stats.record_model(model_assigned)
+
+                    if verbose:
+                        print(
+                            f"{CYAN}Student {student_data['student_number']} assigned model: {model_assigned} with {len(question_ids)} questions{ENDC}")
+
+            elif event in ("auto_save", "submission"):
+                # Saves fire on the page timer, regardless of how long the
+                # previous request took
+                action = event
+                revision += 1
+                answers, combined_code = build_answers(
+                    student_index, question_ids, revision, num_questions, answer_size)
+                endpoint = "auto_save" if event == "auto_save" else "submit"
+                await _wait_until(loop, intended)
+                snapshot = write_load_snapshot()
+                response, _, elapsed = await _timed_request(
+                    http, 'POST', f"{base_url}/api/{endpoint}", loop, intended,
+                    json={"answers": answers, "combinedCode": combined_code})
+                record_student_write(run_stats, event, elapsed, snapshot)
+
+                if response.status != 200:
+                    label = "Auto-save" if event == "auto_save" else "Final submission"
+                    print(
+                        f"{RED}{label} failed for student {student_data['student_number']}{ENDC}")
+                    run_stats.record_error(
+                        event, response_error_kind(response.status))
+                    if event == "submission":
+                        return False
+
+        total_time = loop.time() - (start + events[0][0])
+        run_stats.record_latency("total", total_time)
+
+        if verbose:
+            print(
+                f"{GREEN}Student {student_data['student_number']} completed exam in {total_time:.2f} seconds{ENDC}")
+
+        run_stats.record_success()
+        return True
+
+    except Exception as e:
+        print(
+            f"{RED}Error for student {student_data['student_number']}: {str(e) or type(e).__name__}{ENDC}")
+        run_stats.record_error(action, classify_error(e))
+        return False
+    finally:
+        await http.close()
+
+
+async def simulate_teacher_async(worker_index, connector, base_url, teacher_options, run_stats,
+                                 stop, verbose=False):
+    """Simulate a teacher browsing heavy report pages until stop is set"""
+    rng = random.Random(f"teacher-{worker_index}")
+    names = list(teacher_options["mix"])
+    weights = [teacher_options["mix"][name] for name in names]
+    timeout = aiohttp.ClientTimeout(total=120)
+
+    async with aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                     cookie_jar=aiohttp.CookieJar(unsafe=True)) as http:
+        try:
+            async with http.post(f"{base_url}/teacher_login", timeout=timeout,
+                                 data={'username': teacher_options["username"],
+                                       'password': teacher_options["password"]}) as response:
+                await response.read()
+            if response.status != 200 or "teacher_login" in str(response.url):
+                print(f"{RED}Teacher {worker_index} could not log in{ENDC}")
+                run_stats.record_error(
+                    "teacher", response_error_kind(response.status))
+                return
+        except Exception as e:
+            run_stats.record_error("teacher", classify_error(e))
+            return
+
+        while True:
+            # Think time is exponential, so page loads arrive as a Poisson process
+            try:
+                await asyncio.wait_for(stop.wait(), rng.expovariate(1 / teacher_options["interval"]))
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            name = rng.choices(names, weights)[0]
+            action = f"teacher_{name}"
+            reporting_load.begin()
+            try:
+                start = time.time()
+                async with http.get(_teacher_url(base_url, name, teacher_options["exam_id"]),
+                                    timeout=timeout) as response:
+                    await response.read()
+                run_stats.record_latency(action, time.time() - start)
+                if response.status != 200:
+                    run_stats.record_error(
+                        action, response_error_kind(response.status))
+                elif verbose:
+                    print(f"{CYAN}Teacher {worker_index} loaded {name}{ENDC}")
+            except Exception as e:
+                run_stats.record_error(action, classify_error(e))
+            finally:
+                reporting_load.end()
+
+
+async def _run_open_loop_async(student_indices, base_url, start_at, scenario, options,
+                               max_connections, verbose, teacher_indices=(), teacher_options=None):
+    """Run this process's share of the virtual students on one event loop"""
+    loop = asyncio.get_running_loop()
+    # All processes share one wall-clock start; convert it to this loop's clock
+    loop_start = loop.time() + (start_at - time.time())
+    run_stats = StatsRecorder()
+
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    stop_teachers = asyncio.Event()
+    teachers = [
+        asyncio.create_task(simulate_teacher_async(
+            i, connector, base_url, teacher_options, run_stats, stop_teachers, verbose))
+        for i in teacher_indices
+    ]
+    try:
+        await asyncio.gather(*[
+            simulate_student_async(
+                i, connector, base_url, loop_start, build_schedule(
+                    scenario, i, options),
+                run_stats, options["questions"], options["answer_size"], verbose)
+            for i in student_indices
+        ])
+    finally:
+        stop_teachers.set()
+        await asyncio.gather(*teachers, return_exceptions=True)
+        await connector.close()
+
+    # Plain data, so it can be sent back from a worker process
+    return run_stats.to_dict()
+
+
+def _raise_open_file_limit():
+    """Allow as many sockets as the OS permits, for thousands of students"""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def _init_open_loop_worker(load):
+    """Pool initializer: share the teacher load counters with this process"""
+    global reporting_load
+    reporting_load = load
+
+
+def _open_loop_worker(worker_args):
+    """Entry point of one load generator process"""
+    _raise_open_file_limit()
+    return asyncio.run(_run_open_loop_async(*worker_args))
+
+
+def run_open_loop_test(base_url, num_students, scenario, options,
+                       processes=DEFAULT_PROCESSES, max_connections=0, verbose=False, report_dir=".",
+                       teacher_options=None):
+    """Run the stress test by playing a scenario's schedule for every student"""
+    global reporting_load
+    if aiohttp is None:
+        print(f"{RED}Open-loop mode requires aiohttp: pip install aiohttp{ENDC}")
+        return None
+
+    processes = max(1, min(processes, num_students))
+    print(f"{BLUE}Starting open-loop stress test with {num_students} students{ENDC}")
+    print(f"{BLUE}Scenario '{scenario}': {SCENARIOS[scenario]}{ENDC}")
+    print(f"{BLUE}Running on {processes} process(es){ENDC}")
+
+    teachers = teacher_options["teachers"] if teacher_options else 0
+    if teachers:
+        print(f"{BLUE}Running {teachers} teacher worker(s) on exam {teacher_options['exam_id']}{ENDC}")
+        reporting_load = ReportingLoad()
+
+    # Leave the worker processes time to start before the first arrival
+    start_at = time.time() + (0.5 if processes == 1 else 2.0)
+
+    # Interleave students across processes so arrival patterns hold globally
+    worker_args = [
+        (list(range(p, num_students, processes)), base_url, start_at, scenario,
+         options, max_connections, verbose,
+         list(range(p, teachers, processes)), teacher_options)
+        for p in range(processes)
+    ]
+
+    if processes == 1:
+        results = [_open_loop_worker(worker_args[0])]
+    else:
+        with multiprocessing.Pool(processes, _init_open_loop_worker, (reporting_load,)) as pool:
+            results = pool.map(_open_loop_worker, worker_args)
+
+    for run_stats in results:
+        stats.merge(StatsRecorder.from_dict(run_stats))
+
+    total_time = time.time() - start_at
+
+    return report_results(total_time, num_students, {
+        "mode": "open",
+        "scenario": scenario,
+        "num_students": num_students,
+        "processes": processes,
+        "base_url": base_url,
+        "teachers": _public_teacher_options(teacher_options),
+        **options
+    }, report_dir)
 
 
 def check_active_exam(base_url):
@@ -390,6 +1355,17 @@ def check_active_exam(base_url):
         return False
 
 
+def positive_float(text):
+    """argparse type for rates and intervals that must be above zero"""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a number")
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {text}")
+    return value
+
+
 def main():
     """Main function to run the stress test"""
     parser = argparse.ArgumentParser(
@@ -406,25 +1382,144 @@ def main():
                         help='Show detailed progress for each student')
     parser.add_argument('--skip-check', action='store_true',
                         help='Skip checking for active exam')
+    parser.add_argument('--open-loop', action='store_true',
+                        help='Use the asyncio open-loop generator (requires aiohttp)')
+    parser.add_argument('--scenario', choices=list(SCENARIOS),
+                        help='Exam-day scenario profile to play (implies --open-loop, '
+                        f'default: {DEFAULT_SCENARIO}): ' +
+                        '; '.join(f'{name}: {text}' for name, text in SCENARIOS.items()))
+    parser.add_argument('-r', '--rate', type=positive_float, default=DEFAULT_ARRIVAL_RATE,
+                        help=f'Open-loop: students arriving per second (default: {DEFAULT_ARRIVAL_RATE})')
+    parser.add_argument('--save-interval', type=positive_float, default=DEFAULT_SAVE_INTERVAL,
+                        help=f'Open-loop: seconds between auto-saves (default: {DEFAULT_SAVE_INTERVAL})')
+    parser.add_argument('--duration', type=float, default=DEFAULT_EXAM_DURATION,
+                        help=f'Scenario: seconds each student\'s exam timer runs (default: {DEFAULT_EXAM_DURATION:g})')
+    parser.add_argument('--login-window', type=float, default=DEFAULT_LOGIN_WINDOW,
+                        help=f'Scenario: seconds over which the login storm arrives (default: {DEFAULT_LOGIN_WINDOW:g})')
+    parser.add_argument('--restart-at', type=float, default=None,
+                        help='Scenario reconnect: second at which the server restarts (default: mid-exam)')
+    parser.add_argument('--reconnect-window', type=float, default=DEFAULT_RECONNECT_WINDOW,
+                        help=f'Scenario reconnect: seconds over which students log in again (default: {DEFAULT_RECONNECT_WINDOW:g})')
+    parser.add_argument('--reload-rate', type=float, default=DEFAULT_RELOAD_RATE,
+                        help=f'Scenario: chance per save interval of a page reload (default: {DEFAULT_RELOAD_RATE:g})')
+    parser.add_argument('--questions', type=int, default=None,
+                        help='Open-loop: answers sent per save (default: the exam\'s real questions)')
+    parser.add_argument('--answer-size', type=int, default=0,
+                        help='Open-loop: characters per answer (default: short one-line answers)')
+    parser.add_argument('--seed', default='0',
+                        help='Open-loop: seed for the randomised schedules (default: 0)')
+    parser.add_argument('-p', '--processes', type=int, default=DEFAULT_PROCESSES,
+                        help=f'Open-loop: load generator processes (default: {DEFAULT_PROCESSES})')
+    parser.add_argument('--max-connections', type=int, default=0,
+                        help='Open-loop: connection pool limit per process, 0 = unlimited (default: 0)')
+    parser.add_argument('-t', '--teachers', type=int, default=0,
+                        help='Teacher workers opening report pages during the test (default: 0)')
+    parser.add_argument('--teacher-interval', type=float, default=DEFAULT_TEACHER_INTERVAL,
+                        help=f'Mean seconds between one teacher\'s page loads (default: {DEFAULT_TEACHER_INTERVAL:g})')
+    parser.add_argument('--teacher-mix', default=DEFAULT_TEACHER_MIX,
+                        help=f'Relative weights of the teacher pages (default: {DEFAULT_TEACHER_MIX})')
+    parser.add_argument('--teacher-username', default=DEFAULT_TEACHER_USERNAME,
+                        help=f'Teacher account to log in with (default: {DEFAULT_TEACHER_USERNAME})')
+    parser.add_argument('--teacher-password', default=DEFAULT_TEACHER_PASSWORD,
+                        help='Password of the teacher account')
+    parser.add_argument('--exam-id', type=int, default=None,
+                        help='Exam the teachers report on (default: the active exam)')
+    parser.add_argument('--report-dir', default='.',
+                        help='Directory for the JSON/CSV reports (default: current directory)')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Saved JSON report to compare this run against')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare an existing JSON report against --baseline instead of running a test')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f'Percent a metric may worsen before it is flagged (default: {DEFAULT_REGRESSION_THRESHOLD:g})')
 
     args = parser.parse_args()
 
     print(f"{BLUE}Helwan Exam System - Stress Test Utility{ENDC}")
     print(f"{BLUE}------------------------------------{ENDC}\n")
 
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Offline comparison of two saved reports
+    if args.compare:
+        if baseline is None:
+            print(f"{RED}--compare requires --baseline{ENDC}")
+            return 1
+        with open(args.compare) as f:
+            current = json.load(f)
+        return 1 if compare_reports(baseline, current, args.threshold) else 0
+
     # Check if there is an active exam in the system
     if not args.skip_check and not check_active_exam(args.url):
         print(f"{YELLOW}Hint: To bypass this check, use the --skip-check flag{ENDC}")
         return 1
 
+    teacher_options = None
+    if args.teachers > 0:
+        try:
+            mix = parse_teacher_mix(args.teacher_mix)
+            exam_id = args.exam_id or find_active_exam_id(
+                args.url, args.teacher_username, args.teacher_password)
+        except (ValueError, requests.RequestException) as e:
+            print(f"{RED}Cannot set up teacher workers: {str(e)}{ENDC}")
+            return 1
+        if exam_id is None:
+            print(f"{RED}Could not find the active exam for the teacher workers; use --exam-id{ENDC}")
+            return 1
+        teacher_options = {
+            "teachers": args.teachers,
+            "interval": args.teacher_interval,
+            "mix": mix,
+            "exam_id": exam_id,
+            "username": args.teacher_username,
+            "password": args.teacher_password
+        }
+
     try:
-        success = run_stress_test(
-            args.url,
-            args.num_students,
-            args.concurrent,
-            args.auto_saves,
-            args.verbose
-        )
+        if args.open_loop or args.scenario:
+            options = {
+                "rate": args.rate,
+                "auto_saves": args.auto_saves,
+                "save_interval": args.save_interval,
+                "duration": args.duration,
+                "login_window": args.login_window,
+                "restart_at": args.restart_at,
+                "reconnect_window": args.reconnect_window,
+                "reload_rate": args.reload_rate,
+                "questions": args.questions,
+                "answer_size": args.answer_size,
+                "seed": args.seed
+            }
+            results = run_open_loop_test(
+                args.url,
+                args.num_students,
+                args.scenario or DEFAULT_SCENARIO,
+                options,
+                args.processes,
+                args.max_connections,
+                args.verbose,
+                args.report_dir,
+                teacher_options
+            )
+        else:
+            results = run_stress_test(
+                args.url,
+                args.num_students,
+                args.concurrent,
+                args.auto_saves,
+                args.verbose,
+                args.report_dir,
+                teacher_options
+            )
+        if results is None:
+            return 1
+
+        success = results["summary"]["successful_students"] == args.num_students
+        if baseline is not None and compare_reports(baseline, results, args.threshold):
+            success = False
         return 0 if success else 1
     except KeyboardInterrupt:
         print(f"\n{YELLOW}Stress test interrupted by user{ENDC}")
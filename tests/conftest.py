@@ -0,0 +1,50 @@
+"""
+Shared fixtures. app.py opens its database when imported, so the environment
+points it at a throwaway directory first; each test then gets a database of
+its own through the `database` fixture.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix='exam-tests-')
+os.environ['EXAM_DATABASE_PATH'] = os.path.join(_scratch, 'exam_system.db')
+os.environ['EXAM_TEMPLATE_CACHE'] = os.path.join(_scratch, 'jinja')
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def database(app_module, tmp_path, monkeypatch):
+    """A fresh exam database, with archives and backups next to it"""
+    monkeypatch.setattr(app_module, 'DATABASE_PATH', str(tmp_path / 'exam_system.db'))
+    monkeypatch.setattr(app_module, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    monkeypatch.setattr(app_module, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(app_module.records, '_shards', {})
+    app_module.init_db()
+    return app_module
+
+
+@pytest.fixture
+def exam(database):
+    """An inactive exam with one model, as (exam id, model id)"""
+    with database.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO exams (title, duration, created_by, is_active) VALUES ('Test', 60, 1, 0)")
+        exam_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO exam_models (exam_id, model_name) VALUES (?, 'Model A')", (exam_id,))
+        model_id = cursor.lastrowid
+        conn.commit()
+    return exam_id, model_id
@@ -0,0 +1,68 @@
+"""Several active exams: finding a student's exam, and exams that clash"""
+
+import pytest
+
+
+def exam(exam_id, title, access_code=None, ip_ranges=None):
+    return {'id': exam_id, 'title': title, 'access_code': access_code,
+            'ip_ranges': ip_ranges}
+
+
+EXAMS = [exam(1, 'Lab A', ip_ranges='10.1.0.0/16'),
+         exam(2, 'Lab A front row', ip_ranges='10.1.2.0/24, 2001:db8::/64'),
+         exam(3, 'Makeup', access_code='MAKEUP'),
+         exam(4, 'Hall')]
+MODELS = [{'id': 11, 'exam_id': 1}, {'id': 12, 'exam_id': 1}, {'id': 21, 'exam_id': 2},
+          {'id': 99, 'exam_id': 5}]
+
+
+@pytest.fixture
+def find(app_module, monkeypatch):
+    """find_student_exam over an index of the given exams, as exam ids"""
+    def run(access_code, ip_address, exams=EXAMS):
+        monkeypatch.setattr(app_module, '_active_exams',
+                            app_module.build_exam_index(exams, MODELS))
+        return app_module.find_student_exam(access_code, ip_address)['exam']['id']
+    return run
+
+
+def test_index(app_module):
+    index = app_module.build_exam_index(EXAMS, MODELS)
+    assert index['exams'][1]['model_ids'] == [11, 12]
+    assert index['exams'][4]['model_ids'] == []
+    assert index['codes'] == {'makeup': 3}
+    assert index['default'] == 4
+    # Narrowest networks first
+    assert index['prefixes'] == [(6, 64), (4, 24), (4, 16)]
+
+
+def test_narrowest_network_wins(find):
+    assert find('', '10.1.2.30') == 2
+    assert find('', '10.1.3.30') == 1
+    assert find('', '2001:db8::5') == 2
+    # The client address comes first in X-Forwarded-For
+    assert find('', '10.1.2.30, 192.168.0.1') == 2
+
+
+def test_codes_and_the_open_exam(find):
+    assert find(' makeup ', '10.1.2.30') == 3
+    assert find('', '192.168.0.1') == 4
+    assert find('', 'unknown') == 4
+    with pytest.raises(ValueError, match="Unknown exam code"):
+        find('nope', '10.1.2.30')
+    with pytest.raises(ValueError, match="enter the exam code"):
+        find('', '192.168.0.1', exams=EXAMS[:3])
+    with pytest.raises(ValueError, match="No active exam"):
+        find('', '10.1.2.30', exams=[])
+
+
+def test_access_conflict(app_module):
+    conflict = app_module.access_conflict
+    assert conflict(exam(5, 'New', access_code='makeup'), EXAMS) == \
+        "the code makeup is used by Makeup"
+    assert conflict(exam(5, 'New', ip_ranges='10.1.2.9/24'), EXAMS) == \
+        "its IP ranges are used by Lab A front row"
+    assert conflict(exam(5, 'New'), EXAMS) == "Hall is already open to every student"
+    # Overlapping but different networks: the narrower one wins at login
+    assert conflict(exam(5, 'New', ip_ranges='10.1.3.0/24'), EXAMS) is None
+    assert conflict(exam(5, 'New', access_code='OTHER'), EXAMS) is None
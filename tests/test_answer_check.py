@@ -0,0 +1,54 @@
+"""Background pre-check of saved answers, with its limits"""
+
+import pytest
+
+import sql_grader
+
+DATASET = """
+CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT, grade INTEGER);
+INSERT INTO students VALUES (1, 'Amr', 90), (2, 'Mona', 75), (3, 'Omar', 60);
+"""
+ENDLESS = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+@pytest.fixture(scope='module')
+def check_pool():
+    pool = sql_grader.check_pool(1, memory_limit=8 * 1024 * 1024)
+    yield pool
+    pool.terminate()
+
+
+def test_check_answers(check_pool):
+    outcomes = sql_grader.check_answers(check_pool, [
+        (DATASET, "SELECT name FROM students"),
+        (DATASET, "SELEC name FROM students"),
+        (DATASET, "SELECT nope FROM students"),
+        (DATASET, "CREATE TABLE top (name TEXT); INSERT INTO top SELECT name FROM students; "
+                  "SELECT name FROM top"),
+        (DATASET, "ATTACH DATABASE 'other.db' AS other"),
+        (None, "SELECT whatever FROM anything"),
+        (DATASET, "  "),
+    ], {})
+    assert [status for status, _ in outcomes] == [
+        sql_grader.CHECK_OK, sql_grader.CHECK_SYNTAX_ERROR, sql_grader.CHECK_INVALID,
+        sql_grader.CHECK_OK, sql_grader.CHECK_INVALID, sql_grader.CHECK_OK,
+        sql_grader.CHECK_EMPTY]
+
+
+def test_check_does_not_run_create_table_as(check_pool):
+    # Compiled only: running it would never finish
+    outcomes = sql_grader.check_answers(check_pool, [
+        (DATASET, f"CREATE TABLE n AS {ENDLESS}; SELECT * FROM n"),
+    ], {}, timeout=10)
+    assert outcomes == [(sql_grader.CHECK_OK, None)]
+
+
+def test_check_timeout_is_reported():
+    pool = sql_grader.check_pool(1)
+    cache = {}
+    try:
+        with pytest.raises(sql_grader.CheckTimeout):
+            sql_grader.check_answers(pool, [(DATASET, "SELECT 1")], cache, timeout=0.000001)
+    finally:
+        pool.terminate()
+    assert [status for status, _ in cache.values()] == [sql_grader.CHECK_INVALID]
@@ -0,0 +1,42 @@
+"""Storing large answers compressed, and reading both stored forms back"""
+
+
+def test_round_trip(app_module):
+    long_answer = "SELECT name, grade FROM students WHERE grade > 70; -- ÿ\n" * 40
+    stored = app_module.compress_answer(long_answer)
+    assert isinstance(stored, bytes) and stored.startswith(app_module.ANSWER_COMPRESSION_MARKER)
+    assert len(stored) < len(long_answer)
+    assert app_module.decompress_answer(stored) == long_answer
+
+    # Short answers stay text
+    for text in ['SELECT 1', 'x' * (app_module.ANSWER_COMPRESSION_MIN_SIZE - 1), '', None]:
+        assert app_module.compress_answer(text) == text
+        assert app_module.decompress_answer(text) == text
+
+
+def test_plain_rows_are_read_and_compressed_later(database, exam, monkeypatch):
+    exam_id, model_id = exam
+    long_answer = "SELECT name FROM students WHERE grade > 70;\n" * 40
+
+    # Saved before answers were compressed
+    with monkeypatch.context() as patch:
+        patch.setattr(database, 'ANSWER_COMPRESSION_MIN_SIZE', 10 ** 9)
+        database.records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                         long_answer, {'1': long_answer, '2': 'SELECT 1'})
+
+    def stored_types():
+        with database.get_db_connection() as conn:
+            return sorted(row[0] for row in conn.execute(
+                "SELECT typeof(answer_content) FROM question_answers "
+                "UNION ALL SELECT typeof(code_content) FROM submissions"))
+
+    assert stored_types() == ['text', 'text', 'text']
+    assert database.records.latest_answers('1001', exam_id, model_id) == (
+        1, {1: long_answer, 2: 'SELECT 1'})
+
+    assert database.compress_stored_answers(batch_size=1) > 0
+    assert stored_types() == ['blob', 'blob', 'text']
+    assert database.records.latest_answers('1001', exam_id, model_id) == (
+        1, {1: long_answer, 2: 'SELECT 1'})
+    # Nothing is left to compress
+    assert database.compress_stored_answers() == 0
@@ -0,0 +1,83 @@
+"""Archiving finished exams"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def hand_in(database, exam_id, model_id, student_number='1001'):
+    now = datetime.now()
+    database.records.start_session('A', student_number, exam_id, model_id,
+                                   now, now + timedelta(hours=1), '10.0.0.1')
+    database.records.save_submission('A', student_number, exam_id, model_id,
+                                     '10.0.0.1', 'code', {'1': 'SELECT 1'}, final=True)
+
+
+def exam_row(database, exam_id):
+    with database.get_db_connection() as conn:
+        return conn.execute("SELECT * FROM exams WHERE id = ?", (exam_id,)).fetchone()
+
+
+def test_archive_refuses_running_exams(database, exam):
+    exam_id, model_id = exam
+    now = datetime.now()
+    database.records.start_session('A', '1001', exam_id, model_id,
+                                   now, now + timedelta(hours=1), '10.0.0.1')
+    with pytest.raises(ValueError, match="still taking"):
+        database.archive_exam(exam_id)
+
+    with database.get_db_connection() as conn:
+        conn.execute("UPDATE exams SET is_active = 1 WHERE id = ?", (exam_id,))
+        conn.commit()
+    with pytest.raises(ValueError, match="still active"):
+        database.archive_exam(exam_id)
+
+
+def test_archive_moves_submissions(database, exam):
+    exam_id, model_id = exam
+    hand_in(database, exam_id, model_id)
+
+    # Finished as soon as everybody handed in, with time left on the clock
+    assert database.archive_exam(exam_id) == 1
+
+    with database.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0] == 0
+    exam = exam_row(database, exam_id)
+    assert os.path.exists(exam['archive_path'])
+    students, submissions, _ = database.records.exam_submissions(exam)
+    assert [student['student_number'] for student in students] == ['1001']
+    assert submissions['1001'][0]['is_final']
+
+
+def test_failed_archive_keeps_the_exam_live(database, exam):
+    exam_id, model_id = exam
+    hand_in(database, exam_id, model_id)
+    # An archive file left behind with a table that takes no submissions
+    os.makedirs(database.ARCHIVE_DIR)
+    stale = sqlite3.connect(os.path.join(database.ARCHIVE_DIR, f"exam_{exam_id}.db"))
+    stale.execute("CREATE TABLE submissions (id INTEGER PRIMARY KEY, CHECK (id < 0))")
+    stale.close()
+
+    # The error that stopped the archive comes out, not one from cleaning up
+    with pytest.raises(sqlite3.IntegrityError, match="CHECK"):
+        database.archive_exam(exam_id)
+
+    assert exam_row(database, exam_id)['archive_path'] is None
+    with database.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0] == 1
+        assert conn.execute("PRAGMA database_list").fetchall()[-1]['name'] != 'archive'
+
+
+def test_archive_keeps_a_shard_in_place(database, exam, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SHARD_DIR', str(tmp_path / 'shards'))
+    exam_id, model_id = exam
+    shard = database.assign_exam_shard(exam_id)
+    hand_in(database, exam_id, model_id)
+
+    assert database.archive_exam(exam_id) == 1
+    assert exam_row(database, exam_id)['archive_path'] == shard
+    students, _, _ = database.records.exam_submissions(exam_row(database, exam_id))
+    assert [student['student_number'] for student in students] == ['1001']
+
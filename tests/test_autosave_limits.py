@@ -0,0 +1,52 @@
+"""Token buckets limiting auto-saves, and the interval suggested to pages"""
+
+import pytest
+
+
+@pytest.fixture
+def buckets(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, '_session_save_buckets', {})
+    monkeypatch.setattr(app_module, '_global_save_bucket',
+                        [app_module.AUTOSAVE_GLOBAL_BURST, app_module.time.monotonic()])
+    return app_module
+
+
+def test_token_refill(app_module):
+    bucket = [0.5, 10.0]
+    assert app_module._take_token(bucket, rate=1, burst=5, now=10.0) == pytest.approx(0.5)
+    assert app_module._take_token(bucket, rate=1, burst=5, now=11.0) == 0
+    assert bucket[0] == pytest.approx(0.5)
+    # Never beyond the burst
+    assert app_module._take_token(bucket, rate=1, burst=5, now=100.0) == 0
+    assert bucket[0] == pytest.approx(4)
+
+
+def test_session_bucket_limits_one_page(buckets):
+    for _ in range(buckets.AUTOSAVE_SESSION_BURST):
+        assert buckets.take_autosave_token('session-1') == (None, 0)
+    status, wait = buckets.take_autosave_token('session-1')
+    assert status == 429 and wait > 0
+    # Other sessions are not affected
+    assert buckets.take_autosave_token('session-2') == (None, 0)
+
+
+def test_global_bucket_refunds_refused_saves(buckets):
+    buckets._global_save_bucket[0] = 0
+    status, wait = buckets.take_autosave_token('session-1')
+    assert status == 503 and wait > 0
+    # The session's own token was given back
+    assert buckets._session_save_buckets['session-1'][0] == pytest.approx(
+        buckets.AUTOSAVE_SESSION_BURST, abs=0.01)
+
+
+def test_pages_save_less_often_under_load(buckets, monkeypatch):
+    monkeypatch.setattr(buckets, 'AUTOSAVE_LIMIT_ENABLED', True)
+    assert buckets.autosave_interval() == buckets.AUTOSAVE_INTERVAL
+    buckets._global_save_bucket[:] = [0, buckets.time.monotonic()]
+    assert buckets.autosave_interval() == buckets.AUTOSAVE_INTERVAL * 2
+
+    with buckets.app.test_request_context('/'):
+        response = buckets.autosave_refused('Too many saves', 429, 0.2)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert response.json['next_save'] == buckets.AUTOSAVE_INTERVAL * 2
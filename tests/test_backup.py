@@ -0,0 +1,56 @@
+"""Online backups, their rotation, and restoring one"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def hand_in(database, exam_id, model_id, student_number='1001'):
+    now = datetime.now()
+    database.records.start_session('A', student_number, exam_id, model_id,
+                                   now, now + timedelta(hours=1), '10.0.0.1')
+    database.records.save_submission('A', student_number, exam_id, model_id,
+                                     '10.0.0.1', 'code', {'1': 'SELECT 1'}, final=True)
+
+
+def test_backup_and_restore(database, exam):
+    exam_id, model_id = exam
+    hand_in(database, exam_id, model_id)
+    backup = database.backup_database()
+
+    hand_in(database, exam_id, model_id, student_number='1002')
+    database.restore_database(backup)
+
+    with database.get_db_connection() as conn:
+        students = [row[0] for row in conn.execute(
+            "SELECT DISTINCT student_number FROM submissions")]
+    assert students == ['1001']
+    # The replaced contents were saved first
+    saved = [name for name in os.listdir(database.BACKUP_DIR) if name.startswith('pre_restore_')]
+    assert len(saved) == 1
+
+
+def test_restore_rejects_damaged_backups(database, tmp_path):
+    damaged = tmp_path / 'damaged.db'
+    damaged.write_bytes(b'not a database' * 100)
+    with pytest.raises(ValueError):
+        database.restore_database(str(damaged))
+    with pytest.raises(ValueError, match="does not exist"):
+        database.restore_database(str(tmp_path / 'missing.db'))
+
+
+def test_old_backups_are_rotated(database, monkeypatch):
+    monkeypatch.setattr(database, 'BACKUP_KEEP', 2)
+    os.makedirs(database.BACKUP_DIR)
+    old = ['backup_20260101_000000.db', 'backup_20260101_000000.exam_3.db',
+           'backup_20260102_000000.db', 'pre_restore_20260101_000000.db']
+    for name in old:
+        with open(os.path.join(database.BACKUP_DIR, name), 'wb'):
+            pass
+
+    latest = database.backup_database()
+    # The oldest scheduled backup goes, with its shard copies; others stay
+    assert sorted(os.listdir(database.BACKUP_DIR)) == sorted(
+        ['backup_20260102_000000.db', 'pre_restore_20260101_000000.db',
+         os.path.basename(latest)])
@@ -0,0 +1,61 @@
+"""Compressing HTML and JSON responses, and the cache of compressed bodies"""
+
+import gzip
+import json
+from collections import OrderedDict
+
+import pytest
+
+
+@pytest.fixture
+def compress(app_module, monkeypatch):
+    """Run a response through the compression hook, for a client accepting `accept`"""
+    monkeypatch.setattr(app_module, 'brotli', None)
+    monkeypatch.setattr(app_module, '_compression_cache', OrderedDict())
+
+    def run(response, accept='gzip, deflate'):
+        headers = {'Accept-Encoding': accept} if accept else {}
+        with app_module.app.test_request_context('/', headers=headers):
+            return app_module._compress_response(response)
+    return run
+
+
+def json_response(app_module, size):
+    return app_module.app.response_class(
+        json.dumps({'answer': 'x' * size}), mimetype='application/json')
+
+
+def test_large_responses_are_compressed(app_module, compress):
+    response = compress(json_response(app_module, 5000))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert json.loads(gzip.decompress(response.get_data())) == {'answer': 'x' * 5000}
+
+
+def test_small_or_unaccepted_responses_are_sent_as_they_are(app_module, compress):
+    small = compress(json_response(app_module, 10))
+    assert 'Content-Encoding' not in small.headers
+
+    plain = compress(json_response(app_module, 5000), accept=None)
+    assert 'Content-Encoding' not in plain.headers
+    # Caches must still keep the two versions apart
+    assert 'Accept-Encoding' in plain.vary
+
+    image = compress(app_module.app.response_class(b'x' * 5000, mimetype='image/png'))
+    assert 'Content-Encoding' not in image.headers
+
+
+def test_identical_bodies_are_compressed_once(app_module, compress, monkeypatch):
+    first = compress(json_response(app_module, 5000)).get_data()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("compressed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module.gzip, 'compress', fail)
+        assert compress(json_response(app_module, 5000)).get_data() == first
+
+    # The least recently used bodies make room for new ones
+    monkeypatch.setattr(app_module, 'COMPRESSION_CACHE_SIZE', 1)
+    compress(json_response(app_module, 6000))
+    assert len(app_module._compression_cache) == 1
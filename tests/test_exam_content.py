@@ -0,0 +1,88 @@
+"""Exam page content: built once per model and kept until invalidated"""
+
+import pytest
+
+
+@pytest.fixture
+def content(database, exam, monkeypatch):
+    """model_content for the exam's model, from an empty cache"""
+    monkeypatch.setattr(database, '_exam_contents', {})
+    exam_id, model_id = exam
+    add_question(database, exam_id, model_id, 'First question')
+
+    def build():
+        with database.app.app_context():
+            return database.model_content(exam_id, model_id)
+    return build
+
+
+def add_question(database, exam_id, model_id, text):
+    with database.get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO questions (exam_id, model_id, question_text) VALUES (?, ?, ?)",
+            (exam_id, model_id, text))
+        conn.commit()
+
+
+def test_content_is_kept_until_invalidated(database, exam, content):
+    exam_id, model_id = exam
+    version, payload = content()
+    assert 'First question' in payload['html']
+    assert payload['model'] == {'id': model_id, 'name': 'Model A'}
+
+    add_question(database, exam_id, model_id, 'Second question')
+    assert content() == (version, payload)
+
+    # Another exam's changes leave this one cached
+    database.invalidate_model_content(exam_id + 1)
+    assert content()[0] == version
+
+    database.invalidate_model_content(exam_id)
+    new_version, new_payload = content()
+    assert new_version != version
+    assert len(new_payload['questions']) == 2
+
+
+def test_content_built_during_an_invalidation_is_not_kept(database, exam, content, monkeypatch):
+    exam_id, model_id = exam
+    render_template = database.render_template
+
+    def render_while_edited(*args, **kwargs):
+        # A teacher saves a question while the page is being built
+        add_question(database, exam_id, model_id, 'Second question')
+        database.invalidate_model_content(exam_id)
+        return render_template(*args, **kwargs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(database, 'render_template', render_while_edited)
+        _, stale = content()
+    assert len(stale['questions']) == 1
+    assert len(content()[1]['questions']) == 2
+
+
+def test_missing_exam(database, content):
+    with database.app.app_context():
+        assert database.model_content(12345, 1) == (None, None)
+
+
+def test_content_api_revalidates(database, exam, content):
+    exam_id, model_id = exam
+    client = database.app.test_client()
+    assert client.get('/api/exam/content').status_code == 401
+
+    with client.session_transaction() as student:
+        student.update(student_name='A', student_number='1001',
+                       exam_id=exam_id, model_id=model_id)
+    response = client.get('/api/exam/content')
+    assert response.status_code == 200
+    assert response.json['exam']['id'] == exam_id
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    # Unchanged content is not sent again
+    etag = response.headers['ETag']
+    assert client.get('/api/exam/content',
+                      headers={'If-None-Match': etag}).status_code == 304
+    add_question(database, exam_id, model_id, 'Second question')
+    database.invalidate_model_content(exam_id)
+    assert client.get('/api/exam/content',
+                      headers={'If-None-Match': etag}).status_code == 200
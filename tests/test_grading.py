@@ -0,0 +1,82 @@
+"""Auto-grading answers against their question's reference, with limits"""
+
+import sql_grader
+
+DATASET = """
+CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT, grade INTEGER);
+INSERT INTO students VALUES (1, 'Amr', 90), (2, 'Mona', 75), (3, 'Omar', 60);
+"""
+QUESTIONS = {
+    1: {'dataset_sql': DATASET, 'points': 2, 'order_sensitive': False,
+        'expected_query': "SELECT name FROM students WHERE grade > 70"},
+}
+ENDLESS = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n"
+HUGE = "SELECT length(randomblob(50000000))"
+
+
+def grade(answers, **options):
+    options.setdefault('processes', 1)
+    return {result['submission_id']: result for result in sql_grader.grade_answers(
+        QUESTIONS, [(number, 1, answer) for number, answer in enumerate(answers)], **options)}
+
+
+def test_grades_answers():
+    results = grade(["select NAME from students where grade > 70;",
+                     "SELECT name FROM students",
+                     "SELECT nope FROM students",
+                     ""])
+    assert [results[n]['status'] for n in range(4)] == [
+        sql_grader.STATUS_CORRECT, sql_grader.STATUS_WRONG,
+        sql_grader.STATUS_ERROR, sql_grader.STATUS_NO_ANSWER]
+    assert results[0]['suggested_mark'] == 2
+
+
+def test_limits_are_enforced():
+    results = grade([ENDLESS, HUGE, "SELECT name FROM students WHERE grade > 70"],
+                    time_limit=0.5, memory_limit=8 * 1024 * 1024)
+    assert results[0]['status'] == sql_grader.STATUS_TIMEOUT
+    assert results[1]['status'] == sql_grader.STATUS_MEMORY
+    assert results[2]['status'] == sql_grader.STATUS_CORRECT
+
+
+def test_large_reference_does_not_eat_the_answer_limit():
+    questions = {1: dict(QUESTIONS[1], dataset_sql=DATASET + (
+        "INSERT INTO students (name, grade) "
+        "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 200000) "
+        "SELECT 'student ' || x, 0 FROM n;"))}
+    results = sql_grader.grade_answers(
+        questions, [(1, 1, "SELECT name FROM students WHERE grade > 70")],
+        processes=1, memory_limit=4 * 1024 * 1024)
+    assert results[0]['status'] == sql_grader.STATUS_CORRECT
+
+
+def test_equivalent_answers_share_a_cache_entry():
+    assert sql_grader.answer_hash("select NAME -- names\nfrom students;") == \
+        sql_grader.answer_hash("SELECT name  FROM students")
+    # Quoted text is kept as written
+    assert sql_grader.answer_hash("SELECT 'Amr'") != sql_grader.answer_hash("SELECT 'amr'")
+
+    cache = {}
+    first = grade(["SELECT name FROM students WHERE grade > 70",
+                   "select name from students where grade > 70;"], cache=cache)
+    # Executed once, for the first of the two spellings
+    assert [first[n]['cached'] for n in range(2)] == [False, True]
+    again = grade(["SELECT name FROM students WHERE grade > 70"], cache=cache)
+    assert again[0]['cached'] and again[0]['status'] == sql_grader.STATUS_CORRECT
+
+    # A changed reference is graded afresh
+    questions = {1: dict(QUESTIONS[1], expected_query="SELECT name FROM students")}
+    changed = sql_grader.grade_answers(
+        questions, [(0, 1, "SELECT name FROM students WHERE grade > 70")],
+        processes=1, cache=cache)
+    assert changed[0]['status'] == sql_grader.STATUS_WRONG and not changed[0]['cached']
+
+
+def test_limit_failures_are_not_cached():
+    cache = {}
+    results = grade([ENDLESS, HUGE, "SELECT name FROM students WHERE grade > 70"],
+                    time_limit=0.5, memory_limit=8 * 1024 * 1024, cache=cache)
+    assert [results[n]['status'] for n in range(3)] == [
+        sql_grader.STATUS_TIMEOUT, sql_grader.STATUS_MEMORY, sql_grader.STATUS_CORRECT]
+    # Only the correct answer is remembered; the others run again next time
+    assert [outcome[0] for outcome in cache.values()] == [sql_grader.STATUS_CORRECT]
@@ -0,0 +1,59 @@
+"""Read-only connections for teacher reporting"""
+
+import sqlite3
+
+import pytest
+
+
+def test_read_connections_refuse_writes(database):
+    conn = database.get_read_connection()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError, match="readonly|read-only"):
+            conn.execute("UPDATE users SET role = 'student'")
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("CREATE TABLE notes (text TEXT)")
+    finally:
+        conn.close()
+
+
+def test_reads_do_not_wait_for_writers(database, exam):
+    exam_id, model_id = exam
+    long_answer = "SELECT name FROM students;\n" * 100
+    database.records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                     long_answer, {'1': long_answer})
+
+    writer = database.get_db_connection()
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("DELETE FROM submissions")
+    try:
+        reader = database.get_read_connection(timeout=0.1)
+        try:
+            # The committed rows, with stored answers decompressed
+            rows = reader.execute("SELECT code_content FROM submissions").fetchall()
+        finally:
+            reader.close()
+        assert [row['code_content'] for row in rows] == [long_answer]
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_snapshot_reads(database, tmp_path, monkeypatch):
+    snapshot = tmp_path / 'snapshot.db'
+    conn = sqlite3.connect(snapshot)
+    conn.execute("CREATE TABLE users (id INTEGER)")
+    conn.close()
+    monkeypatch.setattr(database, '_reporting_snapshot', str(snapshot))
+
+    conn = database.get_read_connection(snapshot=True)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    finally:
+        conn.close()
+    # Only reports that allow it read the snapshot
+    conn = database.get_read_connection()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    finally:
+        conn.close()
@@ -0,0 +1,40 @@
+"""Thinning out old autosave versions"""
+
+# Version -> time saved: three 10-minute buckets
+SAVED_AT = {1: '10:00:01', 2: '10:00:02', 3: '10:00:03', 4: '10:00:04',
+            5: '10:15:00', 6: '10:15:30',
+            7: '10:30:00', 8: '10:30:01', 9: '10:30:02', 10: '10:30:03',
+            11: '10:30:04', 12: '10:30:05'}
+
+
+def test_old_versions_expire(database, exam, monkeypatch):
+    exam_id, model_id = exam
+    monkeypatch.setattr(database, 'RETENTION_KEEP_LATEST', 5)
+    monkeypatch.setattr(database, 'RETENTION_BUCKET_MINUTES', 10)
+    monkeypatch.setattr(database, 'RETENTION_PAUSE', 0)
+    for _ in SAVED_AT:
+        database.records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                         'code', {'1': 'SELECT 1'})
+    with database.get_db_connection() as conn:
+        ids = {}
+        for version, saved_at in SAVED_AT.items():
+            conn.execute("UPDATE submissions SET submission_time = ? WHERE version = ?",
+                         (f"2026-01-01 {saved_at}", version))
+            ids[version] = conn.execute(
+                "SELECT id FROM submissions WHERE version = ?", (version,)).fetchone()['id']
+        # Final and graded versions are always kept
+        conn.execute("UPDATE submissions SET is_final = 1 WHERE version = 1")
+        conn.execute("INSERT INTO grades (submission_id, mark) VALUES (?, '5')", (ids[2],))
+        conn.commit()
+
+    # The latest five, and the latest of each bucket, stay too
+    assert database.expired_submission_ids() == [ids[3], ids[5], ids[7]]
+
+    assert database.compact_submissions() == 3
+    with database.get_db_connection() as conn:
+        versions = [row[0] for row in conn.execute(
+            "SELECT version FROM submissions ORDER BY version")]
+        answers = conn.execute("SELECT COUNT(*) FROM question_answers").fetchone()[0]
+    assert versions == [1, 2, 4, 6, 8, 9, 10, 11, 12]
+    assert answers == 9
+    assert database.expired_submission_ids() == []
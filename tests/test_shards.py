@@ -0,0 +1,75 @@
+"""Per-exam shard databases: routing and lookups of the shard path"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import storage
+
+
+def count_submissions(path, exam_id):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM submissions WHERE exam_id = ?", (exam_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_exam_data_goes_to_its_shard(database, exam, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SHARD_DIR', str(tmp_path / 'shards'))
+    exam_id, model_id = exam
+    records = database.records
+
+    shard = database.assign_exam_shard(exam_id)
+    assert shard == str(tmp_path / 'shards' / f"exam_{exam_id}.db")
+    assert records.shard_path(exam_id) == shard
+    assert not records._holds_ip_policies(exam_id)
+
+    now = datetime.now()
+    records.start_session('A', '1001', exam_id, model_id, now,
+                          now + timedelta(minutes=60), '10.0.0.1')
+    records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                            'code', {'1': 'SELECT 1'})
+    assert count_submissions(shard, exam_id) == 1
+    assert count_submissions(database.DATABASE_PATH, exam_id) == 0
+    assert records.latest_answers('1001', exam_id, model_id) == (1, {1: 'SELECT 1'})
+    assert records.live_scopes() == [None, exam_id]
+
+
+def test_exam_with_data_keeps_it_in_the_main_database(database, exam, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SHARD_DIR', str(tmp_path / 'shards'))
+    exam_id, model_id = exam
+    database.records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                     'code', {'1': 'SELECT 1'})
+
+    assert database.assign_exam_shard(exam_id) is None
+    assert database.records.shard_path(exam_id) is None
+    assert count_submissions(database.DATABASE_PATH, exam_id) == 1
+
+
+def test_no_shard_is_remembered_for_a_while(database, exam, monkeypatch):
+    exam_id, _ = exam
+    records = database.records
+    queries = []
+    read_connect = records._read_connect
+
+    def counting_read_connect(*args, **kwargs):
+        queries.append(args)
+        return read_connect(*args, **kwargs)
+
+    monkeypatch.setattr(records, '_read_connect', counting_read_connect)
+    assert records.shard_path(exam_id) is None
+    assert records.shard_path(exam_id) is None
+    assert len(queries) == 1
+
+    # As another process would, without telling this one
+    with database.get_db_connection() as conn:
+        conn.execute("UPDATE exams SET shard_path = 'exam.db' WHERE id = ?", (exam_id,))
+        conn.commit()
+    assert records.shard_path(exam_id) is None
+
+    later = storage.monotonic() + storage.NO_SHARD_TTL + 1
+    monkeypatch.setattr(storage, 'monotonic', lambda: later)
+    assert records.shard_path(exam_id) == 'exam.db'
+    assert records.shard_path(exam_id) == 'exam.db'
+    assert len(queries) == 2
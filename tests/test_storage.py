@@ -0,0 +1,86 @@
+"""SQLite storage backend: sessions, submission versions and answers"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage
+
+
+def start_session(records, student_number, exam_id, model_id, minutes=60):
+    now = datetime.now()
+    return records.start_session(f"Student {student_number}", student_number, exam_id,
+                                 model_id, now, now + timedelta(minutes=minutes), '10.0.0.1')
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        storage.Storage()
+
+
+def test_versions_and_latest_answers(database, exam):
+    exam_id, model_id = exam
+    records = database.records
+    assert records.latest_answers('1001', exam_id, model_id) == (0, {})
+
+    long_answer = 'SELECT name FROM students WHERE id = 1;\n' * 100
+    assert records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                   'code', {'1': 'SELECT 1'}) == 1
+    assert records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                                   'code', {'1': 'SELECT 2', '2': long_answer}) == 2
+
+    # Long answers are stored compressed and read back as text
+    assert records.latest_answers('1001', exam_id, model_id) == (
+        2, {1: 'SELECT 2', 2: long_answer})
+
+
+def test_concurrent_saves_get_distinct_versions(database, exam):
+    exam_id, model_id = exam
+
+    def save():
+        for _ in range(10):
+            database.records.save_submission('A', '1001', exam_id, model_id,
+                                             '10.0.0.1', 'code', {'1': 'SELECT 1'})
+
+    threads = [threading.Thread(target=save) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with database.get_db_connection() as conn:
+        versions = [row['version'] for row in conn.execute(
+            "SELECT version FROM submissions ORDER BY version")]
+    assert versions == list(range(1, 41))
+
+
+def test_sessions_running(database, exam):
+    exam_id, model_id = exam
+    records = database.records
+    assert not records.sessions_running(exam_id)
+
+    session_id = start_session(records, '1001', exam_id, model_id)
+    assert records.sessions_running(exam_id)
+    assert records.sessions_running()
+    assert records.session_end_time(session_id, exam_id) > datetime.now()
+
+    # A student who handed in a final submission is done, time left or not
+    records.save_submission('A', '1001', exam_id, model_id, '10.0.0.1',
+                            'code', {'1': 'SELECT 1'}, final=True)
+    assert not records.sessions_running(exam_id)
+
+    start_session(records, '1002', exam_id, model_id, minutes=-1)
+    assert not records.sessions_running(exam_id)
+
+
+
+def test_postgres_placeholders():
+    postgres = storage.PostgresStorage.__new__(storage.PostgresStorage)
+    assert postgres._sql("SELECT * FROM grades WHERE submission_id = ? AND mark > ?") == (
+        "SELECT * FROM grades WHERE submission_id = %s AND mark > %s")
+    # Question marks in text and comments are kept, and every % is escaped
+    assert postgres._sql(
+        "SELECT 'why?', \"a?\" -- who?\nFROM t /* ? */ WHERE name LIKE '10%' AND id = ?") == (
+        "SELECT 'why?', \"a?\" -- who?\nFROM t /* ? */ WHERE name LIKE '10%%' AND id = %s")
+    assert postgres._sql("SELECT 'it''s ?', ? % 2") == "SELECT 'it''s ?', %s %% 2"
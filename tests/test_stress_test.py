@@ -0,0 +1,86 @@
+"""Latency statistics and reports of the stress test"""
+
+import pytest
+
+import stress_test
+from stress_test import LatencyHistogram, StatsRecorder
+
+
+def summary_of(latencies, **summary):
+    recorder = StatsRecorder()
+    for action, seconds in latencies.items():
+        for value in seconds:
+            recorder.record_latency(action, value)
+    return {
+        "latency": {action: histogram.summary()
+                    for action, histogram in recorder.latencies.items()},
+        "summary": summary
+    }
+
+
+def test_percentiles_are_within_one_percent():
+    histogram = LatencyHistogram()
+    samples = [ms / 1000 for ms in range(1, 1001)]
+    for seconds in reversed(samples):
+        histogram.record(seconds)
+
+    assert histogram.count == 1000
+    assert histogram.mean() == pytest.approx(0.5005)
+    for pct, exact in [(50, 0.5), (90, 0.9), (99, 0.99), (99.9, 0.999)]:
+        assert histogram.percentile(pct) == pytest.approx(exact, rel=0.01)
+    # Never beyond the slowest sample, even though its bucket reaches further
+    assert histogram.percentile(100) == 1.0
+    assert LatencyHistogram().percentile(50) == 0.0
+
+
+def test_histograms_merge_and_survive_json():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    for ms in range(1, 501):
+        first.record(ms / 1000)
+    for ms in range(501, 1001):
+        second.record(ms / 1000)
+
+    first.merge(LatencyHistogram.from_dict(second.to_dict()))
+    assert first.count == 1000
+    assert (first.min, first.max) == (0.001, 1.0)
+    assert first.percentile(50) == pytest.approx(0.5, rel=0.01)
+
+
+def test_compare_reports_flags_regressions():
+    baseline = summary_of({"auto_save": [0.1] * 100},
+                          error_rate=0.0, requests_per_second=100.0)
+    same = summary_of({"auto_save": [0.105] * 100},
+                      error_rate=0.0, requests_per_second=95.0)
+    assert stress_test.compare_reports(baseline, same, threshold=10) == []
+
+    slower = summary_of({"auto_save": [0.1] * 90 + [0.5] * 10},
+                        error_rate=0.01, requests_per_second=50.0)
+    regressions = stress_test.compare_reports(baseline, slower, threshold=10)
+    assert [regression.split(':')[0] for regression in regressions] == [
+        "Auto-save p99", "Auto-save p99.9", "Error rate", "Requests per second"]
+
+
+def test_teacher_mix():
+    assert stress_test.parse_teacher_mix("submissions=4, export") == {
+        "submissions": 4.0, "export": 1.0}
+    with pytest.raises(ValueError, match="Unknown teacher action"):
+        stress_test.parse_teacher_mix("grades=1")
+
+
+def test_writes_are_split_by_teacher_load(monkeypatch):
+    load = stress_test.ReportingLoad()
+    monkeypatch.setattr(stress_test, 'reporting_load', load)
+    recorder = StatsRecorder()
+
+    snapshot = stress_test.write_load_snapshot()
+    stress_test.record_student_write(recorder, "auto_save", 0.1, snapshot)
+
+    # A teacher request that started and finished during the write counts
+    snapshot = stress_test.write_load_snapshot()
+    load.begin()
+    load.end()
+    stress_test.record_student_write(recorder, "auto_save", 0.3, snapshot)
+
+    assert recorder.latencies["auto_save"].count == 2
+    assert recorder.write_latency["quiet"].max == 0.1
+    assert recorder.write_latency["reporting"].max == 0.3
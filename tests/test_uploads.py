@@ -0,0 +1,45 @@
+"""Content-addressed question images: naming and removing orphaned ones"""
+
+import os
+import time
+
+KEPT = 'a' * 32
+ORPHAN = 'b' * 32
+
+
+def test_upload_hash(app_module):
+    assert app_module._upload_hash(f"{KEPT}.png") == KEPT
+    assert app_module._upload_hash(f"{KEPT}.display.webp") == KEPT
+    assert app_module._upload_hash(f"{KEPT}.thumb.jpg") == KEPT
+    # Uploads named before content addressing, temp files and others
+    for filename in ['diagram.png', f"{KEPT}.other.webp", f"{KEPT}.png.1234.tmp",
+                     f"{KEPT}.txt", f"{'A' * 32}.png", f"{KEPT[:-1]}.png", '.gitkeep']:
+        assert app_module._upload_hash(filename) is None
+
+
+def test_orphaned_uploads_are_collected(database, exam, tmp_path, monkeypatch):
+    exam_id, model_id = exam
+    monkeypatch.setattr(database, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    os.makedirs(database.UPLOAD_FOLDER)
+    with database.get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO questions (exam_id, model_id, question_text, image_filename) "
+            "VALUES (?, ?, 'Q', ?)", (exam_id, model_id, f"{KEPT}.png"))
+        conn.commit()
+
+    old = time.time() - database.IMAGE_ORPHAN_GRACE - 60
+    names = [f"{KEPT}.png", f"{KEPT}.display.webp", f"{ORPHAN}.jpg",
+             f"{ORPHAN}.thumb.jpg", 'legacy.png', '.gitkeep', f"{ORPHAN}.jpg.12.tmp"]
+    for name in names:
+        path = os.path.join(database.UPLOAD_FOLDER, name)
+        with open(path, 'wb') as upload:
+            upload.write(b'image')
+        os.utime(path, (old, old))
+    # Uploaded moments ago, for a question that is not saved yet
+    with open(os.path.join(database.UPLOAD_FOLDER, f"{'c' * 32}.png"), 'wb') as upload:
+        upload.write(b'image')
+
+    assert database.collect_orphan_images() == 2
+    assert sorted(os.listdir(database.UPLOAD_FOLDER)) == sorted(
+        [f"{KEPT}.png", f"{KEPT}.display.webp", 'legacy.png', '.gitkeep',
+         f"{ORPHAN}.jpg.12.tmp", f"{'c' * 32}.png"])
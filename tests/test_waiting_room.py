@@ -0,0 +1,46 @@
+"""The waiting room that queues student logins beyond the concurrency limit"""
+
+from collections import OrderedDict
+
+import pytest
+
+
+@pytest.fixture
+def admission(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'LOGIN_CONCURRENCY', 2)
+    monkeypatch.setattr(app_module, '_logins_in_flight', 0)
+    monkeypatch.setattr(app_module, '_waiting_logins', OrderedDict())
+    return app_module
+
+
+def test_logins_queue_beyond_the_limit(admission):
+    assert admission.admit_login()
+    assert admission.admit_login()
+    assert not admission.admit_login()
+
+    first = admission.queue_login({'student_number': '1'})
+    second = admission.queue_login({'student_number': '2'})
+    assert admission.admit_queued_login(second) == (None, 2)
+    assert admission.admit_queued_login(first) == (None, 1)
+
+    # A free slot goes to the front of the queue
+    admission.release_login()
+    assert admission.admit_queued_login(second) == (None, 2)
+    assert admission.admit_queued_login(first) == ({'student_number': '1'}, None)
+    assert admission.admit_queued_login(first) == (None, None)
+    assert admission.admit_queued_login(second) == (None, 1)
+
+    # Nobody overtakes the queue
+    admission.release_login()
+    assert not admission.admit_login()
+    assert admission.admit_queued_login(second) == ({'student_number': '2'}, None)
+
+
+def test_abandoned_places_are_given_up(admission):
+    admission.admit_login()
+    admission.admit_login()
+    tickets = [admission.queue_login({'student_number': str(n)}) for n in range(3)]
+    admission._waiting_logins[tickets[0]]['checked'] -= admission.WAITING_TIMEOUT + 1
+
+    assert admission.admit_queued_login(tickets[0]) == (None, None)
+    assert admission.admit_queued_login(tickets[2]) == (None, 2)
@@ -0,0 +1,13 @@
+"""
+WSGI entry point for Helwan Exam System
+
+For serving the app with a WSGI server instead of `python app.py`, e.g.
+`waitress-serve --threads 32 wsgi:app`. Starts the background jobs (answer
+checker, maintenance, backups, ...) once. Use a single server process with
+threads: the login queue and auto-save limits live in memory, and each
+process would run its own copy of the background jobs.
+"""
+
+from app import app, start_background_jobs
+
+start_background_jobs()